@@ -1,12 +1,12 @@
 import logging
 import json
 import os
-import time
 import random
 import azure.functions as func
 from openai import AzureOpenAI
 from datetime import datetime
 import requests
+from PortmanTrigger.rate_limit import get_rate_limiter
 
 def cargo_generator(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Cargo Generator function processed a request.')
@@ -55,7 +55,15 @@ def cargo_generator(req: func.HttpRequest) -> func.HttpResponse:
         retry_delay = 5  # Start with 5 seconds
         attempt = 0
         
+        # Shared with other instances so scaling out does not multiply the request rate
+        limiter = get_rate_limiter("openai")
+        
         while attempt < max_retries:
+            if not limiter.acquire():
+                return func.HttpResponse(
+                    "Azure OpenAI service is currently rate limited. Please try again later.",
+                    status_code=429
+                )
             try:
                 cargo_data = generate_cargo_data(imo, port_to_visit, prev_port, client, deployment_name)
                 
@@ -66,10 +74,11 @@ def cargo_generator(req: func.HttpRequest) -> func.HttpResponse:
             except Exception as retry_error:
                 attempt += 1
                 if "429" in str(retry_error) and attempt < max_retries:
-                    # Rate limit hit, exponential backoff
+                    # Rate limit hit, exponential backoff; pausing the shared limiter also holds
+                    # back other requests, and the next acquire() waits for the pause to end
                     retry_delay_with_jitter = retry_delay * (2 ** (attempt - 1)) * (0.8 + 0.4 * random.random())
                     logging.warning(f"Rate limit hit. Retrying in {retry_delay_with_jitter:.2f} seconds. Attempt {attempt} of {max_retries}")
-                    time.sleep(retry_delay_with_jitter)
+                    limiter.block_for(retry_delay_with_jitter)
                 else:
                     # Last attempt or different error
                     if attempt >= max_retries:
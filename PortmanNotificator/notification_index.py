@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import DATABASE_CONFIG
+from PortmanTrigger.db_pool import get_db_connection
+from PortmanTrigger.migrations import ensure_database_schema
+
+def delivery_key(blob_name, version):
+    """Return the 16-byte index key of a blob at a version (its Content-MD5 or ETag)."""
+    return hashlib.blake2b(f"{blob_name}\n{version}".encode("utf-8"), digest_size=16).digest()
+
+def get_delivery_key(blob):
+    """Return the index key of a blob trigger delivery, or None if the blob has no version.
+
+    The version is the Content-MD5 of the blob, so a document regenerated with the same content
+    counts as the same delivery, or else its ETag. Both come with the trigger's blob properties,
+    so the key is known without reading the blob.
+    """
+    properties = getattr(blob, "blob_properties", None) or {}
+    properties = {str(name).lower(): value for name, value in properties.items()}
+    version = properties.get("contentmd5") or properties.get("content_md5") or properties.get("etag")
+    if not version:
+        return None
+    if isinstance(version, (bytes, bytearray)):
+        version = version.hex()
+    return delivery_key(blob.name, version)
+
+class NotificationIndex:
+    """Idempotency index of blob deliveries that already have a notification queued.
+
+    Keys live in the notification_index table until they expire after ttl_seconds, so every
+    instance sees them; the keys this instance has seen recently are also kept in an LRU of up
+    to cache_size entries, which answers repeated deliveries without a database round trip.
+    """
+
+    def __init__(self, ttl_seconds, cache_size):
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> expiry (time.time())
+
+    def seen(self, key):
+        """Return True if a notification was already queued for the delivery key.
+
+        If the index cannot be read the delivery is treated as new.
+        """
+        now = time.time()
+        with self.lock:
+            expires = self._cache.get(key)
+            if expires is not None:
+                if expires > now:
+                    self._cache.move_to_end(key)
+                    return True
+                del self._cache[key]
+
+        conn = None
+        try:
+            ensure_database_schema()
+            conn = get_db_connection(DATABASE_CONFIG["dbname"])
+            if conn is None:
+                raise Exception("Failed to connect to database")
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT EXTRACT(EPOCH FROM expires - CURRENT_TIMESTAMP)
+                FROM notification_index WHERE key = %s AND expires > CURRENT_TIMESTAMP;
+            """, (key,))
+            row = cursor.fetchone()
+            cursor.close()
+        except Exception as e:
+            logging.warning(f"Could not check the notification index: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+        if row is None:
+            return False
+        self.remember(key, float(row[0]))
+        return True
+
+    def record(self, cursor, key):
+        """Add the delivery key in the caller's transaction.
+
+        Returns False if another delivery of the same blob recorded the key first; the caller
+        then rolls back instead of queueing a duplicate.
+        """
+        cursor.execute("""
+            INSERT INTO notification_index (key, expires)
+            VALUES (%s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            ON CONFLICT (key) DO UPDATE SET expires = EXCLUDED.expires
+            WHERE notification_index.expires <= CURRENT_TIMESTAMP
+            RETURNING key;
+        """, (key, float(self.ttl_seconds)))
+        return cursor.fetchone() is not None
+
+    def remember(self, key, ttl_seconds=None):
+        """Keep the delivery key in the LRU, evicting the least recently seen key when full."""
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self.lock:
+            self._cache[key] = time.time() + ttl_seconds
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def evict_expired(self, cursor):
+        """Delete expired keys from the table and return how many were removed."""
+        cursor.execute("DELETE FROM notification_index WHERE expires <= CURRENT_TIMESTAMP;")
+        return max(cursor.rowcount, 0)
+
+    def clear_cache(self):
+        with self.lock:
+            self._cache.clear()
@@ -6,69 +6,53 @@ import azure.functions as func
 from azure.storage.blob import BlobServiceClient, BlobSasPermissions, generate_blob_sas
 from datetime import datetime, timedelta, UTC
 import xml.etree.ElementTree as ET
-import time
-import random
-import threading
-from collections import deque
-
-# Global rate limiting mechanism
-class SlackRateLimiter:
-    def __init__(self, max_calls_per_minute=50):
-        self.max_calls_per_minute = max_calls_per_minute
-        self.lock = threading.Lock()
-        self.call_timestamps = deque()
-        self.retry_after = 0
-        self.last_rate_limit_time = 0
-
-    def wait_if_needed(self):
-        """Wait if we've hit our rate limit or if Slack told us to wait"""
-        current_time = time.time()
-        
-        # First check if Slack told us to wait
-        if current_time < self.last_rate_limit_time + self.retry_after:
-            wait_time = (self.last_rate_limit_time + self.retry_after) - current_time
-            logging.info(f"Waiting {wait_time:.2f}s due to previous rate limit from Slack")
-            time.sleep(wait_time)
-        
-        with self.lock:
-            # Remove timestamps older than 1 minute
-            current_time = time.time()
-            while self.call_timestamps and self.call_timestamps[0] < current_time - 60:
-                self.call_timestamps.popleft()
-            
-            # If we've reached our limit, wait until we can make another call
-            if len(self.call_timestamps) >= self.max_calls_per_minute:
-                # Calculate how long to wait
-                oldest_timestamp = self.call_timestamps[0]
-                wait_time = oldest_timestamp + 60 - current_time
-                if wait_time > 0:
-                    logging.info(f"Rate limiting ourselves: waiting {wait_time:.2f}s before sending to Slack")
-                    time.sleep(wait_time)
-                    # Recalculate current time after waiting
-                    current_time = time.time()
-            
-            # Record this call
-            self.call_timestamps.append(current_time)
-    
-    def update_retry_after(self, retry_seconds):
-        """Update the retry_after value based on Slack's response"""
-        with self.lock:
-            self.retry_after = max(self.retry_after, retry_seconds)
-            self.last_rate_limit_time = time.time()
-
-# Create the rate limiter instance (one per function app instance)
-# Slack's rate limit is typically around 1 message per second,
-# so setting our limit to a bit below that to be safe
-slack_rate_limiter = SlackRateLimiter(max_calls_per_minute=60)
-
-# Import the shared blob utility function
+from xml.parsers import expat
+from config import DATABASE_CONFIG, SLACK_NOTIFICATION_CONFIG
+from PortmanTrigger.db_pool import get_db_connection
+from PortmanTrigger.metrics import increment, observe, run_metrics, stage_timer
+from PortmanTrigger.migrations import ensure_database_schema
+from PortmanTrigger.rate_limit import get_rate_limiter, parse_retry_after
+from PortmanNotificator.notification_index import NotificationIndex, get_delivery_key
+
+# Cluster-wide Slack budget (one bucket shared by all function app instances)
+slack_rate_limiter = get_rate_limiter("slack")
+
+# Blob deliveries already queued, so repeated trigger deliveries of a blob are dropped
+notification_index = NotificationIndex(
+    SLACK_NOTIFICATION_CONFIG["dedupe_ttl_seconds"],
+    SLACK_NOTIFICATION_CONFIG["dedupe_cache_size"]
+)
+
+# Message header per XML type: (emoji, title, time label)
+MESSAGE_TYPES = {
+    "NOA": ("📢", "Notice of pre arrival", "ETA"),
+    "VID": ("🆔", "Request for Visit ID received", "ETA"),
+    "ATA": ("🚢", "New port arrival detected", "ATA")
+}
+
+# Import the shared blob utility functions
 try:
-    from PortmanTrigger.blob_utils import generate_blob_storage_link
+    from PortmanTrigger.blob_utils import (
+        NOTIFICATION_METADATA_KEY,
+        decode_blob_metadata,
+        generate_blob_storage_link,
+        get_blob_metadata
+    )
 except ImportError:
     try:
         # Try alternative import path
-        from blob_utils import generate_blob_storage_link
+        from blob_utils import (
+            NOTIFICATION_METADATA_KEY,
+            decode_blob_metadata,
+            generate_blob_storage_link,
+            get_blob_metadata
+        )
     except ImportError:
+        # Without the shared utilities notification fields are always parsed from the XML
+        NOTIFICATION_METADATA_KEY = None
+        decode_blob_metadata = None
+        get_blob_metadata = None
+
         # If import fails, keep the local implementation
         def generate_blob_storage_link(blob_name, connection_string=None):
             """Generate a URL with SAS token to access the blob directly."""
@@ -113,53 +97,156 @@ except ImportError:
                 logging.error(f"Error generating blob storage link: {e}")
                 return ""
 
+def get_xml_type(blob_name):
+    """Return the XML type (ATA, NOA or VID) of a blob from its name, or None for other blobs."""
+    prefix = os.path.basename(blob_name)[:4]
+    return {"ATA_": "ATA", "NOA_": "NOA", "VID_": "VID"}.get(prefix)
+
 def blob_trigger(blob: func.InputStream):
+    """Queue a Slack notification for a new EMSWe XML blob.
+
+    The notification is sent by slack_outbox_trigger, which coalesces events into digests and
+    keeps within the Slack budget, so this function never waits on Slack. Blob triggers are
+    delivered at least once, so a blob version that already has a notification queued (or an
+    error reported) is skipped before the blob is read.
+    """
     logging.info(f"Python blob trigger function processed blob: {blob.name}")
 
     # Check if blob name matches expected format (starts with ATA_, NOA_, or VID_)
-    blob_basename = os.path.basename(blob.name)
-    if not (blob_basename.startswith("ATA_") or blob_basename.startswith("NOA_") or blob_basename.startswith("VID_")):
+    xml_type = get_xml_type(blob.name)
+    if xml_type is None:
         logging.info(f"Blob {blob.name} does not match expected naming pattern (ATA_*, NOA_*, or VID_*). Skipping notification.")
         return
 
     # Check if notifications are enabled
-    if os.environ.get("SLACK_WEBHOOK_ENABLED", "false").lower() == "false":
+    if not SLACK_NOTIFICATION_CONFIG["enabled"]:
         logging.info("Slack webhook is disabled, skipping notification")
         return
-    
-    webhook_url = os.environ["SLACK_WEBHOOK_URL"]
-    channel = os.environ.get("SLACK_CHANNEL")
-    username = "Portman Bot"
+
+    key = get_delivery_key(blob)
+    if key is not None and notification_index.seen(key):
+        logging.info(f"Notification for blob {blob.name} was already queued, skipping duplicate delivery")
+        return
+
+    port = None
     try:
-        # Read the blob content
-        blob_content = blob.read().decode('utf-8')
-
-        # Determine XML type based on blob name
-        if blob_basename.startswith("NOA_"):
-            xml_type = "NOA"
-        elif blob_basename.startswith("VID_"):
-            xml_type = "VID"
+        metadata = get_notification_metadata(blob)
+        if metadata is not None:
+            info = extract_info_from_metadata(metadata, xml_type)
         else:
-            xml_type = "ATA"
-        
-        # Parse the XML to extract information
-        port_call_id, time_value, remarks, _, passengers_count, crew_count = extract_info_from_xml(blob_content, xml_type)
+            # Documents stored without notification metadata: read and parse the XML
+            blob_content = blob.read().decode('utf-8')
+            info = extract_info_from_xml(blob_content, xml_type)
+        port_call_id, time_value, remarks, _, passengers_count, crew_count, port = info
+        event = {
+            "kind": "notification",
+            "port_call_id": port_call_id,
+            "time_value": time_value,
+            "remarks": remarks,
+            "passengers_count": passengers_count,
+            "crew_count": crew_count
+        }
+    except Exception as e:
+        logging.error(f"Error processing blob {blob.name}: {str(e)}")
+        event = {"kind": "error", "error": str(e)}
 
-        # Generate a URL with SAS token to access the blob directly
-        blob_url = generate_blob_storage_link(blob.name)
+    queue_notification(blob.name, xml_type, port, event, key)
 
-        # Send notification to Slack with XML content
-        send_slack_notification(webhook_url, blob.name, port_call_id, time_value, remarks, blob_content, channel, username, blob_url, passengers_count, crew_count)
+def queue_notification(blob_name, xml_type, port, event, delivery_key=None):
+    """Add a notification event to the slack_outbox table.
 
-        logging.info(f"Successfully processed and notified about {xml_type} for {port_call_id}")
+    The event becomes due after the digest window, so events for the same port arriving close
+    together are sent as one message. With a delivery_key, the key is added to the notification
+    index in the same transaction and the event is not queued if the key is already there. If
+    the queue is not reachable, the event is sent right away when the budget allows it. Returns
+    True if the event was queued.
+    """
+    conn = None
+    try:
+        ensure_database_schema()
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        if conn is None:
+            raise Exception("Failed to connect to database")
+        cursor = conn.cursor()
+        if delivery_key is not None and not notification_index.record(cursor, delivery_key):
+            conn.rollback()
+            cursor.close()
+            notification_index.remember(delivery_key)
+            logging.info(f"Notification for blob {blob_name} was already queued, skipping duplicate delivery")
+            return False
+        cursor.execute("""
+            INSERT INTO slack_outbox (blob_name, xml_type, port, payload, next_attempt_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s));
+        """, (blob_name, xml_type, port, json.dumps(event), SLACK_NOTIFICATION_CONFIG["digest_window_seconds"]))
+        conn.commit()
+        cursor.close()
+        if delivery_key is not None:
+            notification_index.remember(delivery_key)
+        logging.info(f"Queued {xml_type} Slack notification for {blob_name}")
+        return True
+    except Exception as e:
+        logging.error(f"Could not queue Slack notification for {blob_name}: {e}")
+        if slack_rate_limiter.try_acquire():
+            status, _ = post_slack_message(build_message([(None, blob_name, xml_type, port, event, 0, None)]))
+            if status != 200:
+                logging.error(f"Slack notification for {blob_name} was lost: {status}")
+        else:
+            logging.error(f"Slack budget used up; notification for {blob_name} was lost")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()
 
+def get_notification_metadata(blob):
+    """Return the notification fields the XML converter stored as blob metadata, or None.
+
+    The metadata normally comes with the trigger; if the host does not pass it, it is read
+    from the blob properties, which does not download the blob.
+    """
+    if decode_blob_metadata is None:
+        return None
+    try:
+        metadata = getattr(blob, "metadata", None)
+        if metadata is not None:
+            metadata = decode_blob_metadata(metadata)
+        else:
+            container_name, _, blob_path = blob.name.partition('/')
+            metadata = get_blob_metadata(container_name, blob_path)
     except Exception as e:
-        logging.error(f"Error processing blob {blob.name}: {str(e)}")
-        # Send error notification to Slack
-        send_slack_error(webhook_url, blob.name, str(e), channel, username)
+        logging.warning(f"Could not read metadata of blob {blob.name}: {e}")
+        return None
+    if metadata.get(NOTIFICATION_METADATA_KEY) != "1":
+        return None
+    return metadata
+
+def format_vid_remarks(vessel_name, imo, mmsi, port):
+    return f"Vessel: {vessel_name}\nIMO: {imo}\nMMSI: {mmsi}\nDestination: {port or 'Unknown'}"
+
+def extract_info_from_metadata(metadata, xml_type="ATA"):
+    """Return the values extract_info_from_xml gives, from the notification fields in blob metadata."""
+    port_call_id = metadata.get("port_call_id", "Unknown")
+    time_value = metadata.get("time_value", "Unknown")
+    port = metadata.get("port")
+    passengers_count = "N/A"
+    crew_count = "N/A"
+
+    if xml_type == "VID":
+        remarks = format_vid_remarks(
+            metadata.get("vessel_name") or "Unknown Vessel", metadata.get("imo", "N/A"), metadata.get("mmsi", "N/A"), port
+        )
+    else:
+        remarks = metadata.get("remarks", "Unknown")
+        if xml_type == "NOA":
+            passengers_count = metadata.get("passengers_count", "N/A")
+            crew_count = metadata.get("crew_count", "N/A")
+
+    return port_call_id, time_value, remarks, xml_type, passengers_count, crew_count, port
 
 def extract_info_from_xml(xml_content, xml_type="ATA"):
-    """Extract information from the XML based on type (ATA, NOA, or VID)."""
+    """Extract information from the XML based on type (ATA, NOA, or VID).
+
+    Returns (port_call_id, time_value, remarks, xml_type, passengers_count, crew_count, port).
+    """
     try:
         # Register namespaces - include ATA, NOA, and VID namespaces
         namespaces = {
@@ -179,9 +266,10 @@ def extract_info_from_xml(xml_content, xml_type="ATA"):
             port_call_id_element = root.find('.//mai:SpecifiedLogisticsTransportMovement/ram:CallTransportEvent/ram:ID', namespaces)
             port_call_id = port_call_id_element.text if port_call_id_element is not None else "Unknown"
         
-        # Initialize passenger and crew counts
+        # Initialize passenger and crew counts and the port (used to group digest messages)
         passengers_count = "N/A"
         crew_count = "N/A"
+        port = None
         
         # Extract time, remarks, and counts based on XML type
         if xml_type == "ATA":
@@ -195,6 +283,12 @@ def extract_info_from_xml(xml_content, xml_type="ATA"):
             # Extract remarks from the ATA part
             remarks_element = root.find('.//ata:ExchangedDocument/ram:Remarks', namespaces)
             remarks = remarks_element.text if remarks_element is not None else "Unknown"
+
+            port_element = root.find('.//ata:SpecifiedLogisticsTransportMovement' +
+                                     '/ram:ArrivalTransportEvent' +
+                                     '/ram:OccurrenceLogisticsLocation' +
+                                     '/ram:ID', namespaces)
+            port = port_element.text if port_element is not None else None
             
         elif xml_type == "NOA":
             # For NOA XML, extract ETA (estimated time of arrival)
@@ -207,6 +301,13 @@ def extract_info_from_xml(xml_content, xml_type="ATA"):
             # Extract remarks from the NOA part
             remarks_element = root.find('.//noa:ExchangedDocument/ram:Remarks', namespaces)
             remarks = remarks_element.text if remarks_element is not None else "Unknown"
+
+            port_element = root.find('.//noa:SpecifiedLogisticsTransportMovement' +
+                                     '/ram:ItineraryTransportRoute' +
+                                     '/ram:ItineraryStopTransportEvent' +
+                                     '/ram:OccurrenceLogisticsLocation' +
+                                     '/ram:ID', namespaces)
+            port = port_element.text if port_element is not None else None
             
             # Extract passenger and crew counts for NOA XML
             try:
@@ -246,7 +347,7 @@ def extract_info_from_xml(xml_content, xml_type="ATA"):
             
             # Extract port location
             port_element = root.find('.//vid:SpecifiedLogisticsTransportMovement/ram:CallTransportEvent/ram:OccurrenceLogisticsLocation/ram:ID', namespaces)
-            port = port_element.text if port_element is not None else "Unknown"
+            port = port_element.text if port_element is not None else None
             
             # Look for document ID from MAI part for VID
             doc_id_element = root.find('.//mai:ExchangedDocument/ram:ID', namespaces)
@@ -256,137 +357,535 @@ def extract_info_from_xml(xml_content, xml_type="ATA"):
             port_call_id = doc_id
             
             # Create a custom remarks string for VID with vessel info
-            remarks = f"Vessel: {vessel_name}\nIMO: {imo}\nMMSI: {mmsi}\nDestination: {port}"
+            remarks = format_vid_remarks(vessel_name, imo, mmsi, port)
         
-        return port_call_id, time_value, remarks, xml_type, passengers_count, crew_count
+        return port_call_id, time_value, remarks, xml_type, passengers_count, crew_count, port
     
     except Exception as e:
         logging.error(f"Error parsing {xml_type} XML: {str(e)}")
-        return "Unknown", "Unknown", "Unknown", xml_type, "Unknown", "Unknown"
-
-def send_slack_notification(webhook_url, blob_name, port_call_id, time_value, remarks, xml_content, channel, username, blob_url, passengers_count="N/A", crew_count="N/A"):
-    """Send a notification to Slack about the new arrival, notification of arrival, or request for visit ID XML."""
-    # Determine the XML type
-    if "NOA_" in blob_name:
-        xml_type = "NOA"
-        emoji = "📢"
-        title = "Notice of pre arrival"
-        time_label = "ETA"
-    elif "VID_" in blob_name:
-        xml_type = "VID"
-        emoji = "🆔"
-        title = "Request for Visit ID received"
-        time_label = "ETA"
-    else:
-        xml_type = "ATA"
-        emoji = "🚢"
-        title = "New port arrival detected"
-        time_label = "ATA"
-    
-    logging.info(f"Preparing Slack notification for {blob_name} with port_call_id {port_call_id} and {time_label} {time_value}")
+        return "Unknown", "Unknown", "Unknown", xml_type, "Unknown", "Unknown", None
+
+def build_event_text(xml_type, event):
+    """Return the mrkdwn text describing one notification event."""
+    _, _, time_label = MESSAGE_TYPES[xml_type]
+    time_value = event.get("time_value")
+    remarks = event.get("remarks")
+    passengers_count = event.get("passengers_count", "N/A")
+    crew_count = event.get("crew_count", "N/A")
 
     # Create the message text based on XML type
     if xml_type == "VID":
         # For VID, the remarks already contain formatted vessel info and we don't include Document ID
         message_text = f"*{time_label}:* {time_value}\n\n{remarks}"
     else:
-        message_text = f"*Visit ID:* {port_call_id}\n*{time_label}:* {time_value}\n\n{remarks}"
-    
+        message_text = f"*Visit ID:* {event.get('port_call_id')}\n*{time_label}:* {time_value}\n\n{remarks}"
+
     # Add passenger and crew counts for NOA messages
     if xml_type == "NOA":
         # Add passenger count if available
         if passengers_count != "N/A":
             message_text += f"\n\n*Passengers:* {passengers_count}"
-        
+
         # Add crew count if available
         if crew_count != "N/A":
             message_text += f"\n*Crew:* {crew_count}"
-        
+
         # If we have both counts, show the total
         if passengers_count != "N/A" and crew_count != "N/A":
             try:
                 total = int(passengers_count) + int(crew_count)
                 message_text += f"\n*Total persons:* {total}"
-            except ValueError:
+            except (TypeError, ValueError):
                 # Skip adding total if conversion fails
                 pass
+    return message_text
 
-    # Create a message for Slack with XML content
-    message = {
-        "channel": channel,
-        "username": username,
-        "blocks": [
+def build_file_context(blob_name, blob_url):
+    return {
+        "type": "context",
+        "elements": [
             {
+                "type": "mrkdwn",
+                "text": f"File: `{blob_name}`" + (f" | <{blob_url}| Download>" if blob_url else "")
+            }
+        ]
+    }
+
+def build_message(rows):
+    """Build the Slack message for one queued event or a digest of several.
+
+    rows are slack_outbox rows (id, blob_name, xml_type, port, payload, attempts, created).
+    """
+    config = SLACK_NOTIFICATION_CONFIG
+    if len(rows) == 1:
+        _, blob_name, xml_type, _, event, _, _ = rows[0]
+        blob_url = generate_blob_storage_link(blob_name)
+        if event.get("kind") == "error":
+            blocks = [{
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": f"{emoji} *{title}* {emoji}"
+                    "text": f"⚠️ *Error processing arrival XML file: `{blob_name}`*\n" + (f" | <{blob_url}| Download>" if blob_url else "") + f"\n\nError message:\n```{event.get('error')}```"
                 }
-            },
-            {
+            }]
+        else:
+            emoji, title, _ = MESSAGE_TYPES[xml_type]
+            blocks = [
+                {"type": "section", "text": {"type": "mrkdwn", "text": f"{emoji} *{title}* {emoji}"}},
+                {"type": "section", "text": {"type": "mrkdwn", "text": build_event_text(xml_type, event)}},
+                build_file_context(blob_name, blob_url)
+            ]
+    else:
+        port = rows[0][3] or "unknown port"
+        blocks = [{
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": f"📬 *{len(rows)} port call updates for {port}*"}
+        }]
+        for _, blob_name, xml_type, _, event, _, _ in rows:
+            emoji, title, _ = MESSAGE_TYPES[xml_type]
+            blocks.append({"type": "divider"})
+            blocks.append({
                 "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": message_text
-                }
-            },
-            {
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"File: `{blob_name}`" + (f" | <{blob_url}| Download>" if blob_url else "")
-                    }
-                ]
-            }
-        ]
-    }
+                "text": {"type": "mrkdwn", "text": f"{emoji} *{title}*\n{build_event_text(xml_type, event)}"}
+            })
+            blocks.append(build_file_context(blob_name, generate_blob_storage_link(blob_name)))
 
+    message = {"username": config["username"], "blocks": blocks}
     # Only add channel if it was provided
-    if channel:
-        message["channel"] = channel
-    
-    # Use the rate limiter to control our sending rate
-    slack_rate_limiter.wait_if_needed()
-    
-    # Send the message to Slack
-    response = requests.post(
-        webhook_url,
-        data=json.dumps(message),
-        headers={"Content-Type": "application/json"}
-    )
-    
-    if response.status_code == 200:
-        logging.info(f"Successfully sent Slack notification for {blob_name}")
-    elif response.status_code == 429:
-        # Extract retry_after if available in response
-        retry_after = 1  # Default to 1 second
-        try:
-            response_data = response.json()
-            if "retry_after" in response_data:
-                retry_after = float(response_data["retry_after"])
-                # Update the global rate limiter with this information
-                slack_rate_limiter.update_retry_after(retry_after)
-        except (ValueError, KeyError, json.JSONDecodeError):
-            pass
-        
-        logging.error(f"Rate limited by Slack: {response.status_code}, {response.text}")
-    else:
+    if config["channel"]:
+        message["channel"] = config["channel"]
+    return message
+
+def post_slack_message(message):
+    """Post a message to the Slack webhook once, without waiting for the budget.
+
+    Returns (status_code, retry_after); retry_after is the number of seconds Slack asked us to
+    wait on a 429 response, else None. Connection errors are reported as status None.
+    """
+    try:
+        response = requests.post(
+            SLACK_NOTIFICATION_CONFIG["webhook_url"],
+            data=json.dumps(message),
+            headers={"Content-Type": "application/json"},
+            timeout=SLACK_NOTIFICATION_CONFIG["timeout"]
+        )
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error sending to Slack: {e}")
+        return None, None
+
+    if response.status_code == 429:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"), default=1)
+        logging.warning(f"Rate limited by Slack, retry after {retry_after}s")
+        return response.status_code, retry_after
+    if response.status_code != 200:
         logging.error(f"Error sending to Slack: {response.status_code}, {response.text}")
+    return response.status_code, None
+
+def claim_notifications(conn, batch_size, stale_after_seconds, max_attempts):
+    """Claim up to batch_size due notifications and mark them as processing.
+
+    Notifications left in 'processing' for longer than stale_after_seconds (e.g. by a crashed
+    worker) are claimed again, unless they have used up max_attempts; those are marked failed
+    so a message that keeps crashing the sender is not claimed forever. SKIP LOCKED lets
+    several senders drain the queue concurrently.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE slack_outbox SET
+            status = 'failed',
+            last_error = 'Sending did not finish',
+            modified = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM slack_outbox
+            WHERE status = 'processing'
+              AND modified < CURRENT_TIMESTAMP - make_interval(secs => %s)
+              AND attempts >= %s
+            FOR UPDATE SKIP LOCKED
+        );
+    """, (stale_after_seconds, max_attempts))
+    cursor.execute("""
+        UPDATE slack_outbox SET
+            status = 'processing',
+            attempts = attempts + 1,
+            modified = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM slack_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'processing' AND modified < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                   AND attempts < %s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, blob_name, xml_type, port, payload, attempts, created;
+    """, (stale_after_seconds, max_attempts, batch_size))
+    rows = sorted(cursor.fetchall(), key=lambda row: row[0])
+    conn.commit()
+    cursor.close()
+    return rows
+
+def group_notifications(rows, max_events):
+    """Group claimed notifications into messages.
+
+    Events for the same port become one digest of at most max_events events, in queue order.
+    Error notifications are always sent on their own.
+    """
+    groups = {}
+    for row in rows:
+        key = ("error", row[0]) if row[4].get("kind") == "error" else ("port", row[3])
+        group = groups.setdefault(key, [[]])
+        if len(group[-1]) >= max_events:
+            group.append([])
+        group[-1].append(row)
+    return [chunk for chunks in groups.values() for chunk in chunks]
+
+def get_queue_stats(cursor):
+    """Return the number of queued notifications and the age in seconds of the oldest one."""
+    cursor.execute("""
+        SELECT COUNT(*), COALESCE(EXTRACT(EPOCH FROM LOCALTIMESTAMP - MIN(created)), 0)
+        FROM slack_outbox WHERE status IN ('pending', 'processing');
+    """)
+    depth, oldest = cursor.fetchone()
+    return int(depth), float(oldest)
+
+def record_notification_results(cursor, sent_ids, retries, max_attempts, retry_backoff_seconds):
+    """Mark sent notifications and reschedule the others.
+
+    retries is a list of (row, delay, error) for notifications that were not sent; delay None
+    means the send failed and is retried with exponential backoff (or marked failed after
+    max_attempts), otherwise the notification was deferred (budget or a 429) and is re-queued
+    after delay seconds without counting as an attempt. Returns the send latencies in seconds.
+    """
+    latencies = []
+    if sent_ids:
+        cursor.execute("""
+            UPDATE slack_outbox SET
+                status = 'sent',
+                last_error = NULL,
+                sent_at = LOCALTIMESTAMP,
+                modified = CURRENT_TIMESTAMP
+            WHERE id = ANY(%s::integer[])
+            RETURNING EXTRACT(EPOCH FROM sent_at - created);
+        """, (sent_ids,))
+        latencies = [float(latency) for (latency,) in cursor.fetchall()]
+
+    ids, statuses, refunds, errors, delays = [], [], [], [], []
+    for row, delay, error in retries:
+        attempts = row[5]
+        ids.append(row[0])
+        errors.append(error)
+        if delay is not None:
+            statuses.append("pending")
+            refunds.append(1)
+            delays.append(float(delay))
+        else:
+            statuses.append("failed" if attempts >= max_attempts else "pending")
+            refunds.append(0)
+            delays.append(float(retry_backoff_seconds * 2 ** (attempts - 1)))
+    if ids:
+        cursor.execute("""
+            UPDATE slack_outbox o SET
+                status = r.status,
+                attempts = o.attempts - r.refund,
+                last_error = r.error,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => r.delay),
+                modified = CURRENT_TIMESTAMP
+            FROM unnest(%s::integer[], %s::text[], %s::integer[], %s::text[], %s::float8[])
+                AS r(id, status, refund, error, delay)
+            WHERE o.id = r.id;
+        """, (ids, statuses, refunds, errors, delays))
+    return latencies
+
+def dispatch_slack_outbox(batch_size=None):
+    """Send queued Slack notifications, coalescing events for the same port into digests.
+
+    Sending stops (leaving the rest queued) as soon as the per-minute budget is used up or Slack
+    answers 429, so the function never sleeps. Queue depth and send latency are recorded in the
+    run metrics. Returns totals of sent, deferred, retrying and failed notifications.
+    """
+    config = SLACK_NOTIFICATION_CONFIG
+    batch_size = batch_size or config["batch_size"]
+    totals = {"sent": 0, "messages": 0, "deferred": 0, "retrying": 0, "failed": 0}
+
+    with run_metrics("slack_outbox"):
+        ensure_database_schema()
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        if conn is None:
+            logging.error("Failed to connect to database when dispatching Slack notifications")
+            return totals
+
+        try:
+            cursor = conn.cursor()
+            depth, oldest = get_queue_stats(cursor)
+            evicted = notification_index.evict_expired(cursor)
+            conn.commit()
+            cursor.close()
+            increment("index_keys_evicted", evicted)
+            observe("queue_depth", depth)
+            observe("queue_oldest_seconds", oldest)
+
+            stopped = False
+            while not stopped:
+                with stage_timer("claim"):
+                    rows = claim_notifications(
+                        conn, batch_size, config["stale_after_seconds"], config["max_attempts"]
+                    )
+                if not rows:
+                    break
+
+                sent_ids, retries = [], []
+                for group in group_notifications(rows, config["max_digest_events"]):
+                    if stopped or not slack_rate_limiter.try_acquire():
+                        stopped = True
+                        delay = slack_rate_limiter.seconds_until_available()
+                        retries.extend((row, delay, None) for row in group)
+                        continue
+                    with stage_timer("send"):
+                        status, retry_after = post_slack_message(build_message(group))
+                    if status == 200:
+                        sent_ids.extend(row[0] for row in group)
+                        totals["messages"] += 1
+                    elif status == 429:
+                        # Re-queue instead of dropping, and leave the rest for a later run
+                        slack_rate_limiter.block_for(retry_after)
+                        stopped = True
+                        retries.extend((row, retry_after, "Rate limited by Slack") for row in group)
+                    else:
+                        retries.extend((row, None, f"Slack responded {status}") for row in group)
+
+                cursor = conn.cursor()
+                with stage_timer("record"):
+                    latencies = record_notification_results(
+                        cursor, sent_ids, retries, config["max_attempts"], config["retry_backoff_seconds"]
+                    )
+                conn.commit()
+                cursor.close()
+
+                for latency in latencies:
+                    observe("send_latency_seconds", latency)
+                totals["sent"] += len(sent_ids)
+                for row, delay, _ in retries:
+                    if delay is not None:
+                        totals["deferred"] += 1
+                    elif row[5] >= config["max_attempts"]:
+                        totals["failed"] += 1
+                    else:
+                        totals["retrying"] += 1
+        finally:
+            conn.close()
+
+        for name, value in totals.items():
+            increment(f"notifications_{name}" if name != "messages" else "messages_sent", value)
+
+    logging.info(f"Slack outbox dispatch complete. Sent {totals['sent']} notifications in {totals['messages']} messages, "
+                 f"deferred: {totals['deferred']}, retrying: {totals['retrying']}, failed: {totals['failed']}")
+    return totals
+
+def slack_outbox_trigger(slackTimer: func.TimerRequest) -> None:
+    logging.info("Slack outbox trigger function processed a request.")
+
+    dispatch_slack_outbox()
+
+class _DisplayBudgetReached(Exception):
+    """Raised by the display formatter once it has produced more than the character budget."""
+
+class _UnsupportedXML(Exception):
+    """Raised by the display formatter for documents it leaves to minidom (DOCTYPE declarations)."""
+
+class XMLDisplayFormatter:
+    """Streaming equivalent of minidom's toprettyxml(indent="  ") without the empty lines.
+
+    The document is parsed incrementally with expat and each node is written as soon as it is
+    known how minidom would lay it out (an element whose only child is text or CDATA is kept on
+    one line), so no tree or full copy is built. Parsing stops once more than max_length
+    characters have been produced, which makes the cost proportional to the output. Malformed
+    content after that point is not detected.
+    """
+
+    INDENT = "  "
+    CHUNK_SIZE = 16384
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self.lines = []
+        self.length = -1  # Characters in "\n".join(self.lines)
+        self.line = []
+        self.stack = []  # [qname, indent, state, held child]; state 0: no children yet, 1: holding one text child, 2: open
+        self.text = None  # [kind, pieces] of the text or CDATA node being read
+        self.in_cdata = False
+        self.namespaces = []
+
+    def format(self, xml_content):
+        """Return the formatted document and whether it was cut off at max_length."""
+        parser = expat.ParserCreate(namespace_separator=" ")
+        parser.namespace_prefixes = True
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+        parser.StartDoctypeDeclHandler = self._doctype
+        parser.StartNamespaceDeclHandler = self._start_namespace
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._characters
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        parser.CommentHandler = self._comment
+        parser.ProcessingInstructionHandler = self._processing_instruction
+
+        try:
+            self._write('<?xml version="1.0" ?>\n')
+            for start in range(0, len(xml_content), self.CHUNK_SIZE):
+                parser.Parse(xml_content[start:start + self.CHUNK_SIZE], False)
+            parser.Parse(xml_content[:0], True)
+        except _DisplayBudgetReached:
+            return "\n".join(self.lines), True
+        self._end_line()
+        return "\n".join(self.lines), False
+
+    def _write(self, data):
+        """Collect output by lines, dropping whitespace-only lines like the minidom formatter did."""
+        if "\n" not in data:
+            self.line.append(data)
+            return
+        parts = data.split("\n")
+        self.line.append(parts[0])
+        self._end_line()
+        for part in parts[1:-1]:
+            self.line.append(part)
+            self._end_line()
+        self.line.append(parts[-1])
+
+    def _end_line(self):
+        line = "".join(self.line)
+        self.line = []
+        if line.strip():
+            self.lines.append(line)
+            self.length += len(line) + 1
+            if self.length > self.max_length:
+                raise _DisplayBudgetReached()
+
+    @staticmethod
+    def _escape(data):
+        return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+    @staticmethod
+    def _qualified_name(name):
+        parts = name.split(" ")
+        if len(parts) == 3:
+            return f"{parts[2]}:{parts[1]}"
+        return parts[-1]
+
+    def _write_child(self, kind, data, indent):
+        if kind == "text":
+            self._write(self._escape(indent + data + "\n"))
+        elif kind == "cdata":
+            self._write(f"<![CDATA[{data}]]>")
+        elif kind == "comment":
+            self._write(f"{indent}<!--{data}-->\n")
+        else:
+            self._write(f"{indent}<?{data[0]} {data[1]}?>\n")
+
+    def _open_parent(self):
+        """Write the pending start tag of the current element as one with several children."""
+        parent = self.stack[-1]
+        if parent[2] != 2:
+            self._write(">\n")
+            if parent[2] == 1:
+                self._write_child(*parent[3], parent[1] + self.INDENT)
+                parent[3] = None
+            parent[2] = 2
+        return parent[1] + self.INDENT
+
+    def _add_child(self, kind, data):
+        if not self.stack:
+            self._write_child(kind, data, "")
+            return
+        parent = self.stack[-1]
+        if parent[2] == 0 and kind in ("text", "cdata"):
+            # Held back until the next node shows whether it is the only child
+            parent[2] = 1
+            parent[3] = (kind, data)
+            return
+        self._write_child(kind, data, self._open_parent())
+
+    def _flush_text(self):
+        if self.text is not None:
+            kind, pieces = self.text
+            self.text = None
+            self._add_child(kind, "".join(pieces))
+
+    def _doctype(self, *args):
+        raise _UnsupportedXML()
+
+    def _start_namespace(self, prefix, uri):
+        self.namespaces.append((prefix, uri))
+
+    def _start_element(self, name, attributes):
+        self._flush_text()
+        indent = self._open_parent() if self.stack else ""
+        tag = [indent, "<", self._qualified_name(name)]
+        for prefix, uri in self.namespaces:
+            tag.append(f' xmlns:{prefix}="' if prefix else ' xmlns="')
+            tag.append(self._escape(uri or ""))
+            tag.append('"')
+        self.namespaces = []
+        for i in range(0, len(attributes), 2):
+            tag.append(f' {self._qualified_name(attributes[i])}="{self._escape(attributes[i + 1])}"')
+        self._write("".join(tag))
+        self.stack.append([tag[2], indent, 0, None])
+
+    def _end_element(self, name):
+        self._flush_text()
+        qname, indent, state, held = self.stack.pop()
+        if state == 0:
+            self._write("/>\n")
+        elif state == 1:
+            kind, data = held
+            self._write(">" + (self._escape(data) if kind == "text" else f"<![CDATA[{data}]]>") + f"</{qname}>\n")
+        else:
+            self._write(f"{indent}</{qname}>\n")
+
+    def _characters(self, data):
+        if self.text is None:
+            self.text = ["cdata" if self.in_cdata else "text", [data]]
+        else:
+            self.text[1].append(data)
+
+    def _start_cdata(self):
+        self._flush_text()
+        self.in_cdata = True
+
+    def _end_cdata(self):
+        self._flush_text()
+        self.in_cdata = False
+
+    def _comment(self, data):
+        self._flush_text()
+        self._add_child("comment", data)
+
+    def _processing_instruction(self, target, data):
+        self._flush_text()
+        self._add_child("pi", (target, data))
 
 def format_xml_for_display(xml_content, max_length=2500):
-    """Format XML content for better display in Slack message and limit to max_length."""
+    """Format XML content for better display in Slack message and limit to max_length.
+
+    Not currently called by the notification path: messages are built from the notification
+    fields (build_message) and link to the document instead of including its XML.
+    """
     try:
-        # Try to pretty-print the XML
-        from xml.dom import minidom
-        parsed_xml = minidom.parseString(xml_content)
-        pretty_xml = parsed_xml.toprettyxml(indent="  ")
-        
-        # Remove empty lines that minidom sometimes adds
-        pretty_xml = "\n".join([line for line in pretty_xml.split("\n") if line.strip()])
-        
+        # Pretty-print the XML, stopping once max_length is exceeded
+        try:
+            pretty_xml, truncated = XMLDisplayFormatter(max_length).format(xml_content)
+        except _UnsupportedXML:
+            from xml.dom import minidom
+            pretty_xml = minidom.parseString(xml_content).toprettyxml(indent="  ")
+            # Remove empty lines that minidom sometimes adds
+            pretty_xml = "\n".join([line for line in pretty_xml.split("\n") if line.strip()])
+            truncated = len(pretty_xml) > max_length
+
         # If XML is too long, truncate it
-        if len(pretty_xml) > max_length:
+        if truncated:
             return pretty_xml[:max_length] + "\n... (truncated)"
         return pretty_xml
     except Exception as e:
@@ -395,54 +894,3 @@ def format_xml_for_display(xml_content, max_length=2500):
         if len(xml_content) > max_length:
             return xml_content[:max_length] + "\n... (truncated)"
         return xml_content
-
-def send_slack_error(webhook_url, blob_name, error_message, channel, username):
-    """Send an error notification to Slack."""
-
-    # Generate a blob link even for errors
-    blob_url = generate_blob_storage_link(blob_name)
-
-    message = {
-        "username": username,
-        "blocks": [
-            {
-                "type": "section",
-                "text": {
-                    "type": "mrkdwn",
-                    "text": f"⚠️ *Error processing arrival XML file: `{blob_name}`*\n" + (f" | <{blob_url}| Download>" if blob_url else "") + "\n\nError message:\n```{error_message}```"
-                }
-            }
-        ]
-    }
-
-    # Only add channel if it was provided
-    if channel:
-        message["channel"] = channel
-    
-    # Use the rate limiter to control our sending rate
-    slack_rate_limiter.wait_if_needed()
-    
-    # Send the error message to Slack
-    response = requests.post(
-        webhook_url,
-        data=json.dumps(message),
-        headers={"Content-Type": "application/json"}
-    )
-    
-    if response.status_code == 200:
-        logging.info(f"Successfully sent Slack error notification for {blob_name}")
-    elif response.status_code == 429:
-        # Extract retry_after if available in response
-        retry_after = 1  # Default to 1 second
-        try:
-            response_data = response.json()
-            if "retry_after" in response_data:
-                retry_after = float(response_data["retry_after"])
-                # Update the global rate limiter with this information
-                slack_rate_limiter.update_retry_after(retry_after)
-        except (ValueError, KeyError, json.JSONDecodeError):
-            pass
-        
-        logging.error(f"Rate limited by Slack for error notification: {response.status_code}, {response.text}")
-    else:
-        logging.error(f"Error sending error notification to Slack: {response.status_code}, {response.text}")
\ No newline at end of file
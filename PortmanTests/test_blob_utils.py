@@ -0,0 +1,142 @@
+# Test cases for the PortmanTrigger/blob_utils.py module.
+
+import base64
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, UTC
+from unittest.mock import patch, MagicMock
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from PortmanTrigger.blob_utils import (
+    SasUrlCache,
+    decode_blob_metadata,
+    encode_blob_metadata,
+    generate_blob_storage_link,
+    get_container_client,
+    get_sas_cache_stats,
+    reset_blob_clients,
+    upload_blobs
+)
+
+ACCOUNT_KEY = base64.b64encode(b"portman-test-key").decode()
+CONNECTION_STRING = (
+    f"DefaultEndpointsProtocol=https;AccountName=portmantest;AccountKey={ACCOUNT_KEY};"
+    "EndpointSuffix=core.windows.net"
+)
+
+class TestBlobUtils(unittest.TestCase):
+    def setUp(self):
+        reset_blob_clients()
+
+    def tearDown(self):
+        reset_blob_clients()
+
+    @patch('PortmanTrigger.blob_utils.BlobServiceClient')
+    def test_clients_are_shared_and_container_ensured_once(self, mock_service_client):
+        """Test that storage clients are created once per process and the container is ensured once."""
+        container_client = mock_service_client.from_connection_string.return_value.get_container_client.return_value
+        container_client.create_container.side_effect = ResourceExistsError("exists")
+
+        first = get_container_client("xml", CONNECTION_STRING)
+        second = get_container_client("xml", CONNECTION_STRING)
+
+        self.assertIs(first, second)
+        mock_service_client.from_connection_string.assert_called_once_with(CONNECTION_STRING)
+        container_client.create_container.assert_called_once()
+        container_client.exists.assert_not_called()
+
+    @patch('PortmanTrigger.blob_utils.BlobServiceClient')
+    def test_upload_recreates_missing_container(self, mock_service_client):
+        """Test that an upload recreates a deleted container and retries, and reports failures per blob."""
+        container_client = mock_service_client.from_connection_string.return_value.get_container_client.return_value
+        uploads = {"a.xml": [ResourceNotFoundError("ContainerNotFound"), None], "b.xml": [OSError("timeout")]}
+
+        def get_blob_client(name):
+            blob_client = MagicMock()
+            blob_client.upload_blob.side_effect = uploads[name]
+            return blob_client
+        container_client.get_blob_client.side_effect = get_blob_client
+
+        errors = upload_blobs("xml", [("a.xml", "<a/>"), ("b.xml", "<b/>")], CONNECTION_STRING)
+
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], OSError)
+        # Once when the client is first used and once after the 404
+        self.assertEqual(container_client.create_container.call_count, 2)
+
+    @patch('PortmanTrigger.blob_utils.BlobServiceClient')
+    def test_batches_reuse_the_shared_client(self, mock_service_client):
+        """Test that every batch uploads through the same client with at most max_concurrency threads."""
+        container_client = mock_service_client.from_connection_string.return_value.get_container_client.return_value
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def upload_blob(*args, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+        container_client.get_blob_client.return_value.upload_blob.side_effect = upload_blob
+
+        blobs = [(f"{index}.xml", "<a/>") for index in range(6)]
+        for _ in range(3):
+            self.assertEqual(upload_blobs("xml", blobs, CONNECTION_STRING, max_concurrency=2), [None] * 6)
+
+        mock_service_client.from_connection_string.assert_called_once_with(CONNECTION_STRING)
+        self.assertEqual(container_client.get_blob_client.return_value.upload_blob.call_count, 18)
+        self.assertLessEqual(peak[0], 2)
+
+    @patch('PortmanTrigger.blob_utils.BlobServiceClient')
+    def test_upload_with_metadata(self, mock_service_client):
+        """Test that metadata is stored ASCII-encoded and decodes back to the original text."""
+        container_client = mock_service_client.from_connection_string.return_value.get_container_client.return_value
+        metadata = {"remarks": "Viking Grace -> Åbo\nberth 1", "port": "FITKU"}
+
+        errors = upload_blobs("xml", [("a.xml", "<a/>", metadata)], CONNECTION_STRING)
+
+        self.assertEqual(errors, [None])
+        stored = container_client.get_blob_client.return_value.upload_blob.call_args.kwargs["metadata"]
+        self.assertTrue(all(value.isascii() and "\n" not in value for value in stored.values()))
+        self.assertEqual(decode_blob_metadata({key.upper(): value for key, value in stored.items()}), metadata)
+        self.assertIsNone(encode_blob_metadata({"remarks": "x" * 9000}))
+
+    @patch('PortmanTrigger.blob_utils.BlobServiceClient')
+    def test_generate_link_without_storage_client(self, mock_service_client):
+        """Test that SAS links are generated from the parsed connection string alone."""
+        url = generate_blob_storage_link("xml/NOA_1.xml", CONNECTION_STRING)
+
+        self.assertTrue(url.startswith("https://portmantest.blob.core.windows.net/xml/NOA_1.xml?"))
+        self.assertIn("sig=", url)
+        mock_service_client.from_connection_string.assert_not_called()
+
+    @patch('PortmanTrigger.blob_utils.generate_blob_sas', return_value="sig=test")
+    def test_sas_links_are_cached_per_blob(self, mock_generate_blob_sas):
+        """Test that a signed link is reused for the same blob and signed once per blob."""
+        first = generate_blob_storage_link("xml/NOA_1.xml", CONNECTION_STRING)
+        second = generate_blob_storage_link("xml/NOA_1.xml", CONNECTION_STRING)
+        other = generate_blob_storage_link("xml/ATA_1.xml", CONNECTION_STRING)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(mock_generate_blob_sas.call_count, 2)
+        self.assertEqual(get_sas_cache_stats(), {"hits": 1, "misses": 2, "size": 2})
+
+    def test_sas_cache_expiry_and_eviction(self):
+        """Test that links close to expiry are re-signed and the least recently used link is evicted."""
+        cache = SasUrlCache(max_entries=2, min_remaining=timedelta(hours=24))
+        now = datetime.now(UTC)
+        cache.put("a", "url-a", now + timedelta(days=7))
+        cache.put("b", "url-b", now + timedelta(hours=12))
+
+        self.assertEqual(cache.get("a", now), "url-a")
+        self.assertIsNone(cache.get("b", now))
+        self.assertIsNone(cache.get("a", now + timedelta(days=6, hours=1)))
+
+        cache.put("c", "url-c", now + timedelta(days=7))
+        self.assertIsNone(cache.get("b", now))
+        self.assertEqual(cache.get("c", now), "url-c")
+        self.assertEqual(cache.get_stats(), {"hits": 2, "misses": 3, "size": 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Test cases for the PortmanTrigger/db_pool.py module.
+
+import gc
+import unittest
+from unittest.mock import patch
+from PortmanTrigger import portman
+from PortmanTrigger.db_pool import ConnectionPool, close_connection_pools, get_db_connection
+from config import DATABASE_CONFIG
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(
+            DATABASE_CONFIG["dbname"],
+            min_size=1,
+            max_size=2,
+            max_idle_seconds=300,
+            health_check_interval_seconds=0,
+            acquire_timeout_seconds=0.1
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        close_connection_pools()
+
+    def backend_pid(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_backend_pid();")
+        pid = cursor.fetchone()[0]
+        cursor.close()
+        return pid
+
+    def test_connections_are_reused(self):
+        """Test that closing a pooled connection returns it for reuse with a clean transaction."""
+        conn = self.pool.acquire()
+        pid = self.backend_pid(conn)
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE pool_test (id INTEGER);")
+        conn.close()
+        conn.close()  # Closing twice must not release the connection twice
+
+        conn = self.pool.acquire()
+        self.assertEqual(self.backend_pid(conn), pid)
+        # The uncommitted CREATE TABLE was rolled back when the connection was released
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('pool_test') IS NULL;")
+        self.assertTrue(cursor.fetchone()[0])
+        conn.close()
+
+    def test_max_size_limits_open_connections(self):
+        """Test that acquire() times out once max_size connections are in use."""
+        first, second = self.pool.acquire(), self.pool.acquire()
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire()
+        first.close()
+        third = self.pool.acquire()
+        self.assertIsNotNone(third)
+        second.close()
+        third.close()
+
+    def test_broken_connections_are_replaced(self):
+        """Test that a connection failing its health check is discarded and replaced."""
+        conn, admin = self.pool.acquire(), self.pool.acquire()
+        pid = self.backend_pid(conn)
+        conn.close()
+
+        cursor = admin.cursor()
+        cursor.execute("SELECT pg_terminate_backend(%s);", (pid,))
+        cursor.close()
+
+        # The idle connection fails its health check, so a new one is opened in its place
+        conn = self.pool.acquire()
+        self.assertNotEqual(self.backend_pid(conn), pid)
+        conn.close()
+        admin.close()
+
+    def test_failed_writes_return_their_connection(self):
+        """Test that a failing upsert or XML URL store gives its connection back to the pool."""
+        with patch("PortmanTrigger.portman.get_db_connection", side_effect=lambda _: self.pool.acquire()):
+            with patch("PortmanTrigger.portman.bulk_upsert_voyages", side_effect=Exception("upsert failed")):
+                for _ in range(3):
+                    with self.assertRaises(Exception):
+                        portman.save_results_to_db([{"portCallId": 1}])
+            with patch("PortmanTrigger.portman.request_xml_document", return_value="https://example.com/VID.xml"), \
+                    patch("PortmanTrigger.portman.store_xml_urls", side_effect=Exception("store failed")):
+                for _ in range(3):
+                    self.assertIsNone(portman.create_xml_document("VID", {"portCallId": 1}))
+
+        self.assertEqual(self.pool._size, 1)
+        self.assertEqual(len(self.pool._idle), 1)
+
+    def test_unclosed_connections_are_returned_when_collected(self):
+        """Test that a connection proxy dropped without close() gives its connection back."""
+        conn = self.pool.acquire()
+        del conn
+        gc.collect()
+        self.assertEqual((self.pool._size, len(self.pool._idle)), (1, 1))
+
+    def test_get_db_connection_uses_shared_pool(self):
+        """Test that get_db_connection hands out connections from one process-wide pool."""
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        pid = self.backend_pid(conn)
+        conn.close()
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        self.assertEqual(self.backend_pid(conn), pid)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
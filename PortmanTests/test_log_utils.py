@@ -0,0 +1,49 @@
+# Test cases for the PortmanTrigger/log_utils.py module.
+
+import json
+import logging
+import unittest
+from unittest.mock import patch
+from PortmanTrigger.log_utils import JsonFormatter, log_event, log_payload, parse_module_levels
+
+class TestLogUtils(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("PortmanTests.log_utils")
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        self.logger.setLevel(logging.NOTSET)
+
+    def test_event_fields_are_attached_and_rendered(self):
+        """Test that structured events carry their fields and render as text and JSON."""
+        with self.assertLogs(self.logger, level="INFO") as logs:
+            log_event(self.logger, "arrival_detected", portCallId=123, berthName="viking1")
+
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), "arrival_detected portCallId=123 berthName=viking1")
+        self.assertEqual(record.event_fields, {"portCallId": 123, "berthName": "viking1"})
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["event"], "arrival_detected")
+        self.assertEqual(entry["portCallId"], 123)
+
+    def test_payloads_are_sampled_at_debug_only(self):
+        """Test that payloads are logged for every Nth call and not serialised above DEBUG."""
+        with self.assertLogs(self.logger, level="DEBUG") as logs:
+            logged = [log_payload(self.logger, "test sampled", {"n": i}, sample_every=3) for i in range(7)]
+        self.assertEqual(logged, [True, False, False, True, False, False, True])
+        self.assertEqual(logs.output[1], 'DEBUG:PortmanTests.log_utils:test sampled payload: {"n": 3}')
+
+        self.logger.setLevel(logging.INFO)
+        with patch("PortmanTrigger.log_utils.json.dumps") as mock_dumps:
+            self.assertFalse(log_payload(self.logger, "test disabled", {"n": 0}, sample_every=1))
+        mock_dumps.assert_not_called()
+
+    def test_parse_module_levels(self):
+        """Test parsing of per-logger level overrides."""
+        self.assertEqual(
+            parse_module_levels("PortmanTrigger=debug, PortmanXMLConverter.src=WARNING,broken,=INFO"),
+            {"PortmanTrigger": "DEBUG", "PortmanXMLConverter.src": "WARNING"}
+        )
+
+if __name__ == '__main__':
+    unittest.main()
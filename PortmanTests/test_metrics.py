@@ -0,0 +1,155 @@
+# Test cases for the PortmanTrigger/metrics.py module.
+
+import os
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+from PortmanTrigger import portman
+from PortmanTrigger.metrics import (
+    RunMetrics,
+    current_run,
+    increment,
+    observe,
+    run_metrics,
+    stage_timer,
+    timed_iter,
+    with_run_context
+)
+from PortmanTrigger.xml_client import request_xml_documents
+from config import XML_CONVERTER_CONFIG
+
+class TestMetrics(unittest.TestCase):
+    @patch('PortmanTrigger.metrics.time.perf_counter')
+    def test_nested_stages_are_charged_their_own_time(self, mock_perf_counter):
+        """Test that an outer stage is not charged for the time of the stages nested in it."""
+        # Run start, process start, decode 1.0-2.0 and 3.0-6.0, process end, run end
+        mock_perf_counter.side_effect = [0.0, 0.0, 1.0, 2.0, 3.0, 6.0, 8.0, 10.0]
+        metrics = RunMetrics("test")
+        with metrics.timer("process"):
+            with metrics.timer("decode"):
+                pass
+            with metrics.timer("decode"):
+                pass
+        metrics.finish()
+
+        summary = metrics.summary()
+        self.assertEqual(summary["stages"]["decode"], {"seconds": 4.0, "calls": 2})
+        self.assertEqual(summary["stages"]["process"], {"seconds": 4.0, "calls": 1})
+        self.assertEqual(summary["untimed_seconds"], 2.0)
+
+    @patch('PortmanTrigger.metrics.time.perf_counter')
+    def test_stages_on_worker_threads_nest_separately(self, mock_perf_counter):
+        """Test that a stage timed on another thread does not end or absorb the caller's stage."""
+        # Run start, convert start, upload start (worker), convert end, upload end (worker), run end
+        mock_perf_counter.side_effect = [0.0, 0.0, 1.0, 2.0, 10.0, 10.0]
+        metrics = RunMetrics("test")
+        upload_started, convert_stopped = threading.Event(), threading.Event()
+
+        def upload():
+            with metrics.timer("upload"):
+                upload_started.set()
+                convert_stopped.wait(5)
+
+        worker = threading.Thread(target=upload)
+        with metrics.timer("convert"):
+            worker.start()
+            upload_started.wait(5)
+        convert_stopped.set()
+        worker.join()
+        metrics.finish()
+
+        summary = metrics.summary()
+        self.assertEqual(summary["stages"]["convert"], {"seconds": 2.0, "calls": 1})
+        self.assertEqual(summary["stages"]["upload"], {"seconds": 9.0, "calls": 1})
+
+    def test_stages_on_executor_threads_are_reported(self):
+        """Test that timers and counters used on executor threads are charged to the caller's run."""
+        def work(item):
+            with stage_timer("upload"):
+                increment("uploaded")
+            return item
+
+        with run_metrics("test") as metrics:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                self.assertEqual(list(executor.map(with_run_context(work), range(4))), [0, 1, 2, 3])
+
+        summary = metrics.summary()
+        self.assertEqual(summary["stages"]["upload"]["calls"], 4)
+        self.assertEqual(summary["counters"]["uploaded"], 4)
+
+    def test_xml_conversion_stages_are_reported(self):
+        """Test that converter stages run on the XML client's threads show up in the run summary."""
+        voyage = {"portCallId": 3190880, "imoLloyds": 9606900, "vesselName": "Viking Grace",
+                  "eta": "2024-03-13T10:00:00.000+00:00", "portAreaName": "Matkustajasatama",
+                  "portToVisit": "FITKU"}
+        with patch.dict(XML_CONVERTER_CONFIG, {"transport": "inprocess"}), run_metrics("xml_outbox") as metrics:
+            results = request_xml_documents([("VID", voyage), ("NOA", voyage)], batch_size=1)
+        try:
+            self.assertEqual(metrics.summary()["stages"]["build"]["calls"], 2)
+        finally:
+            for path, _, _ in results:
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def test_helpers_are_no_ops_outside_a_run(self):
+        """Test that timers, counters and iterators do nothing without a run in progress."""
+        items = [1, 2]
+        self.assertIs(timed_iter("decode", items), items)
+        with stage_timer("fetch"):
+            increment("records")
+        self.assertIsNone(current_run())
+
+    @patch('PortmanTrigger.metrics.get_exporter')
+    @patch('PortmanTrigger.metrics.log_event')
+    def test_run_summary_is_logged_and_exported(self, mock_log_event, mock_get_exporter):
+        """Test that a run reports its stages and counters when it ends."""
+        with run_metrics("ingest") as metrics:
+            self.assertIs(current_run(), metrics)
+            self.assertEqual(list(timed_iter("decode", [1, 2, 3])), [1, 2, 3])
+            increment("records", 3)
+        self.assertIsNone(current_run())
+
+        fields = mock_log_event.call_args.kwargs
+        self.assertEqual(mock_log_event.call_args.args[1], "run_summary")
+        self.assertEqual(fields["run"], "ingest")
+        # Three items and the final StopIteration
+        self.assertEqual(fields["decode_calls"], 4)
+        self.assertEqual(fields["records"], 3)
+        mock_get_exporter.return_value.export.assert_called_once_with(metrics)
+
+    @patch('PortmanTrigger.portman.save_results_to_db')
+    def test_ingest_stages(self, mock_save_results):
+        """Test that streaming ingest charges decoding and normalisation to separate stages."""
+        port_calls = ({"portCallId": i, "imoLloyds": 9000000 + i} for i in range(5))
+        with run_metrics("ingest") as metrics:
+            portman.save_port_calls_in_batches(port_calls, batch_size=2)
+
+        summary = metrics.summary()
+        self.assertEqual(summary["stages"]["decode"]["calls"], 6)
+        self.assertEqual(summary["stages"]["process"]["calls"], 4)
+        self.assertEqual(mock_save_results.call_count, 3)
+
+    @patch('PortmanTrigger.metrics.otel_metrics')
+    @patch.dict('PortmanTrigger.metrics.METRICS_CONFIG', {"otel_export": True})
+    def test_opentelemetry_export(self, mock_otel_metrics):
+        """Test that run summaries are recorded on OpenTelemetry instruments."""
+        meter = mock_otel_metrics.get_meter.return_value
+        histograms = {"portman.run.duration": MagicMock(), "portman.stage.duration": MagicMock(),
+                      "portman.pipeline.observation": MagicMock()}
+        meter.create_histogram.side_effect = lambda name, **kwargs: histograms[name]
+        with patch('PortmanTrigger.metrics._exporter', None), patch.dict('os.environ', {"APPLICATIONINSIGHTS_CONNECTION_STRING": ""}):
+            with run_metrics("xml_outbox"):
+                with stage_timer("convert"):
+                    increment("jobs_done", 2)
+                observe("queue_depth", 4)
+
+        histograms["portman.stage.duration"].record.assert_called_once()
+        self.assertEqual(histograms["portman.stage.duration"].record.call_args.args[1],
+                         {"run": "xml_outbox", "stage": "convert"})
+        meter.create_counter.return_value.add.assert_called_once_with(2, {"run": "xml_outbox", "name": "jobs_done"})
+        histograms["portman.pipeline.observation"].record.assert_any_call(
+            4, {"run": "xml_outbox", "name": "queue_depth", "stat": "max"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Test cases for the PortmanTrigger/migrations.py module.
+
+import unittest
+from unittest.mock import patch
+from PortmanTrigger import migrations
+from PortmanTrigger import db_pool
+from PortmanTrigger.db_pool import get_db_connection
+from config import DATABASE_CONFIG
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        migrations.reset_schema_cache()
+        self.conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.cursor.execute("DROP TABLE IF EXISTS migration_test;")
+        self.cursor.execute("DELETE FROM schema_version WHERE version > %s;", (migrations.LATEST_SCHEMA_VERSION,))
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+        migrations.reset_schema_cache()
+
+    def test_apply_migrations_runs_pending_versions_once(self):
+        """Test that only migrations newer than the recorded schema version are applied."""
+        self.assertEqual(migrations.apply_migrations(self.conn), migrations.LATEST_SCHEMA_VERSION)
+
+        extra_version = migrations.LATEST_SCHEMA_VERSION + 1
+        extra = migrations.MIGRATIONS + [
+            (extra_version, "Create test table", ["CREATE TABLE migration_test (id INTEGER);"])
+        ]
+        self.assertEqual(migrations.apply_migrations(self.conn, extra), extra_version)
+        # Re-running would fail on CREATE TABLE if the migration were applied again
+        self.assertEqual(migrations.apply_migrations(self.conn, extra), extra_version)
+
+        self.cursor.execute("SELECT description FROM schema_version WHERE version = %s;", (extra_version,))
+        self.assertEqual(self.cursor.fetchone()[0], "Create test table")
+
+    def test_failed_migration_is_rolled_back(self):
+        """Test that a failing migration leaves neither its changes nor its version behind."""
+        extra_version = migrations.LATEST_SCHEMA_VERSION + 1
+        broken = migrations.MIGRATIONS + [
+            (extra_version, "Broken migration", ["CREATE TABLE migration_test (id INTEGER);", "SELECT no_such_column;"])
+        ]
+        with self.assertRaises(Exception):
+            migrations.apply_migrations(self.conn, broken)
+
+        self.cursor.execute("SELECT to_regclass('migration_test') IS NULL, MAX(version) FROM schema_version;")
+        self.assertEqual(self.cursor.fetchone(), [True, migrations.LATEST_SCHEMA_VERSION])
+
+    def test_create_database_leaves_no_pooled_connection(self):
+        """Test that checking for the database does not keep a connection to the postgres database."""
+        migrations.create_database_if_missing(DATABASE_CONFIG["dbname"])
+        self.assertNotIn("postgres", db_pool._pools)
+
+    def test_ensure_database_schema_is_cached(self):
+        """Test that the schema is checked on the first call of a process only."""
+        with patch("PortmanTrigger.migrations.apply_migrations", wraps=migrations.apply_migrations) as mock_apply:
+            self.assertEqual(migrations.ensure_database_schema(), migrations.LATEST_SCHEMA_VERSION)
+            self.assertEqual(migrations.ensure_database_schema(), migrations.LATEST_SCHEMA_VERSION)
+        self.assertEqual(mock_apply.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,22 @@
 
 import unittest
 import json
+import os
+import subprocess
+import sys
+import tempfile
 import pg8000
+from unittest.mock import patch
 from datetime import datetime, timezone
 from PortmanTrigger.portman import (
     process_query,
     save_results_to_db,
+    bulk_upsert_voyages,
+    read_json_from_directory,
+    get_backfill_workers,
     fetch_data_from_api,
+    get_fetch_state,
+    save_fetch_state,
     get_db_connection
 )
 from config import DATABASE_CONFIG
@@ -89,6 +99,150 @@ class TestPortman(unittest.TestCase):
         self.assertIsNotNone(row)
         self.assertEqual(row[0], "Viking Grace")
 
+    def test_save_results_to_db_change_set(self):
+        """Test that the bulk upsert reports new voyages and ETA/ATA changes."""
+        port_call = dict(self.sample_port_call, portCallId=3190999)
+        self.cursor.execute("DELETE FROM voyages WHERE portCallId = %s", (3190999,))
+        self.cursor.execute("DELETE FROM arrivals WHERE portCallId = %s", (3190999,))
+        self.cursor.execute("DELETE FROM xml_outbox WHERE portCallId = %s", (3190999,))
+        self.conn.commit()
+
+        changes = save_results_to_db(process_query({"portCalls": [port_call]}))
+        self.assertEqual(len(changes), 1)
+        self.assertTrue(changes[0]["is_new"])
+        self.assertFalse(changes[0]["eta_changed"])
+        self.assertFalse(changes[0]["ata_changed"])
+
+        # Re-ingesting the same snapshot produces no changes
+        self.assertEqual(save_results_to_db(process_query({"portCalls": [port_call]})), [])
+
+        area = dict(port_call["portAreaDetails"][0], eta="2024-03-13T11:00:00.000+00:00",
+                    ata="2024-03-13T11:05:42.000+00:00")
+        changes = save_results_to_db(process_query({"portCalls": [dict(port_call, portAreaDetails=[area])]}))
+        self.assertEqual(len(changes), 1)
+        self.assertFalse(changes[0]["is_new"])
+        self.assertTrue(changes[0]["eta_changed"])
+        self.assertTrue(changes[0]["ata_changed"])
+        self.assertEqual(changes[0]["new_ata"], "2024-03-13T11:05:00.000Z")
+
+        self.cursor.execute("SELECT ata FROM arrivals WHERE portCallId = %s", (3190999,))
+        self.assertEqual(self.cursor.fetchall(), ([datetime(2024, 3, 13, 11, 5)],))
+
+    def test_save_results_to_db_skips_unchanged_rows(self):
+        """Test that only port calls whose content hash differs are rewritten."""
+        port_call = dict(self.sample_port_call, portCallId=3190997)
+        self.cursor.execute("DELETE FROM voyages WHERE portCallId = %s", (3190997,))
+        self.cursor.execute("DELETE FROM xml_outbox WHERE portCallId = %s", (3190997,))
+        self.conn.commit()
+
+        save_results_to_db(process_query({"portCalls": [port_call]}))
+        self.cursor.execute("SELECT content_hash, modified FROM voyages WHERE portCallId = %s", (3190997,))
+        first_hash, first_modified = self.cursor.fetchone()
+        self.assertIsNotNone(first_hash)
+
+        results = process_query({"portCalls": [port_call]})
+        self.assertEqual(results[0]["contentHash"], first_hash)
+        changes, counts = bulk_upsert_voyages(self.cursor, results)
+        self.conn.commit()
+        self.assertEqual(changes, [])
+        self.assertEqual(counts, {"new": 0, "changed": 0, "unchanged": 1})
+        self.cursor.execute("SELECT modified FROM voyages WHERE portCallId = %s", (3190997,))
+        self.assertEqual(self.cursor.fetchone()[0], first_modified)
+
+        # A change outside ETA/ATA updates the row without reporting an XML-relevant change
+        changes, counts = bulk_upsert_voyages(self.cursor, process_query({"portCalls": [dict(port_call, nextPort="FIHEL")]}))
+        self.conn.commit()
+        self.assertEqual(changes, [])
+        self.assertEqual(counts, {"new": 0, "changed": 1, "unchanged": 0})
+        self.cursor.execute("SELECT nextPort, content_hash, modified FROM voyages WHERE portCallId = %s", (3190997,))
+        next_port, content_hash, modified = self.cursor.fetchone()
+        self.assertEqual(next_port, "FIHEL")
+        self.assertNotEqual(content_hash, first_hash)
+        self.assertGreater(modified, first_modified)
+
+    def test_read_json_from_directory_parallel_resume(self):
+        """Test that a parallel backfill applies files in natsort order and resumes from checkpoints."""
+        port_call_id = 3190996
+        self.cursor.execute("DELETE FROM voyages WHERE portCallId = %s", (port_call_id,))
+        self.cursor.execute("DELETE FROM arrivals WHERE portCallId = %s", (port_call_id,))
+        self.cursor.execute("DELETE FROM xml_outbox WHERE portCallId = %s", (port_call_id,))
+        self.conn.commit()
+
+        snapshots = {
+            "portnet1.json": ("2024-03-13T10:00:00.000+00:00", None),
+            "portnet2.json": ("2024-03-13T11:00:00.000+00:00", None),
+            "portnet10.json": ("2024-03-13T11:00:00.000+00:00", "2024-03-13T11:07:00.000+00:00")
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for filename, (eta, ata) in snapshots.items():
+                area = dict(self.sample_port_call["portAreaDetails"][0], eta=eta, ata=ata)
+                port_call = dict(self.sample_port_call, portCallId=port_call_id, portAreaDetails=[area])
+                with open(os.path.join(directory, filename), "w", encoding="utf-8") as file:
+                    json.dump({"portCalls": [port_call]}, file)
+            checkpoint_directory = os.path.abspath(directory)
+
+            read_json_from_directory(directory, None, workers=2)
+
+            self.cursor.execute("SELECT eta, ata FROM voyages WHERE portCallId = %s", (port_call_id,))
+            self.assertEqual(self.cursor.fetchone(), [datetime(2024, 3, 13, 11, 0), datetime(2024, 3, 13, 11, 7)])
+            self.cursor.execute(
+                "SELECT formality FROM xml_outbox WHERE portCallId = %s ORDER BY formality", (port_call_id,)
+            )
+            self.assertEqual([row[0] for row in self.cursor.fetchall()], ["ATA", "NOA", "VID"])
+            self.cursor.execute(
+                "SELECT filename FROM backfill_checkpoints WHERE directory = %s ORDER BY filename", (checkpoint_directory,)
+            )
+            self.assertEqual([row[0] for row in self.cursor.fetchall()], ["portnet1.json", "portnet10.json", "portnet2.json"])
+
+            # Imported files are skipped when the backfill is run again
+            with patch("PortmanTrigger.portman.save_results_to_db") as mock_save:
+                read_json_from_directory(directory, None, workers=2)
+            mock_save.assert_not_called()
+
+            self.cursor.execute("DELETE FROM backfill_checkpoints WHERE directory = %s", (checkpoint_directory,))
+            self.conn.commit()
+
+    def test_get_backfill_workers(self):
+        """Test that requested worker counts fall back to the default and are clamped."""
+        with patch.dict("PortmanTrigger.portman.BACKFILL_CONFIG", {"workers": 2, "max_workers": 4}):
+            self.assertEqual(get_backfill_workers(None), 2)
+            self.assertEqual(get_backfill_workers("3"), 3)
+            self.assertEqual(get_backfill_workers("many"), 2)
+            self.assertEqual(get_backfill_workers("1000"), 4)
+            self.assertEqual(get_backfill_workers("0"), 1)
+
+    def test_command_line_workers_are_clamped(self):
+        """Test that --workers given to the command-line entry point is clamped to the maximum."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as directory:
+            result = subprocess.run(
+                [sys.executable, "-m", "PortmanTrigger.portman", "--input-dir", directory, "--workers", "99"],
+                cwd=root, env={**os.environ, "BACKFILL_MAX_WORKERS": "3"},
+                capture_output=True, text=True, timeout=60
+            )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Parsing files with 3 worker processes.", result.stdout + result.stderr)
+
+    def test_fetch_state_high_water_mark(self):
+        """Test that the stored fetch high-water mark only moves forward."""
+        source = "test-port-calls"
+        self.cursor.execute("DELETE FROM fetch_state WHERE source = %s", (source,))
+        self.conn.commit()
+        self.assertEqual(get_fetch_state(source), {"high_water_mark": None, "etag": None, "last_modified": None})
+
+        later = datetime(2024, 3, 13, 10, 0, tzinfo=timezone.utc)
+        save_fetch_state({"high_water_mark": later, "etag": '"v1"', "last_modified": None}, source)
+        save_fetch_state({"high_water_mark": datetime(2024, 3, 12, tzinfo=timezone.utc), "etag": '"v2"',
+                          "last_modified": None}, source)
+
+        state = get_fetch_state(source)
+        self.assertEqual(state["high_water_mark"], later)
+        self.assertEqual(state["etag"], '"v2"')
+
+        self.cursor.execute("DELETE FROM fetch_state WHERE source = %s", (source,))
+        self.conn.commit()
+
     def test_get_db_connection(self):
         """Test database connection to the correct database."""
         conn = get_db_connection(DATABASE_CONFIG["dbname"])
@@ -1,15 +1,35 @@
+import io
+import json
+import os
 import unittest
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 from PortmanTrigger.portman import (
     process_query,
     save_results_to_db,
     fetch_data_from_api,
+    track_high_water_mark,
+    iter_port_calls,
+    save_port_calls_in_batches,
+    iter_port_call_batches,
+    build_voyage_columns,
     get_db_connection
 )
+from PortmanTrigger.db_pool import close_connection_pools
+from PortmanTrigger.rate_limit import TokenBucketLimiter
+from PortmanTrigger.xml_client import request_xml_documents
+from config import XML_CONVERTER_CONFIG
 
 class TestPortmanMockDb(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures before each test method."""
+        # Pooled connections would bypass the patched pg8000.connect
+        close_connection_pools()
+        # Keep API fetches independent of the shared rate limit bucket in the database
+        limiter = TokenBucketLimiter("digitraffic", per_minute=60, burst=10, shared=False)
+        patcher = patch('PortmanTrigger.portman.get_rate_limiter', return_value=limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         # Test data
         self.sample_port_call = {
             "portCallId": 3190880,
@@ -78,6 +98,71 @@ class TestPortmanMockDb(unittest.TestCase):
         self.assertIn("portCalls", data)
         self.assertEqual(len(data["portCalls"]), 1)
 
+    @patch('requests.get')
+    def test_fetch_data_from_api_incremental(self, mock_get):
+        """Test that incremental fetches send the time filter and conditional request headers."""
+        mock_response = MagicMock(status_code=200, headers={"ETag": '"v2"', "Last-Modified": "Wed, 13 Mar 2024 10:00:00 GMT"})
+        mock_response.json.return_value = {"portCalls": [self.sample_port_call]}
+        mock_get.return_value = mock_response
+
+        validators = {"etag": '"v1"', "last_modified": None}
+        data = fetch_data_from_api(datetime(2024, 3, 13, 12, 0, tzinfo=timezone(timedelta(hours=2))), validators)
+
+        self.assertEqual(len(data["portCalls"]), 1)
+        kwargs = mock_get.call_args.kwargs
+        self.assertEqual(kwargs["params"], {"from": "2024-03-13T10:00:00.000Z"})
+        self.assertEqual(kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(kwargs["headers"]["Accept-Encoding"], "gzip")
+        self.assertNotIn("If-Modified-Since", kwargs["headers"])
+        self.assertEqual(validators, {"etag": '"v2"', "last_modified": "Wed, 13 Mar 2024 10:00:00 GMT"})
+
+        # A 304 response means nothing changed since the previous fetch
+        mock_get.return_value = MagicMock(status_code=304)
+        self.assertIsNone(fetch_data_from_api(None, validators))
+        self.assertEqual(mock_get.call_args.kwargs["headers"]["If-Modified-Since"], "Wed, 13 Mar 2024 10:00:00 GMT")
+
+    def test_track_high_water_mark(self):
+        """Test high-water mark tracking while port calls are consumed."""
+        port_calls = [
+            dict(self.sample_port_call, portCallTimestamp="2024-03-12T08:00:00.000+00:00"),
+            dict(self.sample_port_call, portCallTimestamp="2024-03-12T11:30:00.000+02:00"),
+            dict(self.sample_port_call, portCallTimestamp=None)
+        ]
+        state = {"high_water_mark": None}
+        self.assertEqual(list(track_high_water_mark(port_calls, state)), port_calls)
+        self.assertEqual(state["high_water_mark"], datetime(2024, 3, 12, 9, 30, tzinfo=timezone.utc))
+
+    @patch('PortmanTrigger.portman.save_results_to_db')
+    def test_save_port_calls_in_batches(self, mock_save):
+        """Test that streamed port calls are saved in fixed-size batches."""
+        port_calls = [dict(self.sample_port_call, portCallId=3190880 + i) for i in range(5)]
+        port_calls.insert(2, {"invalid": "data"})
+        document = io.BytesIO(json.dumps({"dataUpdatedTime": None, "portCalls": port_calls}).encode("utf-8"))
+
+        saved_count = save_port_calls_in_batches(iter_port_calls(document), batch_size=2)
+
+        self.assertEqual(saved_count, 5)
+        batches = [call.args[0] for call in mock_save.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual([port_call_id for batch in batches for port_call_id in batch.rows],
+                         [3190880, 3190881, 3190882, 3190883, 3190884])
+        self.assertEqual(batches[0].entry(3190880)["crewOnArrival"], 1849)
+
+    def test_port_call_batch_matches_process_query(self):
+        """Test that the columnar batch writes the same column values and hashes as the dict path."""
+        port_calls = [
+            self.sample_port_call,
+            dict(self.sample_port_call, portCallId=3190881, vesselTypeCode=20, imoLloyds=None, mmsi="257800001"),
+            dict(self.sample_port_call, vesselName="Viking Grace II")  # Duplicate, last one wins
+        ]
+        results = process_query({"portCalls": port_calls})
+        batch = next(iter_port_call_batches(port_calls))
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.voyage_columns(), build_voyage_columns(results))
+        self.assertEqual(batch.entry(3190880), results[2])
+        self.assertEqual(batch.entry(3190881)["vesselTypeCode"], 20)
+
     @patch('pg8000.connect')
     def test_save_results_to_db(self, mock_connect):
         """Test database operations."""
@@ -95,8 +180,83 @@ class TestPortmanMockDb(unittest.TestCase):
         
         # Verify database operations
         mock_cursor.execute.assert_called()
-        # Expect two commits due to the NOA XML generation feature
-        self.assertEqual(mock_conn.commit.call_count, 2)
+        # All rows are written by a single bulk upsert and committed once
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+        self.assertEqual(mock_conn.commit.call_count, 1)
+
+    @patch('PortmanTrigger.xml_client.get_converter_session')
+    def test_request_xml_documents(self, mock_get_session):
+        """Test concurrent XML converter calls over the shared session."""
+        mock_response = MagicMock(status_code=200)
+        mock_response.json.return_value = {"sasUrl": "https://example.com/doc.xml"}
+        mock_get_session.return_value.post.return_value = mock_response
+
+        voyage = {"portCallId": 3190880, "imoLloyds": 9606900, "vesselName": "Viking Grace",
+                  "eta": "2024-03-13T10:00:00.000+00:00", "portAreaName": "Matkustajasatama"}
+        results = request_xml_documents([("VID", voyage), ("ATA", voyage), ("NOA", voyage)], batch_size=1)
+
+        # ATA is rejected before any HTTP call because the ata field is missing
+        self.assertEqual([url for url, _, _ in results], ["https://example.com/doc.xml", None, "https://example.com/doc.xml"])
+        self.assertEqual(results[1], (None, "Missing required field 'ata'", True))
+        post = mock_get_session.return_value.post
+        self.assertEqual(post.call_count, 2)
+        for call in post.call_args_list:
+            self.assertEqual(call.kwargs["timeout"], XML_CONVERTER_CONFIG["timeout"])
+            self.assertEqual(call.kwargs["json"]["portcall_data"]["portCallId"], "3190880")
+
+    @patch('PortmanTrigger.xml_client.get_converter_session')
+    def test_request_xml_documents_in_process(self, mock_get_session):
+        """Test that the in-process transport converts documents without calling the converter over HTTP."""
+        voyage = {"portCallId": 3190880, "imoLloyds": 9606900, "vesselName": "Viking Grace",
+                  "eta": "2024-03-13T10:00:00.000+00:00", "portAreaName": "Matkustajasatama",
+                  "portToVisit": "FITKU"}
+        with patch.dict(XML_CONVERTER_CONFIG, {"transport": "inprocess"}):
+            batched = request_xml_documents([("VID", voyage), ("ATA", voyage)])
+            single = request_xml_documents([("NOA", voyage)])
+        paths = [path for path, _, _ in batched + single]
+        try:
+            mock_get_session.assert_not_called()
+            self.assertIsNone(paths[1])
+            self.assertTrue(os.path.basename(paths[0]).startswith("VID_3190880_"))
+            self.assertTrue(os.path.basename(paths[2]).startswith("NOA_3190880_"))
+        finally:
+            for path in paths:
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    @patch('PortmanTrigger.xml_client.get_converter_session')
+    def test_request_xml_documents_in_batches(self, mock_get_session):
+        """Test that documents are sent to the batch endpoint and results mapped back in job order."""
+        def fake_post(url, json, timeout):
+            response = MagicMock(status_code=200)
+            response.json.return_value = {"results": [
+                {"status": "success", "sasUrl": f"https://example.com/{item['formality_type']}.xml"}
+                if item["formality_type"] != "NOA" else {"status": "error", "message": "invalid"}
+                for item in json["items"]
+            ]}
+            return response
+        mock_get_session.return_value.post.side_effect = fake_post
+
+        voyage = {"portCallId": 3190880, "imoLloyds": 9606900, "vesselName": "Viking Grace",
+                  "eta": "2024-03-13T10:00:00.000+00:00", "portAreaName": "Matkustajasatama"}
+        jobs = [("VID", voyage), ("ATA", voyage), ("NOA", voyage), ("VID", voyage)]
+        results = request_xml_documents(jobs, batch_size=3)
+
+        self.assertEqual(results, [
+            ("https://example.com/VID.xml", None, False),
+            (None, "Missing required field 'ata'", True),
+            (None, "invalid", False),
+            ("https://example.com/VID.xml", None, False)
+        ])
+        post = mock_get_session.return_value.post
+        self.assertEqual(post.call_count, 2)
+        self.assertTrue(post.call_args_list[0].args[0].startswith(XML_CONVERTER_CONFIG["function_url"] + "-batch"))
+        # The ATA job is rejected before the request, so the first batch only carries two items
+        self.assertEqual([item["formality_type"] for item in post.call_args_list[0].kwargs["json"]["items"]], ["VID", "NOA"])
+
+    def tearDown(self):
+        # Do not leave mocked connections in the pool for other tests
+        close_connection_pools()
 
     def test_get_db_connection(self):
         """Test database connection."""
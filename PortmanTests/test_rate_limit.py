@@ -0,0 +1,107 @@
+# Test cases for the PortmanTrigger/rate_limit.py module.
+
+import threading
+import unittest
+import pg8000
+from unittest.mock import patch
+from PortmanTrigger.migrations import ensure_database_schema
+from PortmanTrigger.rate_limit import TokenBucketLimiter, parse_retry_after
+from config import DATABASE_CONFIG
+
+BUCKET = "test_bucket"
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        """Create a database connection and start from a fresh bucket."""
+        ensure_database_schema()
+        self.conn = pg8000.connect(
+            user=DATABASE_CONFIG["user"],
+            password=DATABASE_CONFIG["password"],
+            host=DATABASE_CONFIG["host"],
+            database=DATABASE_CONFIG["dbname"],
+            port=DATABASE_CONFIG["port"]
+        )
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM rate_limit_buckets WHERE name = %s", (BUCKET,))
+        self.conn.commit()
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM rate_limit_buckets WHERE name = %s", (BUCKET,))
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def test_instances_share_one_bucket(self):
+        """Test that two instances together get no more tokens than the bucket holds."""
+        first = TokenBucketLimiter(BUCKET, per_minute=1, burst=3, lease_seconds=300)
+        second = TokenBucketLimiter(BUCKET, per_minute=1, burst=3, lease_seconds=300)
+
+        # The first instance leases the whole burst and serves it from memory
+        self.assertTrue(first.try_acquire())
+        with patch.object(first, "_take", side_effect=AssertionError("database asked")):
+            self.assertTrue(first.try_acquire())
+            self.assertTrue(first.try_acquire())
+        self.assertFalse(first.try_acquire())
+        self.assertFalse(second.try_acquire())
+        self.assertGreater(second.seconds_until_available(), 50)
+
+    def test_block_applies_to_all_instances(self):
+        """Test that a Retry-After block from one instance stops the others without waiting."""
+        first = TokenBucketLimiter(BUCKET, per_minute=60, burst=5, lease_seconds=0.001)
+        second = TokenBucketLimiter(BUCKET, per_minute=60, burst=5, lease_seconds=0.001)
+        self.assertTrue(second.try_acquire())
+
+        first.block_for(30)
+
+        with patch('PortmanTrigger.rate_limit.time.sleep') as mock_sleep:
+            self.assertFalse(second.acquire(timeout=5))
+        mock_sleep.assert_not_called()
+        self.assertGreater(second.seconds_until_available(), 25)
+
+    @patch('PortmanTrigger.rate_limit.get_db_connection', return_value=None)
+    def test_falls_back_to_local_bucket(self, _):
+        """Test that the limit still holds per instance when the database is unavailable."""
+        limiter = TokenBucketLimiter(BUCKET, per_minute=1, burst=2)
+        self.assertEqual([limiter.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_lock_is_released_while_taking_a_lease(self):
+        """Test that other threads are not held on the lock during the database round trip."""
+        limiter = TokenBucketLimiter(BUCKET, per_minute=60, burst=5, lease_seconds=300)
+        entered, release = threading.Event(), threading.Event()
+
+        def take(wanted):
+            entered.set()
+            release.wait(5)
+            return 3, 2.0, 0.0
+
+        results = []
+        with patch.object(limiter, "_take", side_effect=take) as mock_take:
+            threads = [threading.Thread(target=lambda: results.append(limiter.try_acquire())) for _ in range(2)]
+            threads[0].start()
+            self.assertTrue(entered.wait(5))
+            self.assertTrue(limiter.lock.acquire(timeout=1))
+            limiter.lock.release()
+            self.assertEqual(limiter.seconds_until_available(), 0)
+            # The second thread waits for the lease being taken instead of taking its own
+            threads[1].start()
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(results, [True, True])
+        mock_take.assert_called_once()
+
+    def test_rate_must_be_positive(self):
+        """Test that a limit of 0 requests per minute is rejected instead of failing on use."""
+        with self.assertRaises(ValueError):
+            TokenBucketLimiter(BUCKET, per_minute=0, burst=5)
+
+    def test_parse_retry_after(self):
+        """Test Retry-After in seconds, as an HTTP date and when it is missing or invalid."""
+        self.assertEqual(parse_retry_after("30"), 30)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertEqual(parse_retry_after(None, default=1), 1)
+        self.assertEqual(parse_retry_after("soon", default=5), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+# Test cases for the PortmanNotificator/slack_notificator.py module.
+
+import json
+import unittest
+from xml.dom import minidom
+import pg8000
+from unittest.mock import patch, MagicMock
+from PortmanNotificator import slack_notificator
+from PortmanNotificator.notification_index import delivery_key
+from PortmanNotificator.slack_notificator import (
+    blob_trigger,
+    dispatch_slack_outbox,
+    extract_info_from_metadata,
+    extract_info_from_xml,
+    format_xml_for_display,
+    queue_notification
+)
+from PortmanTrigger.blob_utils import decode_blob_metadata, encode_blob_metadata
+from PortmanXMLConverter.xml_converter import build_xml_document
+from PortmanTrigger.migrations import ensure_database_schema
+from PortmanTrigger.rate_limit import TokenBucketLimiter
+from config import DATABASE_CONFIG
+
+BLOB_PREFIX = "emswe-xml-messages/test-slack/"
+
+def slack_response(status_code, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {}, text="")
+    response.json.return_value = {}
+    return response
+
+def event(port_call_id):
+    return {"kind": "notification", "port_call_id": port_call_id, "time_value": "2024-03-13T10:00:00Z",
+            "remarks": "Test", "passengers_count": "N/A", "crew_count": "N/A"}
+
+@patch('PortmanNotificator.slack_notificator.generate_blob_storage_link', return_value="")
+@patch.dict('PortmanNotificator.slack_notificator.SLACK_NOTIFICATION_CONFIG', {"digest_window_seconds": 0})
+class TestSlackNotificator(unittest.TestCase):
+    def setUp(self):
+        """Create a database connection and leave only this test's notifications queued."""
+        ensure_database_schema()
+        self.conn = pg8000.connect(
+            user=DATABASE_CONFIG["user"],
+            password=DATABASE_CONFIG["password"],
+            host=DATABASE_CONFIG["host"],
+            database=DATABASE_CONFIG["dbname"],
+            port=DATABASE_CONFIG["port"]
+        )
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM slack_outbox WHERE blob_name LIKE %s", (BLOB_PREFIX + "%",))
+        self.cursor.execute("UPDATE slack_outbox SET status = 'sent' WHERE status IN ('pending', 'processing')")
+        self.conn.commit()
+
+        self.index_keys = [delivery_key(BLOB_PREFIX + "ATA_1.xml", version) for version in ("0x1", "md5-2")]
+        self.cursor.execute("DELETE FROM notification_index WHERE key = ANY(%s::bytea[])", (self.index_keys,))
+        self.conn.commit()
+        slack_notificator.notification_index.clear_cache()
+
+        self.limiter = TokenBucketLimiter("test_slack", per_minute=50, burst=50, shared=False)
+        patcher = patch.object(slack_notificator, "slack_rate_limiter", self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.cursor.execute("DELETE FROM slack_outbox WHERE blob_name LIKE %s", (BLOB_PREFIX + "%",))
+        self.cursor.execute("DELETE FROM notification_index WHERE key = ANY(%s::bytea[])", (self.index_keys,))
+        self.conn.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def queue_rows(self):
+        self.cursor.execute(
+            "SELECT blob_name, status, attempts FROM slack_outbox WHERE blob_name LIKE %s ORDER BY id",
+            (BLOB_PREFIX + "%",)
+        )
+        return list(self.cursor.fetchall())
+
+    @patch('PortmanNotificator.slack_notificator.requests.post')
+    def test_events_for_a_port_are_sent_as_one_digest(self, mock_post, _):
+        """Test that queued events are coalesced per port and errors are sent on their own."""
+        mock_post.return_value = slack_response(200)
+        queue_notification(BLOB_PREFIX + "ATA_1.xml", "ATA", "FITKU", event(1))
+        queue_notification(BLOB_PREFIX + "NOA_2.xml", "NOA", "FITKU", event(2))
+        queue_notification(BLOB_PREFIX + "VID_3.xml", "VID", "FIHEL", event(3))
+        queue_notification(BLOB_PREFIX + "ATA_4.xml", "ATA", None, {"kind": "error", "error": "bad xml"})
+
+        totals = dispatch_slack_outbox()
+
+        self.assertEqual(totals["sent"], 4)
+        self.assertEqual(totals["messages"], 3)
+        self.assertEqual({status for _, status, _ in self.queue_rows()}, {"sent"})
+        digest = json.loads(mock_post.call_args_list[0].kwargs["data"])
+        self.assertIn("2 port call updates for FITKU", digest["blocks"][0]["text"]["text"])
+        error = json.loads(mock_post.call_args_list[2].kwargs["data"])
+        self.assertIn("bad xml", error["blocks"][0]["text"]["text"])
+
+    @patch('PortmanNotificator.slack_notificator.requests.post')
+    def test_rate_limited_messages_are_requeued(self, mock_post, _):
+        """Test that a 429 re-queues the events after Retry-After and stops sending."""
+        mock_post.return_value = slack_response(429, {"Retry-After": "30"})
+        queue_notification(BLOB_PREFIX + "ATA_1.xml", "ATA", "FITKU", event(1))
+        queue_notification(BLOB_PREFIX + "ATA_2.xml", "ATA", "FIHEL", event(2))
+
+        totals = dispatch_slack_outbox()
+
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(totals["deferred"], 2)
+        self.assertEqual([tuple(row[1:]) for row in self.queue_rows()], [("pending", 0), ("pending", 0)])
+        self.assertFalse(self.limiter.try_acquire())
+
+    @patch('PortmanTrigger.rate_limit.time.sleep')
+    @patch('PortmanNotificator.slack_notificator.requests.post')
+    def test_sending_stops_when_budget_is_used_up(self, mock_post, mock_sleep, _):
+        """Test that messages over the per-minute budget stay queued instead of waiting."""
+        mock_post.return_value = slack_response(200)
+        self.limiter = TokenBucketLimiter("test_slack", per_minute=1, burst=1, shared=False)
+        slack_notificator.slack_rate_limiter = self.limiter
+        queue_notification(BLOB_PREFIX + "ATA_1.xml", "ATA", "FITKU", event(1))
+        queue_notification(BLOB_PREFIX + "ATA_2.xml", "ATA", "FIHEL", event(2))
+
+        totals = dispatch_slack_outbox()
+
+        self.assertEqual((totals["sent"], totals["deferred"]), (1, 1))
+        self.assertEqual([tuple(row[1:]) for row in self.queue_rows()], [("sent", 1), ("pending", 0)])
+        mock_sleep.assert_not_called()
+
+    @patch('PortmanNotificator.slack_notificator.requests.post')
+    def test_stale_notifications_out_of_attempts_are_failed(self, mock_post, _):
+        """Test that a notification left processing by crashed senders is not claimed again once out of attempts."""
+        queue_notification(BLOB_PREFIX + "ATA_1.xml", "ATA", "FITKU", event(1))
+        self.cursor.execute("""
+            UPDATE slack_outbox SET status = 'processing', attempts = %s, modified = CURRENT_TIMESTAMP - INTERVAL '1 day'
+            WHERE blob_name LIKE %s
+        """, (slack_notificator.SLACK_NOTIFICATION_CONFIG["max_attempts"], BLOB_PREFIX + "%"))
+        self.conn.commit()
+
+        dispatch_slack_outbox()
+
+        mock_post.assert_not_called()
+        self.assertEqual([tuple(row[1:]) for row in self.queue_rows()],
+                         [("failed", slack_notificator.SLACK_NOTIFICATION_CONFIG["max_attempts"])])
+
+    @patch.dict('PortmanNotificator.slack_notificator.SLACK_NOTIFICATION_CONFIG', {"enabled": True})
+    def test_duplicate_deliveries_are_queued_once(self, _):
+        """Test that repeated deliveries of a blob version queue one notification, from memory or the table."""
+        def delivery(properties):
+            blob = MagicMock(metadata=None, blob_properties=properties)
+            blob.name = BLOB_PREFIX + "ATA_1.xml"
+            blob.read.return_value = b"<not xml"
+            return blob
+
+        first = delivery({"ETag": "0x1"})
+        blob_trigger(first)
+        with patch('PortmanNotificator.notification_index.get_db_connection',
+                   side_effect=AssertionError("database asked")):
+            blob_trigger(delivery({"ETag": "0x1"}))
+        slack_notificator.notification_index.clear_cache()
+        repeated = delivery({"ETag": "0x1"})
+        blob_trigger(repeated)
+        self.assertEqual([status for _, status, _ in self.queue_rows()], ["pending"])
+        repeated.read.assert_not_called()
+
+        # A new version of the blob is notified again
+        blob_trigger(delivery({"ContentMD5": "md5-2", "ETag": "0x2"}))
+        self.assertEqual(len(self.queue_rows()), 2)
+
+class TestNotificationMetadata(unittest.TestCase):
+    def setUp(self):
+        self.port_call = {
+            "portCallId": 3190880,
+            "imoLloyds": 9606900,
+            "mmsi": 230629000,
+            "vesselName": "Viking Grace Ä",
+            "portToVisit": "FITKU",
+            "portAreaDetails": [{
+                "eta": "2024-03-13T10:00:00.000+00:00",
+                "ata": "2024-03-13T10:04:00.000+00:00",
+                "berthCode": "v1",
+                "berthName": "viking1"
+            }]
+        }
+
+    def test_metadata_matches_xml(self):
+        """Test that the converter's blob metadata gives the same notification as parsing the XML."""
+        for xml_type in ("ATA", "NOA", "VID"):
+            success, (_, xml, metadata) = build_xml_document(self.port_call, xml_type)
+            self.assertTrue(success)
+            stored = decode_blob_metadata(encode_blob_metadata(metadata))
+            self.assertEqual(extract_info_from_metadata(stored, xml_type), extract_info_from_xml(xml, xml_type))
+
+    @patch('PortmanNotificator.slack_notificator.queue_notification')
+    @patch.dict('PortmanNotificator.slack_notificator.SLACK_NOTIFICATION_CONFIG', {"enabled": True})
+    def test_trigger_does_not_read_blob_with_metadata(self, mock_queue_notification):
+        """Test that the blob trigger takes the notification fields from the trigger metadata."""
+        _, (_, _, metadata) = build_xml_document(self.port_call, "ATA")
+        blob = MagicMock(metadata=encode_blob_metadata(metadata))
+        blob.name = "emswe-xml-messages/ATA_3190880_20240313100400.xml"
+
+        blob_trigger(blob)
+
+        blob.read.assert_not_called()
+        _, xml_type, port, event, _ = mock_queue_notification.call_args.args
+        self.assertEqual((xml_type, port, event["port_call_id"]), ("ATA", "FITKU", "3190880"))
+
+class TestFormatXmlForDisplay(unittest.TestCase):
+    def minidom_format(self, xml_content, max_length):
+        pretty_xml = minidom.parseString(xml_content).toprettyxml(indent="  ")
+        pretty_xml = "\n".join([line for line in pretty_xml.split("\n") if line.strip()])
+        if len(pretty_xml) > max_length:
+            return pretty_xml[:max_length] + "\n... (truncated)"
+        return pretty_xml
+
+    def test_output_matches_minidom(self):
+        """Test that the streaming formatter lays out documents exactly like minidom."""
+        documents = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n<!-- top -->\n<Envelope xmlns="" xmlns:m="urn:m" id="1">\n'
+            '  <m:x a="&quot;&gt;" b="\'"/>\n  <m:y>  </m:y>\n  <?pi data?>\n</Envelope>',
+            '<a>x &amp; y<b>1</b>tail\n more<c/><![CDATA[x<y]]><![CDATA[z]]></a>',
+            '<a><b></b><c><![CDATA[only]]></c><!-- c --></a>'
+        ]
+        _, (_, noa, _) = build_xml_document({"portCallId": 1, "vesselName": "Test", "portToVisit": "FITKU"}, "NOA")
+        documents.append(noa)
+        for document in documents:
+            for max_length in (10, 60, 300, 100000):
+                self.assertEqual(format_xml_for_display(document, max_length), self.minidom_format(document, max_length))
+
+    def test_stops_at_max_length(self):
+        """Test that formatting stops at the limit without reading the rest of the document."""
+        document = "<a>" + "<b>text</b>" * 100000 + "<unclosed>"
+        formatted = format_xml_for_display(document, 100)
+        self.assertEqual(formatted, self.minidom_format("<a>" + "<b>text</b>" * 10 + "</a>", 100))
+
+if __name__ == '__main__':
+    unittest.main()
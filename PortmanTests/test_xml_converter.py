@@ -3,10 +3,27 @@ Test module for the complete EMSWe converter solution.
 """
 
 import os
+import sys
 import json
 import pytest
+import subprocess
 import tempfile
+from datetime import datetime
+from unittest.mock import patch
+from lxml import etree
 from PortmanXMLConverter.src.converter import EMSWeConverter
+from PortmanXMLConverter.src.validator import SchemaRegistry, ValidationPolicy, schema_registry
+from PortmanXMLConverter.src.transformer import XMLTransformer
+from PortmanXMLConverter.src.digitraffic_adapter import adapt_digitraffic_to_portman
+from datetime_utils import (
+    clear_datetime_caches,
+    get_datetime_cache_stats,
+    parse_iso_datetime,
+    to_display_datetime,
+    to_minute_datetime,
+    to_xml_datetime
+)
+from PortmanXMLConverter.xml_converter import convert_portcall_batch
 
 # Test data paths
 EXAMPLE_XML_PATH = os.path.join(
@@ -26,6 +43,62 @@ def test_converter_initialization():
     assert converter.parser is not None
     assert converter.transformer is not None
 
+def test_converters_share_compiled_schema():
+    """Test that converters reuse the process-wide compiled schema per formality type."""
+    first = EMSWeConverter(formality_type="NOA")
+    before = schema_registry.get_stats()["NOA"]
+    second = EMSWeConverter(formality_type="NOA")
+    after = schema_registry.get_stats()["NOA"]
+
+    assert first.validator.schema is second.validator.schema
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] == 1
+    assert after["compile_seconds"] > 0
+
+def test_schema_registry_warmup():
+    """Test that warmup compiles every formality type once."""
+    registry = SchemaRegistry()
+    registry.warmup()
+    registry.warmup(["ATA"])
+
+    stats = registry.get_stats()
+    assert sorted(stats) == ["ATA", "NOA", "VID"]
+    assert all(entry["misses"] == 1 for entry in stats.values())
+    assert stats["ATA"]["hits"] == 1
+
+def test_sampled_validation_policy():
+    """Test that sampling validates every Nth document and every new input shape."""
+    policy = ValidationPolicy("sampled", sample_every=4)
+    document = {"vesselName": "Viking Grace", "imoLloyds": "9606900", "declarant": {"id": "FI1"}}
+    decisions = [policy.should_validate("NOA", document) for _ in range(5)]
+    assert decisions == [True, False, False, False, True]
+
+    # Same keys but an empty value or a different nested key is a new shape
+    assert policy.should_validate("NOA", dict(document, imoLloyds=""))
+    assert policy.should_validate("NOA", dict(document, declarant={"name": "Agent"}))
+    assert not policy.should_validate("NOA", dict(document, vesselName="Amorella"))
+    # Shapes are tracked per formality type
+    assert policy.should_validate("VID", document)
+
+    policy.record_result("NOA", False)
+    assert policy.get_stats() == {
+        "policy": "sampled",
+        "formality_types": {
+            "NOA": {"documents": 8, "validated": 4, "skipped": 4, "failed": 1},
+            "VID": {"documents": 1, "validated": 1, "skipped": 0, "failed": 0}
+        }
+    }
+
+def test_validation_policy_off_skips_validation():
+    """Test that the off policy skips validation of generated documents."""
+    converter = EMSWeConverter(formality_type="ATA")
+    with patch("PortmanXMLConverter.src.converter.validation_policy", ValidationPolicy("off")) as policy, \
+            patch.object(converter.validator, "validate") as validate:
+        success, xml = converter.convert_to_emswe({"call_id": "1"})
+    assert success and xml.startswith("<?xml")
+    validate.assert_not_called()
+    assert policy.get_stats()["formality_types"]["ATA"]["skipped"] == 1
+
 def test_validate_xml():
     """Test XML validation functionality."""
     converter = EMSWeConverter(formality_type="ATA")
@@ -105,6 +178,173 @@ def test_convert_to_emswe():
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+def test_convert_portcall_batch():
+    """Test that a batch returns per-item results in request order."""
+    portcall_data = {
+        "portCallId": "3190880",
+        "imoLloyds": "9606900",
+        "mmsi": "257800000",
+        "vesselName": "Viking Grace",
+        "portToVisit": "FITKU",
+        "portAreaName": "Matkustajasatama",
+        "eta": "2024-03-13T10:00:00.000+00:00",
+        "ata": "2024-03-13T10:04:00.000+00:00"
+    }
+    results = convert_portcall_batch([
+        {"portcall_data": portcall_data, "formality_type": "NOA"},
+        {"portcall_data": portcall_data, "formality_type": "XYZ"},
+        {"formality_type": "ATA"},
+        {"portcall_data": {"portCallId": "1"}, "formality_type": "NOA"},
+        {"portcall_data": portcall_data, "formality_type": "VID"}
+    ])
+
+    assert [result["status"] for result in results] == ["success", "error", "error", "error", "success"]
+    try:
+        assert os.path.basename(results[0]["sasUrl"]).startswith("NOA_3190880_")
+        assert os.path.basename(results[4]["sasUrl"]).startswith("VID_3190880_")
+        assert "Invalid formality_type" in results[1]["message"]
+        assert "NOA XML generation failed" in results[3]["message"]
+    finally:
+        for result in results:
+            if result["status"] == "success" and os.path.exists(result["sasUrl"]):
+                os.remove(result["sasUrl"])
+
+def test_convert_portcall_batch_same_type_documents_get_own_blobs():
+    """Test that two documents of one type for the same port call are not stored under one name."""
+    portcall_data = {
+        "portCallId": "3190880",
+        "imoLloyds": "9606900",
+        "vesselName": "Viking Grace",
+        "portToVisit": "FITKU",
+        "eta": "2024-03-13T10:00:00.000+00:00"
+    }
+    updated = dict(portcall_data, eta="2024-03-13T11:00:00.000+00:00")
+    results = convert_portcall_batch([
+        {"portcall_data": portcall_data, "formality_type": "NOA"},
+        {"portcall_data": updated, "formality_type": "NOA"}
+    ])
+
+    try:
+        assert [result["status"] for result in results] == ["success", "success"]
+        assert results[0]["sasUrl"] != results[1]["sasUrl"]
+        for result in results:
+            assert os.path.exists(result["sasUrl"])
+    finally:
+        for result in results:
+            if result["status"] == "success" and os.path.exists(result["sasUrl"]):
+                os.remove(result["sasUrl"])
+
+@pytest.mark.parametrize("cwd, script", [
+    (os.path.join(os.path.dirname(__file__), "..", "PortmanXMLConverter"), "xml_converter.py"),
+    (os.path.join(os.path.dirname(__file__), ".."), os.path.join("PortmanXMLConverter", "xml_converter.py"))
+])
+def test_command_line_interface(tmp_path, cwd, script):
+    """Test that the documented command-line interface converts and validates a document."""
+    json_file, xml_file = tmp_path / "portcall.json", tmp_path / "noa.xml"
+    json_file.write_text(json.dumps({
+        "portCallId": 3190880,
+        "imoLloyds": 9606900,
+        "vesselName": "Viking Grace",
+        "portToVisit": "FITKU",
+        "portAreaName": "Matkustajasatama",
+        "eta": "2024-03-13T10:00:00.000+00:00"
+    }))
+
+    for command in (["from-digitraffic", "--json-file", str(json_file), "--output-file", str(xml_file)],
+                    ["validate", "--xml-file", str(xml_file)]):
+        result = subprocess.run([sys.executable, script, *command, "--formality-type", "NOA"],
+                                cwd=cwd, capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+    assert "2024-03-13T10:00:00Z" in xml_file.read_text(encoding="utf-8")
+
+class FixedDatetime(datetime):
+    """datetime with a fixed now() so defaults filled in by both builders match."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2024, 5, 1, 12, 0, 0)
+
+@pytest.mark.parametrize("formality_type", ["ATA", "NOA", "VID"])
+def test_template_builder_matches_element_builder(formality_type):
+    """Test that template-rendered documents are byte-identical to element-built ones and valid."""
+    port_call = {
+        "portCallId": "3190880",
+        "imoLloyds": "9606900",
+        "mmsi": "257800000",
+        "vesselName": "Viking Grace",
+        "radioCallSign": "OJPU",
+        "portToVisit": "FITKU",
+        "portAreaName": "Matkustajasatama",
+        "berthName": "viking1",
+        "eta": "2024-03-13T10:00:00.000+00:00",
+        "ata": "2024-03-13T10:04:00.000+00:00",
+        "passengersOnArrival": 120,
+        "crewOnArrival": 0
+    }
+    sparse = {"vesselName": "Unknown & Co", "imoLloyds": "0", "mmsi": "123", "remarks": 5, "call_id": "1"}
+    element_builder = XMLTransformer(use_templates=False)
+    template_builder = XMLTransformer()
+    validator = EMSWeConverter(formality_type=formality_type).validator
+
+    with patch("PortmanXMLConverter.src.transformer.datetime", FixedDatetime):
+        for portman_data in (adapt_digitraffic_to_portman(port_call, formality_type), sparse):
+            expected = element_builder.portman_to_emswe(portman_data, formality_type)
+            rendered = template_builder.portman_to_emswe(portman_data, formality_type)
+            if expected is None:
+                assert rendered is None
+                continue
+            assert etree.tostring(rendered, pretty_print=True, xml_declaration=True, encoding="UTF-8") == \
+                etree.tostring(expected, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
+        is_valid, errors = validator.validate(
+            template_builder.portman_to_emswe(adapt_digitraffic_to_portman(port_call, formality_type), formality_type)
+        )
+    assert is_valid, errors
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-03-13T10:00:00.000+00:00", "2024-03-13T10:00:00Z"),
+    ("2024-03-13T10:00:00+00:00", "2024-03-13T10:00:00Z"),
+    ("2024-03-13T10:00:00.000Z", "2024-03-13T10:00:00Z"),
+    ("2024-03-13T10:00:00Z", "2024-03-13T10:00:00Z"),
+    ("2024-03-13T10:00:00.123456", "2024-03-13T10:00:00Z"),
+    # Offsets are dropped, not converted
+    ("2024-03-13T12:00:00.000+02:00", "2024-03-13T12:00:00Z"),
+    ("2024-03-13T10:00", None),
+    ("2024-03-13", None),
+    ("not a timestamp", None)
+])
+def test_datetime_normalisation(value, expected):
+    """Test that the Digitraffic timestamp variants normalise to the EMSWe format."""
+    assert to_xml_datetime(value) == expected
+
+def test_datetime_rejects_non_string_values():
+    """Test that values the caches cannot hash are rejected instead of raising."""
+    for value in (None, 1710324000, ["2024-03-13T10:00:00Z"], {"eta": "2024-03-13T10:00:00Z"}):
+        assert parse_iso_datetime(value) is None
+        assert to_xml_datetime(value) is None
+        assert to_minute_datetime(value) is None
+
+def test_datetime_formats_and_memoisation():
+    """Test minute and display formatting and that repeated timestamps hit the cache."""
+    clear_datetime_caches()
+    assert to_minute_datetime("2024-03-13T10:04:59.999+00:00") == "2024-03-13T10:04:00.000Z"
+    assert to_display_datetime("2024-03-13T10:04:59.999Z") == "2024-03-13 10:04"
+    assert to_display_datetime(None) == "N/A"
+    assert to_display_datetime("garbage") == "N/A"
+
+    for _ in range(3):
+        to_xml_datetime("2024-03-13T10:00:00.000+00:00")
+    stats = get_datetime_cache_stats()
+    assert stats["format"]["hits"] == 2
+    assert stats["parse"]["misses"] == 4
+
+def test_transformer_keeps_unparseable_datetime_fallback():
+    """Test that unparseable datetimes still get the best-effort string cleanup."""
+    transformer = XMLTransformer()
+    assert transformer._format_datetime_for_xml("2024-03-13T10:00:00.000+00:00") == "2024-03-13T10:00:00Z"
+    assert transformer._format_datetime_for_xml("2024-03-13T10:00") == "2024-03-13T10:00Z"
+    assert transformer._format_datetime_for_xml("tomorrow") == "tomorrow"
+
 def test_round_trip_conversion():
     """Test round-trip conversion (EMSWe -> Portman -> EMSWe)."""
     converter = EMSWeConverter(formality_type="ATA")
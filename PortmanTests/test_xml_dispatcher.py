@@ -0,0 +1,147 @@
+# Test cases for the PortmanTrigger/xml_dispatcher.py module.
+
+import unittest
+import pg8000
+from unittest.mock import patch
+from PortmanTrigger.portman import process_query, save_results_to_db
+from PortmanTrigger.xml_dispatcher import dispatch_xml_outbox
+from PortmanTrigger.xml_client import store_xml_urls
+from config import DATABASE_CONFIG, XML_CONVERTER_CONFIG
+
+PORT_CALL_ID = 3190998
+
+class TestXmlDispatcher(unittest.TestCase):
+    def setUp(self):
+        """Create a database connection and clear outbox state for the test port call."""
+        self.conn = pg8000.connect(
+            user=DATABASE_CONFIG["user"],
+            password=DATABASE_CONFIG["password"],
+            host=DATABASE_CONFIG["host"],
+            database=DATABASE_CONFIG["dbname"],
+            port=DATABASE_CONFIG["port"]
+        )
+        self.cursor = self.conn.cursor()
+        for table in ("voyages", "arrivals", "xml_outbox"):
+            self.cursor.execute(f"DELETE FROM {table} WHERE portCallId = %s", (PORT_CALL_ID,))
+        # Leave only this test's jobs due so the dispatcher does not pick up unrelated rows
+        self.cursor.execute("UPDATE xml_outbox SET status = 'done' WHERE status IN ('pending', 'processing')")
+        self.conn.commit()
+
+        self.sample_port_call = {
+            "portCallId": PORT_CALL_ID,
+            "imoLloyds": 9606900,
+            "mmsi": 257800000,
+            "vesselName": "Viking Grace",
+            "portToVisit": "FITKU",
+            "portAreaDetails": [{
+                "eta": "2024-03-13T10:00:00.000+00:00",
+                "ata": "2024-03-13T10:04:00.000+00:00",
+                "portAreaCode": "PASSE",
+                "portAreaName": "Matkustajasatama",
+                "berthCode": "v1",
+                "berthName": "viking1"
+            }]
+        }
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def outbox_rows(self, columns="formality, status, attempts, xml_url"):
+        self.cursor.execute(
+            f"SELECT {columns} FROM xml_outbox WHERE portCallId = %s ORDER BY formality",
+            (PORT_CALL_ID,)
+        )
+        return list(self.cursor.fetchall())
+
+    def test_save_results_queues_jobs_once(self):
+        """Test that ingest queues VID/ATA jobs and re-queuing the same events is idempotent."""
+        results = process_query({"portCalls": [self.sample_port_call]})
+        save_results_to_db(results)
+        self.cursor.execute("DELETE FROM voyages WHERE portCallId = %s", (PORT_CALL_ID,))
+        self.conn.commit()
+        save_results_to_db(results)
+
+        rows = self.outbox_rows()
+        self.assertEqual([row[0] for row in rows], ["ATA", "VID"])
+        self.assertTrue(all(row[1] == "pending" for row in rows))
+
+    def test_dispatch_marks_jobs_done_and_retries_failures(self):
+        """Test that the dispatcher stores URLs, records successes and schedules failed jobs for retry."""
+        save_results_to_db(process_query({"portCalls": [self.sample_port_call]}))
+
+        def fake_request(formality, data):
+            if formality == "VID":
+                return "https://example.com/VID.xml", None, False
+            return None, "Converter unavailable", False
+
+        with patch("PortmanTrigger.xml_client.generate_xml_document", side_effect=fake_request), \
+                patch.dict(XML_CONVERTER_CONFIG, {"batch_size": 1}):
+            totals = dispatch_xml_outbox(max_workers=2)
+
+        self.assertEqual(totals, {"done": 1, "retrying": 1, "failed": 0})
+        self.assertEqual(self.outbox_rows("formality, status, attempts, xml_url, last_error"), [
+            ["ATA", "pending", 1, None, "Converter unavailable"],
+            ["VID", "done", 1, "https://example.com/VID.xml", None]
+        ])
+        self.cursor.execute("SELECT vid_xml_url, ata_xml_url FROM voyages WHERE portCallId = %s", (PORT_CALL_ID,))
+        self.assertEqual(self.cursor.fetchone(), ["https://example.com/VID.xml", None])
+
+    def test_dispatch_fails_rejected_jobs_without_retrying(self):
+        """Test that a job with a missing mandatory field is marked failed with its error on the first attempt."""
+        save_results_to_db(process_query({"portCalls": [self.sample_port_call]}))
+        self.cursor.execute("UPDATE xml_outbox SET payload = payload - 'vesselName' WHERE portCallId = %s", (PORT_CALL_ID,))
+        self.conn.commit()
+
+        with patch.dict(XML_CONVERTER_CONFIG, {"batch_size": 1}):
+            totals = dispatch_xml_outbox(max_workers=2)
+
+        self.assertEqual(totals, {"done": 0, "retrying": 0, "failed": 2})
+        self.assertEqual(self.outbox_rows("formality, status, attempts, last_error"), [
+            ["ATA", "failed", 1, "Missing required field 'vesselName'"],
+            ["VID", "failed", 1, "Missing required field 'vesselName'"]
+        ])
+
+    def test_stale_jobs_out_of_attempts_are_failed(self):
+        """Test that a job left processing by crashed workers is not claimed again once out of attempts."""
+        save_results_to_db(process_query({"portCalls": [self.sample_port_call]}))
+        self.cursor.execute("""
+            UPDATE xml_outbox SET status = 'processing', attempts = 5, modified = CURRENT_TIMESTAMP - INTERVAL '1 day'
+            WHERE portCallId = %s AND formality = 'ATA'
+        """, (PORT_CALL_ID,))
+        self.cursor.execute("UPDATE xml_outbox SET status = 'done' WHERE portCallId = %s AND formality = 'VID'",
+                            (PORT_CALL_ID,))
+        self.conn.commit()
+
+        with patch("PortmanTrigger.xml_client.generate_xml_document") as mock_generate:
+            dispatch_xml_outbox(max_workers=2, max_attempts=5)
+
+        mock_generate.assert_not_called()
+        self.assertEqual(self.outbox_rows("formality, status, attempts"), [["ATA", "failed", 5], ["VID", "done", 0]])
+
+    def test_store_xml_urls_updates_latest_arrival(self):
+        """Test that ATA URLs go to the most recent arrival record and the voyage in one statement."""
+        save_results_to_db(process_query({"portCalls": [self.sample_port_call]}))
+        self.cursor.execute(
+            "INSERT INTO arrivals (portCallId, ata) VALUES (%s, '2024-03-13T10:10:00') RETURNING id", (PORT_CALL_ID,)
+        )
+        latest_id = self.cursor.fetchone()[0]
+
+        updated = store_xml_urls(self.cursor, [
+            ("ATA", PORT_CALL_ID, "https://example.com/ATA_1.xml"),
+            ("NOA", PORT_CALL_ID, "https://example.com/NOA.xml"),
+            ("ATA", PORT_CALL_ID, "https://example.com/ATA_2.xml")
+        ])
+        self.conn.commit()
+
+        self.assertEqual(updated, [PORT_CALL_ID])
+        self.cursor.execute("SELECT id, ata_xml_url FROM arrivals WHERE portCallId = %s ORDER BY id", (PORT_CALL_ID,))
+        self.assertEqual(list(self.cursor.fetchall()), [
+            [latest_id - 1, None],
+            [latest_id, "https://example.com/ATA_2.xml"]
+        ])
+        self.cursor.execute("SELECT noa_xml_url, ata_xml_url FROM voyages WHERE portCallId = %s", (PORT_CALL_ID,))
+        self.assertEqual(self.cursor.fetchone(), ["https://example.com/NOA.xml", "https://example.com/ATA_2.xml"])
+
+if __name__ == '__main__':
+    unittest.main()
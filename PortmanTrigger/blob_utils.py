@@ -1,15 +1,212 @@
-from azure.storage.blob import BlobServiceClient, BlobSasPermissions, generate_blob_sas
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, BlobSasPermissions, ContentSettings, generate_blob_sas
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, UTC
+from functools import lru_cache
+from urllib.parse import quote, unquote
 import os
 import logging
+import threading
+from config import BLOB_SAS_CONFIG
+from PortmanTrigger.metrics import stage_timer, with_run_context
+
+# Blob metadata flag set by the XML converter on documents carrying their Slack notification
+# fields as metadata; the notifier reads the fields only from blobs that have it
+NOTIFICATION_METADATA_KEY = "portman_notification"
+# Azure limits the total size of a blob's metadata names and values to 8 KiB
+MAX_METADATA_BYTES = 8192
+# Printable characters kept as is in metadata values; everything else is percent-encoded
+METADATA_SAFE_CHARACTERS = "!#$&'()*+,/:;=?@[]^`{|}"
+
+_service_clients = {}
+_container_clients = {}
+_clients_lock = threading.Lock()
+
+@lru_cache(maxsize=8)
+def parse_connection_string(connection_string):
+    """Parse a storage connection string into a dict of its settings (parsed once per string)."""
+    settings = {}
+    for part in connection_string.split(';'):
+        key, separator, value = part.partition('=')
+        if separator:
+            settings[key.strip()] = value.strip()
+    return settings
+
+def get_blob_service_client(connection_string=None):
+    """Return the process-wide BlobServiceClient for a connection string."""
+    if not connection_string:
+        connection_string = os.environ.get("AzureWebJobsStorage")
+    with _clients_lock:
+        client = _service_clients.get(connection_string)
+        if client is None:
+            client = BlobServiceClient.from_connection_string(connection_string)
+            _service_clients[connection_string] = client
+        return client
+
+def ensure_container_exists(container_client):
+    """Create the container unless it already exists."""
+    try:
+        container_client.create_container()
+        logging.info(f"Created blob container {container_client.container_name}")
+    except ResourceExistsError:
+        pass
+
+def get_container_client(container_name, connection_string=None):
+    """Return the process-wide ContainerClient for a container.
+
+    The container is created on first use in the process; after that uploads only recreate it
+    if storage reports it missing.
+    """
+    if not connection_string:
+        connection_string = os.environ.get("AzureWebJobsStorage")
+    key = (connection_string, container_name)
+    with _clients_lock:
+        container_client = _container_clients.get(key)
+    if container_client is not None:
+        return container_client
+
+    container_client = get_blob_service_client(connection_string).get_container_client(container_name)
+    ensure_container_exists(container_client)
+    with _clients_lock:
+        return _container_clients.setdefault(key, container_client)
+
+def reset_blob_clients():
+    """Forget the cached storage clients and SAS URLs (e.g. after rotating keys or between tests)."""
+    with _clients_lock:
+        _service_clients.clear()
+        _container_clients.clear()
+    sas_url_cache.clear()
+
+def encode_blob_metadata(metadata):
+    """Encode text values for blob metadata, which is sent as HTTP headers and must be ASCII.
+
+    Values are percent-encoded; returns None if the metadata would exceed the storage limit.
+    """
+    if not metadata:
+        return None
+    encoded = {key: quote(str(value), safe=METADATA_SAFE_CHARACTERS) for key, value in metadata.items()}
+    if sum(len(key) + len(value) for key, value in encoded.items()) > MAX_METADATA_BYTES:
+        logging.warning(f"Blob metadata exceeds {MAX_METADATA_BYTES} bytes, uploading without it")
+        return None
+    return encoded
+
+def decode_blob_metadata(metadata):
+    """Decode blob metadata written with encode_blob_metadata (keys are returned lower case)."""
+    return {key.lower(): unquote(value) for key, value in (metadata or {}).items()}
+
+def get_blob_metadata(container_name, blob_name, connection_string=None):
+    """Return the decoded metadata of a blob from its properties, without downloading it."""
+    blob_client = get_blob_service_client(connection_string).get_blob_client(container_name, blob_name)
+    return decode_blob_metadata(blob_client.get_blob_properties().metadata)
+
+def upload_blob(container_client, blob_name, data, content_type="application/xml", metadata=None):
+    """Upload data to a blob, overwriting it, and return the BlobClient.
+
+    metadata is an optional dict of text values stored with the blob (see encode_blob_metadata).
+    If the container has been deleted since it was first ensured, it is recreated and the
+    upload retried once.
+    """
+    blob_client = container_client.get_blob_client(blob_name)
+    content_settings = ContentSettings(content_type=content_type)
+    metadata = encode_blob_metadata(metadata)
+    try:
+        blob_client.upload_blob(data, overwrite=True, content_settings=content_settings, metadata=metadata)
+    except ResourceNotFoundError:
+        ensure_container_exists(container_client)
+        blob_client.upload_blob(data, overwrite=True, content_settings=content_settings, metadata=metadata)
+    return blob_client
+
+def upload_blobs(container_name, blobs, connection_string=None, max_concurrency=8, content_type="application/xml"):
+    """Upload (blob_name, data) or (blob_name, data, metadata) items concurrently.
+
+    Uploads go through the shared sync client, so every batch reuses its connection pool, on a
+    thread pool of at most max_concurrency workers. Returns a list with None for each uploaded
+    blob and the exception for each failed one, in input order.
+    """
+    if not blobs:
+        return []
+    with stage_timer("upload"):
+        return _upload_blobs(container_name, blobs, connection_string, max_concurrency, content_type)
+
+def _upload_blobs(container_name, blobs, connection_string, max_concurrency, content_type):
+    container_client = get_container_client(container_name, connection_string)
+
+    def upload(blob):
+        try:
+            upload_blob(container_client, blob[0], blob[1], content_type, blob[2] if len(blob) > 2 else None)
+            return None
+        except Exception as e:
+            return e
+
+    if len(blobs) == 1:
+        return [upload(blobs[0])]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(blobs))) as executor:
+        return list(executor.map(with_run_context(upload), blobs))
+
+def get_blob_url(container_name, blob_name, connection_string=None):
+    """Return the plain (unsigned) URL of a blob without contacting storage."""
+    account_url = get_blob_service_client(connection_string).url.rstrip('/')
+    return f"{account_url}/{container_name}/{blob_name}"
+
+class SasUrlCache:
+    """Thread-safe LRU cache of signed blob URLs.
+
+    A cached URL is returned until less than min_remaining of its validity is left, so a link
+    handed out is always usable for at least that long. Hits and misses are counted.
+    """
+
+    def __init__(self, max_entries, min_remaining):
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining
+        self._entries = OrderedDict()  # key -> (url, expiry)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now):
+        """Return the cached URL for key if it is still valid long enough, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - now > self.min_remaining:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, url, expiry):
+        with self._lock:
+            self._entries[key] = (url, expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+sas_url_cache = SasUrlCache(
+    max_entries=BLOB_SAS_CONFIG["cache_size"],
+    min_remaining=timedelta(hours=BLOB_SAS_CONFIG["min_remaining_hours"])
+)
 
 def generate_blob_storage_link(blob_name, connection_string=None):
-    """Generate a URL with SAS token to access the blob directly."""
+    """Generate a URL with SAS token to access the blob directly.
+
+    Signed URLs are cached per blob and reused until they get close to expiry.
+    """
     try:
         # Get storage account connection string if not provided
         if not connection_string:
             connection_string = os.environ.get("AzureWebJobsStorage")
-        
+
         if not connection_string:
             logging.warning("Storage connection string not available, cannot generate direct link")
             return ""
@@ -17,31 +214,41 @@ def generate_blob_storage_link(blob_name, connection_string=None):
         container_name = blob_name.split('/')[0]
         blob_path = '/'.join(blob_name.split('/')[1:])
 
-        # Create the BlobServiceClient
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        # Get account name and key (needed for SAS token generation) from the connection string
+        settings = parse_connection_string(connection_string)
+        account_name = settings.get("AccountName") or get_blob_service_client(connection_string).account_name
 
-        # Get account name from connection string
-        account_name = blob_service_client.account_name
+        now = datetime.now(UTC)
+        cache_key = (account_name, container_name, blob_path)
+        blob_url = sas_url_cache.get(cache_key, now)
+        if blob_url:
+            return blob_url
 
-        # Get account key (needed for SAS token generation)
-        account_key = connection_string.split('AccountKey=')[1].split(';')[0]
+        account_key = settings["AccountKey"]
+        expiry = now + timedelta(days=BLOB_SAS_CONFIG["expiry_days"])
 
-        # Generate SAS token with read permission that expires in 7 days
-        sas_token = generate_blob_sas(
-            account_name=account_name,
-            container_name=container_name,
-            blob_name=blob_path,
-            account_key=account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.now(UTC) + timedelta(days=7),
-            content_type="application/xml",
-            content_disposition=f"attachment; filename={os.path.basename(blob_path)}"
-        )
+        # Generate SAS token with read permission
+        with stage_timer("sas"):
+            sas_token = generate_blob_sas(
+                account_name=account_name,
+                container_name=container_name,
+                blob_name=blob_path,
+                account_key=account_key,
+                permission=BlobSasPermissions(read=True),
+                expiry=expiry,
+                content_type="application/xml",
+                content_disposition=f"attachment; filename={os.path.basename(blob_path)}"
+            )
 
         # Create the URL with SAS token
         blob_url = f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_path}?{sas_token}"
+        sas_url_cache.put(cache_key, blob_url, expiry)
 
         return blob_url
     except Exception as e:
         logging.error(f"Error generating blob storage link: {e}")
-        return "" 
\ No newline at end of file
+        return ""
+
+def get_sas_cache_stats():
+    """Return SAS URL cache hit/miss counts and size."""
+    return sas_url_cache.get_stats()
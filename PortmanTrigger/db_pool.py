@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+import weakref
+
+import pg8000
+
+from config import DATABASE_CONFIG, DB_POOL_CONFIG
+
+logger = logging.getLogger('PortmanTrigger')
+
+def connect(dbname):
+    """Open a new pg8000 connection to a database with the configured credentials."""
+    return pg8000.connect(
+        database=dbname,
+        user=DATABASE_CONFIG["user"],
+        password=DATABASE_CONFIG["password"],
+        host=DATABASE_CONFIG["host"],
+        port=DATABASE_CONFIG["port"]
+    )
+
+class PooledConnection:
+    """pg8000 connection proxy whose close() returns the connection to its pool.
+
+    A proxy that is garbage collected without being closed also gives its connection back, so
+    a missed close() cannot use up a pool slot for good.
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_release", weakref.finalize(self, pool.release, conn))
+
+    def close(self):
+        if self._conn is not None:
+            object.__setattr__(self, "_conn", None)
+            self._release()
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"Connection has been returned to the pool: {name}")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+class ConnectionPool:
+    """Thread-safe pool of pg8000 connections to one database.
+
+    Up to max_size connections are open at a time; acquire() blocks for up to
+    acquire_timeout_seconds when all of them are in use. Idle connections are checked with
+    SELECT 1 before reuse if they have not been used for health_check_interval_seconds, and
+    closed after max_idle_seconds as long as at least min_size connections stay open.
+    """
+
+    def __init__(self, dbname, min_size, max_size, max_idle_seconds, health_check_interval_seconds,
+                 acquire_timeout_seconds):
+        self.dbname = dbname
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.acquire_timeout_seconds = acquire_timeout_seconds
+        self._idle = []  # (connection, last used monotonic time), most recently used last
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def _connect(self):
+        return connect(self.dbname)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logger.info(f"Discarding broken pooled connection to '{self.dbname}': {e}")
+            return False
+
+    def _evict_idle(self, now):
+        """Close connections idle for longer than max_idle_seconds, keeping min_size open."""
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.max_idle_seconds):
+            conn, _ = self._idle.pop(0)
+            self._size -= 1
+            self._discard(conn)
+
+    def acquire(self):
+        """Return a PooledConnection, reusing an idle connection when possible."""
+        deadline = time.monotonic() + self.acquire_timeout_seconds
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    check = now - last_used > self.health_check_interval_seconds
+                elif self._size < self.max_size:
+                    conn, check = None, False
+                    self._size += 1
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise TimeoutError(f"Timed out waiting for a connection to '{self.dbname}'")
+                    self._condition.wait(remaining)
+                    continue
+
+            # Connect and health-check outside the lock so other threads are not blocked
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            elif check and not self._is_healthy(conn):
+                self._discard(conn)
+                with self._condition:
+                    self._size -= 1
+                continue
+            return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except Exception:
+            self._discard(conn)
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    def close(self):
+        """Close all idle connections. Connections in use are closed when they are released."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.min_size = 0
+            self.max_idle_seconds = -1
+        for conn, _ in idle:
+            self._discard(conn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(dbName):
+    """Return the process-wide connection pool for a database, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(dbName)
+        if pool is None:
+            pool = ConnectionPool(
+                dbName,
+                min_size=DB_POOL_CONFIG["min_size"],
+                max_size=DB_POOL_CONFIG["max_size"],
+                max_idle_seconds=DB_POOL_CONFIG["max_idle_seconds"],
+                health_check_interval_seconds=DB_POOL_CONFIG["health_check_interval_seconds"],
+                acquire_timeout_seconds=DB_POOL_CONFIG["acquire_timeout_seconds"]
+            )
+            _pools[dbName] = pool
+        return pool
+
+def close_connection_pools():
+    """Close and forget all connection pools (e.g. on shutdown or between tests)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def get_db_connection(dbName):
+    """Return a pooled connection to a specified database, or None if it cannot be opened.
+
+    Calling close() on the returned connection gives it back to the pool.
+    """
+    try:
+        return get_connection_pool(dbName).acquire()
+    except Exception as e:
+        logger.info(f"Error connecting to database '{dbName}': {e}")
+        return None
+
+def get_unpooled_connection(dbName):
+    """Return a new connection outside the pools, or None if it cannot be opened.
+
+    For one-off work (e.g. creating the database through the postgres system database) that
+    should not leave an idle connection in a pool; close() closes the connection.
+    """
+    try:
+        return connect(dbName)
+    except Exception as e:
+        logger.info(f"Error connecting to database '{dbName}': {e}")
+        return None
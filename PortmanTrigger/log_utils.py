@@ -0,0 +1,118 @@
+import itertools
+import json
+import logging
+import threading
+from config import LOGGING_CONFIG
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_configured = False
+_configure_lock = threading.Lock()
+_payload_counters = {}
+
+class LazyJSON:
+    """Serialise a value to JSON only when a handler actually formats the record."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, default=str)
+
+class EventMessage:
+    """Log message of a structured event, rendered as 'event key=value ...' when formatted."""
+
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        if not self.fields:
+            return self.event
+        return self.event + " " + " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with the fields of structured events."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            entry["event"] = event
+            entry.update(record.event_fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a structured event with named fields.
+
+    Nothing is formatted unless the level is enabled. The fields are attached to the record
+    (event, event_fields) for JSON output and log exporters, and rendered into the message for
+    plain text handlers.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, EventMessage(event, fields), extra={"event": event, "event_fields": fields},
+                   stacklevel=2)
+
+def log_payload(logger, kind, payload, sample_every=None):
+    """Log a full request payload at DEBUG, for every Nth payload of this kind only.
+
+    Returns True if the payload was logged.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    if sample_every is None:
+        sample_every = LOGGING_CONFIG["payload_sample_every"]
+    counter = _payload_counters.get(kind)
+    if counter is None:
+        counter = _payload_counters.setdefault(kind, itertools.count())
+    if next(counter) % max(sample_every, 1):
+        return False
+    logger.debug("%s payload: %s", kind, LazyJSON(payload), stacklevel=2)
+    return True
+
+def parse_module_levels(spec):
+    """Parse 'logger=LEVEL,...' into a dict of logger names to level names, skipping malformed parts."""
+    levels = {}
+    for part in spec.split(','):
+        name, separator, level = part.partition('=')
+        if separator and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging(force=False):
+    """Set up logging once per process.
+
+    A handler is only installed when the host has not installed one (the Functions worker
+    does), so this works both in Azure and from the command line. Per-logger levels from
+    LOG_MODULE_LEVELS are always applied.
+    """
+    global _configured
+    with _configure_lock:
+        if _configured and not force:
+            return
+        root = logging.getLogger()
+        if not root.handlers:
+            handler = logging.StreamHandler()
+            if LOGGING_CONFIG["format"] == "json":
+                handler.setFormatter(JsonFormatter())
+            else:
+                handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(LOGGING_CONFIG["level"])
+        for name, level in parse_module_levels(LOGGING_CONFIG["module_levels"]).items():
+            try:
+                logging.getLogger(name).setLevel(level)
+            except ValueError:
+                root.warning("Ignoring unknown log level %s for logger %s", level, name)
+        _configured = True
@@ -0,0 +1,244 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from config import METRICS_CONFIG
+from PortmanTrigger.log_utils import log_event
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    # Export is optional; summaries are still logged without the OpenTelemetry API
+    otel_metrics = None
+
+logger = logging.getLogger('PortmanTrigger')
+
+_current_run = contextvars.ContextVar("portman_run_metrics", default=None)
+
+class RunMetrics:
+    """Stage timings and counters of one pipeline run.
+
+    Stages may nest (e.g. decoding the response while port calls are normalised); each stage
+    is charged its own time only, so the stage times add up to the time covered by timers.
+    Nesting is tracked per thread: stages timed on worker threads (e.g. concurrent uploads) are
+    charged separately and run alongside the stage of the thread that started them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counters = {}
+        self.observations = {}  # name -> [count, total, max]
+        self._local = threading.local()  # .stack: [stage, started, seconds spent in nested stages]
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.elapsed = None
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start_stage(self, stage):
+        self._stack().append([stage, time.perf_counter(), 0.0])
+
+    def stop_stage(self):
+        stack = self._stack()
+        stage, started, nested = stack.pop()
+        elapsed = time.perf_counter() - started
+        if stack:
+            stack[-1][2] += elapsed
+        with self._lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                totals = self.stages[stage] = [0.0, 0]
+            totals[0] += elapsed - nested
+            totals[1] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        self.start_stage(stage)
+        try:
+            yield
+        finally:
+            self.stop_stage()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Record a measured value (e.g. a queue depth or latency) to report its mean and max."""
+        with self._lock:
+            totals = self.observations.get(name)
+            if totals is None:
+                self.observations[name] = [1, value, value]
+            else:
+                totals[0] += 1
+                totals[1] += value
+                totals[2] = max(totals[2], value)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._started
+
+    def summary(self):
+        """Return the run as a dict of total seconds, per-stage seconds and calls, and counters."""
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._started
+        timed = sum(seconds for seconds, _ in self.stages.values())
+        return {
+            "run": self.name,
+            "seconds": round(elapsed, 4),
+            "untimed_seconds": round(max(elapsed - timed, 0.0), 4),
+            "stages": {
+                stage: {"seconds": round(seconds, 4), "calls": calls}
+                for stage, (seconds, calls) in self.stages.items()
+            },
+            "counters": dict(self.counters),
+            "observations": {
+                name: {"count": count, "mean": round(total / count, 4), "max": round(maximum, 4)}
+                for name, (count, total, maximum) in self.observations.items()
+            }
+        }
+
+class OpenTelemetryExporter:
+    """Record run summaries as OpenTelemetry metrics."""
+
+    def __init__(self):
+        meter = otel_metrics.get_meter("portman")
+        self.run_duration = meter.create_histogram(
+            "portman.run.duration", unit="s", description="Duration of pipeline runs")
+        self.stage_duration = meter.create_histogram(
+            "portman.stage.duration", unit="s", description="Time spent per pipeline stage in a run")
+        self.events = meter.create_counter(
+            "portman.pipeline.events", description="Items counted by pipeline runs")
+        self.observations = meter.create_histogram(
+            "portman.pipeline.observation", description="Mean and max of values observed in a run")
+
+    def export(self, metrics):
+        summary = metrics.summary()
+        self.run_duration.record(summary["seconds"], {"run": metrics.name})
+        for stage, totals in summary["stages"].items():
+            self.stage_duration.record(totals["seconds"], {"run": metrics.name, "stage": stage})
+        for name, value in summary["counters"].items():
+            self.events.add(value, {"run": metrics.name, "name": name})
+        for name, stats in summary["observations"].items():
+            for stat in ("mean", "max"):
+                self.observations.record(stats[stat], {"run": metrics.name, "name": name, "stat": stat})
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def get_exporter():
+    """Return the process-wide exporter, or None if export is disabled or unavailable."""
+    global _exporter
+    if not METRICS_CONFIG["otel_export"] or otel_metrics is None:
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+                try:
+                    from azure.monitor.opentelemetry import configure_azure_monitor
+                    configure_azure_monitor()
+                except ImportError:
+                    logger.warning("azure-monitor-opentelemetry is not installed; metrics go to the "
+                                   "configured OpenTelemetry provider only")
+            _exporter = OpenTelemetryExporter()
+        return _exporter
+
+def report_run(metrics):
+    """Log the summary of a finished run and export it if configured."""
+    summary = metrics.summary()
+    fields = {"seconds": summary["seconds"], "untimed_seconds": summary["untimed_seconds"]}
+    for stage, totals in summary["stages"].items():
+        fields[f"{stage}_seconds"] = totals["seconds"]
+        fields[f"{stage}_calls"] = totals["calls"]
+    fields.update(summary["counters"])
+    for name, stats in summary["observations"].items():
+        fields[f"{name}_mean"] = stats["mean"]
+        fields[f"{name}_max"] = stats["max"]
+    log_event(logger, "run_summary", run=metrics.name, **fields)
+
+    exporter = get_exporter()
+    if exporter is not None:
+        try:
+            exporter.export(metrics)
+        except Exception as e:
+            logger.warning("Exporting metrics of run %s failed: %s", metrics.name, e)
+
+@contextmanager
+def run_metrics(name):
+    """Collect the stage timings and counters of a run and report them when it ends.
+
+    Yields the RunMetrics (None when metrics are disabled).
+    """
+    if not METRICS_CONFIG["enabled"]:
+        yield None
+        return
+    metrics = RunMetrics(name)
+    token = _current_run.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_run.reset(token)
+        metrics.finish()
+        report_run(metrics)
+
+def current_run():
+    """Return the RunMetrics of the run in progress in this context, if any."""
+    return _current_run.get()
+
+def with_run_context(func):
+    """Wrap func to run in a copy of the caller's context, e.g. on executor threads.
+
+    Threads do not inherit context variables, so without this, timers and counters used on a
+    worker thread would not see the run in progress. Every call gets its own copy, as one
+    context cannot be entered by several threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+def stage_timer(stage):
+    """Time a block as a stage of the current run (a no-op outside a run)."""
+    metrics = _current_run.get()
+    if metrics is None:
+        return nullcontext()
+    return metrics.timer(stage)
+
+def increment(name, value=1):
+    """Add to a counter of the current run (a no-op outside a run)."""
+    metrics = _current_run.get()
+    if metrics is not None:
+        metrics.increment(name, value)
+
+def observe(name, value):
+    """Record a measured value in the current run (a no-op outside a run)."""
+    metrics = _current_run.get()
+    if metrics is not None:
+        metrics.observe(name, value)
+
+def timed_iter(stage, iterable):
+    """Charge the time spent producing each item of an iterable to a stage of the current run.
+
+    Time spent by the consumer between items is not included. Returns the iterable unchanged
+    outside a run.
+    """
+    metrics = _current_run.get()
+    if metrics is None:
+        return iterable
+    return _timed_iter(metrics, stage, iter(iterable))
+
+def _timed_iter(metrics, stage, iterator):
+    while True:
+        metrics.start_stage(stage)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            metrics.stop_stage()
+        yield item
@@ -0,0 +1,246 @@
+import logging
+import threading
+
+from config import DATABASE_CONFIG
+from PortmanTrigger.db_pool import get_db_connection, get_unpooled_connection
+
+logger = logging.getLogger('PortmanTrigger')
+
+# Serialises migrations between worker processes (arbitrary application-wide key)
+MIGRATION_LOCK_KEY = 71304001
+
+# Ordered schema migrations as (version, description, statements). Never edit a released
+# migration; append a new one instead. Statements are written with IF NOT EXISTS so databases
+# bootstrapped before schema versioning are brought up to date without errors.
+MIGRATIONS = [
+    (1, "Create voyages and arrivals tables", [
+        """
+        CREATE TABLE IF NOT EXISTS voyages (
+            portCallId INTEGER PRIMARY KEY,
+            imoLloyds INTEGER,
+            mmsi INTEGER,
+            vesselTypeCode TEXT,
+            vesselName TEXT,
+            prevPort TEXT,
+            portToVisit TEXT,
+            nextPort TEXT,
+            agentName TEXT,
+            shippingCompany TEXT,
+            eta TIMESTAMP NULL,
+            ata TIMESTAMP NULL,
+            portAreaCode TEXT,
+            portAreaName TEXT,
+            berthCode TEXT,
+            berthName TEXT,
+            etd TIMESTAMP NULL,
+            atd TIMESTAMP NULL,
+            passengersOnArrival INTEGER DEFAULT 0,
+            passengersOnDeparture INTEGER DEFAULT 0,
+            crewOnArrival INTEGER DEFAULT 0,
+            crewOnDeparture INTEGER DEFAULT 0,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS arrivals (
+            id SERIAL PRIMARY KEY,
+            portCallId INTEGER,
+            eta TIMESTAMP NULL,
+            old_ata TIMESTAMP NULL,
+            ata TIMESTAMP NOT NULL,
+            vesselName TEXT,
+            portAreaName TEXT,
+            berthName TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    ]),
+    (2, "Add XML URL and mmsi columns", [
+        "ALTER TABLE voyages ADD COLUMN IF NOT EXISTS noa_xml_url TEXT DEFAULT NULL;",
+        "ALTER TABLE voyages ADD COLUMN IF NOT EXISTS ata_xml_url TEXT DEFAULT NULL;",
+        "ALTER TABLE voyages ADD COLUMN IF NOT EXISTS vid_xml_url TEXT DEFAULT NULL;",
+        "ALTER TABLE voyages ADD COLUMN IF NOT EXISTS mmsi INTEGER DEFAULT NULL;",
+        "ALTER TABLE arrivals ADD COLUMN IF NOT EXISTS ata_xml_url TEXT DEFAULT NULL;"
+    ]),
+    (3, "Create xml_outbox table for pending VID/NOA/ATA documents", [
+        """
+        CREATE TABLE IF NOT EXISTS xml_outbox (
+            id SERIAL PRIMARY KEY,
+            portCallId INTEGER NOT NULL,
+            formality TEXT NOT NULL,
+            event_timestamp TIMESTAMP NOT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT NULL,
+            xml_url TEXT NULL,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (portCallId, formality, event_timestamp)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS xml_outbox_pending_idx ON xml_outbox (next_attempt_at) WHERE status IN ('pending', 'processing');"
+    ]),
+    (4, "Add voyages content hash for change detection", [
+        "ALTER TABLE voyages ADD COLUMN IF NOT EXISTS content_hash TEXT DEFAULT NULL;"
+    ]),
+    (5, "Create fetch_state table for incremental API fetches", [
+        """
+        CREATE TABLE IF NOT EXISTS fetch_state (
+            source TEXT PRIMARY KEY,
+            high_water_mark TIMESTAMPTZ NULL,
+            etag TEXT NULL,
+            last_modified TEXT NULL,
+            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    ]),
+    (6, "Create backfill_checkpoints table", [
+        """
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            directory TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_size BIGINT NOT NULL,
+            saved_count INTEGER DEFAULT 0,
+            completed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (directory, filename)
+        );
+        """
+    ]),
+    (7, "Create slack_outbox table for queued Slack notifications", [
+        """
+        CREATE TABLE IF NOT EXISTS slack_outbox (
+            id SERIAL PRIMARY KEY,
+            blob_name TEXT NOT NULL,
+            xml_type TEXT NOT NULL,
+            port TEXT NULL,
+            payload JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT NULL,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS slack_outbox_pending_idx ON slack_outbox (next_attempt_at) WHERE status IN ('pending', 'processing');"
+    ]),
+    (8, "Create rate_limit_buckets table for cluster-wide rate limits", [
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            name TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            blocked_until TIMESTAMPTZ NULL
+        );
+        """
+    ]),
+    (9, "Create notification_index table for deduplicating blob trigger deliveries", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_index (
+            key BYTEA PRIMARY KEY,
+            expires TIMESTAMP NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS notification_index_expires_idx ON notification_index (expires);"
+    ])
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_version = None
+_schema_lock = threading.Lock()
+
+def create_database_if_missing(db_name):
+    """Create the database through the postgres system database if it doesn't exist.
+
+    Uses an unpooled connection, so no connection to the postgres database stays open for the
+    life of the worker.
+    """
+    conn = get_unpooled_connection("postgres")
+    if conn is None:
+        return
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_name,))
+        if not cursor.fetchone():
+            logger.info(f"Database '{db_name}' does not exist. Creating...")
+            cursor.execute(f"CREATE DATABASE {db_name};")
+        cursor.close()
+    finally:
+        conn.close()
+
+def apply_migrations(conn, migrations=MIGRATIONS):
+    """Apply pending migrations in one transaction and return the resulting schema version.
+
+    An advisory lock makes concurrently starting workers wait for each other, so every
+    migration runs exactly once.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+        current_version = cursor.fetchone()[0]
+
+        for version, description, statements in migrations:
+            if version <= current_version:
+                continue
+            logger.info(f"Applying schema migration {version}: {description}")
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description)
+            )
+            current_version = version
+
+        conn.commit()
+        return current_version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def ensure_database_schema():
+    """Bring the database schema up to date once per worker process.
+
+    The first call creates the database if needed and applies pending migrations; later calls
+    return the cached schema version without touching the database. Returns None (and retries
+    on the next call) if the schema could not be verified.
+    """
+    global _schema_version
+    if _schema_version is not None:
+        return _schema_version
+
+    with _schema_lock:
+        if _schema_version is None:
+            try:
+                create_database_if_missing(DATABASE_CONFIG["dbname"])
+                conn = get_db_connection(DATABASE_CONFIG["dbname"])
+                if conn is None:
+                    return None
+                try:
+                    _schema_version = apply_migrations(conn)
+                finally:
+                    conn.close()
+                logger.info(f"Database schema is at version {_schema_version}.")
+            except Exception as e:
+                logger.info(f"Error migrating database schema: {e}")
+        return _schema_version
+
+def reset_schema_cache():
+    """Forget the cached schema version so the next ensure_database_schema() checks again."""
+    global _schema_version
+    with _schema_lock:
+        _schema_version = None
@@ -1,26 +1,14 @@
 import logging
 import json
 import azure.functions as func
-import pg8000
-from config import DATABASE_CONFIG, XML_CONVERTER_CONFIG
-import requests
+from config import DATABASE_CONFIG
+from PortmanTrigger.db_pool import get_db_connection
+from PortmanTrigger.log_utils import log_payload
+from PortmanTrigger.xml_client import get_converter_transport
 import os
 from datetime import datetime
 
-def get_db_connection(dbName):
-    """Establish and return a database connection to a specified database."""
-    try:
-        conn = pg8000.connect(
-            database=dbName,
-            user=DATABASE_CONFIG["user"],
-            password=DATABASE_CONFIG["password"],
-            host=DATABASE_CONFIG["host"],
-            port=DATABASE_CONFIG["port"]
-        )
-        return conn
-    except Exception as e:
-        logging.error(f"Error connecting to database '{dbName}': {e}")
-        return None
+logger = logging.getLogger('PortmanTrigger')
 
 def get_voyage_data(portCallId):
     """Get voyage data from the database based on portCallId."""
@@ -146,69 +134,45 @@ def noa_generator(req: func.HttpRequest) -> func.HttpResponse:
         if field in voyage_data and voyage_data[field] is None:
             voyage_data[field] = ""  # Replace None with empty string
     
-    # Call the XML Storage Function
-    xml_converterfunction_url = XML_CONVERTER_CONFIG["function_url"]
-    xml_converter_function_key = XML_CONVERTER_CONFIG["function_key"]
+    # Call the XML converter through the configured transport
+    transport = get_converter_transport()
     
-    # Add the function key to the URL if it exists
-    if xml_converter_function_key:
-        if "?" in xml_converterfunction_url:
-            xml_converterfunction_url += f"&code={xml_converter_function_key}"
-        else:
-            xml_converterfunction_url += f"?code={xml_converter_function_key}"
-    
-    logging.info(f"Calling xml-converter for NOA: {xml_converterfunction_url}")
+    logging.info(f"Calling xml-converter for NOA over {transport.name} transport")
     
-    # Send the voyage data to the function for NOA generation
+    # Send the voyage data to the converter for NOA generation
     try:
-        # Log the payload for debugging
-        logging.info(f"Payload to XML converter: {json.dumps({'portcall_data': voyage_data, 'formality_type': 'NOA'})}")
+        # Log the payload for debugging (sampled, DEBUG only)
+        log_payload(logger, "NOA converter request", {'portcall_data': voyage_data, 'formality_type': 'NOA'})
         
-        response = requests.post(
-            xml_converterfunction_url,
-            json={"portcall_data": voyage_data, "formality_type": "NOA"},
-            headers={"Content-Type": "application/json"}
-        )
+        response_data = transport.convert("NOA", voyage_data)
+        # Get SAS URL from the response
+        sas_url = response_data.get('sasUrl')
         
-        if response.status_code == 200:
-            response_data = response.json()
-            # Get SAS URL from the response
-            sas_url = response_data.get('sasUrl')
-            
-            if not sas_url:
-                return func.HttpResponse(
-                    json.dumps({"status": "error", "message": "No URL found in XML converter response"}),
-                    mimetype="application/json",
-                    status_code=500
-                )
-            
-            # Update the database with the NOA XML URL
-            if update_noa_xml_url(portCallId, sas_url):
-                return func.HttpResponse(
-                    json.dumps({
-                        "status": "success", 
-                        "message": f"NOA XML generated and URL updated for portCallId {portCallId}",
-                        "sasUrl": sas_url
-                    }),
-                    mimetype="application/json"
-                )
-            else:
-                return func.HttpResponse(
-                    json.dumps({
-                        "status": "partial", 
-                        "message": f"NOA XML generated but URL update failed for portCallId {portCallId}",
-                        "sasUrl": sas_url
-                    }),
-                    mimetype="application/json",
-                    status_code=500
-                )
+        if not sas_url:
+            return func.HttpResponse(
+                json.dumps({"status": "error", "message": "No URL found in XML converter response"}),
+                mimetype="application/json",
+                status_code=500
+            )
+        
+        # Update the database with the NOA XML URL
+        if update_noa_xml_url(portCallId, sas_url):
+            return func.HttpResponse(
+                json.dumps({
+                    "status": "success", 
+                    "message": f"NOA XML generated and URL updated for portCallId {portCallId}",
+                    "sasUrl": sas_url
+                }),
+                mimetype="application/json"
+            )
         else:
             return func.HttpResponse(
                 json.dumps({
-                    "status": "error", 
-                    "message": f"XML converter failed with status {response.status_code}: {response.text}"
+                    "status": "partial", 
+                    "message": f"NOA XML generated but URL update failed for portCallId {portCallId}",
+                    "sasUrl": sas_url
                 }),
-                mimetype="application/json", 
+                mimetype="application/json",
                 status_code=500
             )
     except Exception as e:
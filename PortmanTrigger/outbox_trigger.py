@@ -0,0 +1,10 @@
+import logging
+import azure.functions as func
+from PortmanTrigger.xml_dispatcher import dispatch_xml_outbox
+
+def outbox_trigger(outboxTimer: func.TimerRequest) -> None:
+    logging.info("Outbox-trigger function processed a request.")
+
+    dispatch_xml_outbox()
+
+    logging.info("XML outbox dispatched successfully.")
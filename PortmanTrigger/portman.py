@@ -1,52 +1,38 @@
-import sqlite3
 import requests
-import pg8000
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
 import argparse
 import json
 import glob
 import natsort
 import logging
-
-from config import DATABASE_CONFIG, XML_CONVERTER_CONFIG
-# Import the blob utilities
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 try:
-    from PortmanTrigger.blob_utils import generate_blob_storage_link
+    import ijson
 except ImportError:
-    try:
-        # Try alternative import path
-        from blob_utils import generate_blob_storage_link
-    except ImportError:
-        # Fallback definition if the module can't be imported
-        def generate_blob_storage_link(blob_name, connection_string=None):
-            log("Warning: generate_blob_storage_link function not available")
-            return ""
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger('PortmanTrigger')
+    # Fall back to json.load if the streaming parser is not installed
+    ijson = None
 
-def log(message):
-    logger.info(message)
+from config import DATABASE_CONFIG, DIGITRAFFIC_CONFIG, INGEST_CONFIG, BACKFILL_CONFIG
+from PortmanTrigger.db_pool import get_db_connection
+from PortmanTrigger.migrations import apply_migrations, create_database_if_missing, ensure_database_schema
+from PortmanTrigger.xml_client import request_xml_document, store_xml_urls
+from PortmanTrigger.log_utils import configure_logging, log_event
+from PortmanTrigger.metrics import increment, run_metrics, stage_timer, timed_iter
+from PortmanTrigger.rate_limit import get_rate_limiter, parse_retry_after
+from datetime_utils import parse_iso_datetime, to_minute_datetime
 
-def get_db_connection(dbName):
-    """Establish and return a database connection to a specified database."""
-    try:
-        conn = pg8000.connect(
-            database=dbName,
-            user=DATABASE_CONFIG["user"],
-            password=DATABASE_CONFIG["password"],
-            host=DATABASE_CONFIG["host"],
-            port=DATABASE_CONFIG["port"]
-        )
-        return conn
-    except Exception as e:
-        log(f"Error connecting to database '{dbName}': {e}")
-        return None
+DIGITRAFFIC_SOURCE = "digitraffic-port-calls"
+
+configure_logging()
+logger = logging.getLogger('PortmanTrigger')
+
+def log(message, *args):
+    """Log at INFO; pass values as args so they are only formatted if the record is emitted."""
+    logger.info(message, *args, stacklevel=2)
 
 def get_tracked_vessels():
     """Get IMO numbers to track from environment variables or command-line arguments."""
@@ -72,198 +58,47 @@ def get_tracked_vessels():
 
 
 def create_database_and_tables():
-    """Create the database and the necessary tables if they don't exist."""
+    """Create the database if needed and apply all pending schema migrations."""
     try:
         log("Checking if database and tables exist...")
-
-        # Connect to PostgreSQL system database to check existence
-        conn = get_db_connection("postgres")
-        if conn is None:
-            return
-        conn.autocommit = True
-        cursor = conn.cursor()
-
-        # Create database if it doesn't exist
-        db_name = DATABASE_CONFIG["dbname"]
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_name,))
-        if not cursor.fetchone():
-            log("Database '" +  db_name + "' does not exist. Creating...")
-            cursor.execute(f"CREATE DATABASE {db_name};")
-        cursor.close()
-        conn.close()
-
-        # Connect to the created database
-        conn = get_db_connection(db_name)
-        if conn is None:
-            return
-        cursor = conn.cursor()
-
-        # Create the 'voyages' table
-        create_voyages_table = """
-        CREATE TABLE IF NOT EXISTS voyages (
-            portCallId INTEGER PRIMARY KEY,
-            imoLloyds INTEGER,
-            mmsi INTEGER,
-            vesselTypeCode TEXT,
-            vesselName TEXT,
-            prevPort TEXT,
-            portToVisit TEXT,
-            nextPort TEXT,
-            agentName TEXT,
-            shippingCompany TEXT,
-            eta TIMESTAMP NULL,
-            ata TIMESTAMP NULL,
-            portAreaCode TEXT,
-            portAreaName TEXT,
-            berthCode TEXT,
-            berthName TEXT,
-            etd TIMESTAMP NULL,
-            atd TIMESTAMP NULL,
-            passengersOnArrival INTEGER DEFAULT 0,
-            passengersOnDeparture INTEGER DEFAULT 0,
-            crewOnArrival INTEGER DEFAULT 0,
-            crewOnDeparture INTEGER DEFAULT 0,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        cursor.execute(create_voyages_table)
-
-        # Create the 'arrivals' table
-        create_arrivals_table = """
-        CREATE TABLE IF NOT EXISTS arrivals (
-            id SERIAL PRIMARY KEY,
-            portCallId INTEGER,
-            eta TIMESTAMP NULL,
-            old_ata TIMESTAMP NULL,
-            ata TIMESTAMP NOT NULL,
-            vesselName TEXT,
-            portAreaName TEXT,
-            berthName TEXT,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        cursor.execute(create_arrivals_table)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        log("Database and tables setup complete.")
-    except Exception as e:
-        log(f"Error setting up database and tables: {e}")
-
-def update_database_schema():
-    """Update database schema by adding new columns if they don't exist."""
-    try:
-        log("Checking for schema updates...")
+        create_database_if_missing(DATABASE_CONFIG["dbname"])
         conn = get_db_connection(DATABASE_CONFIG["dbname"])
         if conn is None:
             return
-        
-        cursor = conn.cursor()
-        
-        # Check and update voyages table schema
-        cursor.execute("""
-            SELECT column_name FROM information_schema.columns 
-            WHERE table_name = 'voyages' AND table_schema = 'public'
-        """)
-        existing_columns = [row[0].lower() for row in cursor.fetchall()]
-        log(f"Current columns in voyages table: {existing_columns}")
-        
-        # Add new columns to voyages table if they don't exist
-        columns_to_add = {
-            'noa_xml_url': 'TEXT DEFAULT NULL',
-            'ata_xml_url': 'TEXT DEFAULT NULL',
-            'vid_xml_url': 'TEXT DEFAULT NULL',
-            'mmsi': 'INTEGER DEFAULT NULL'
-        }
-        
-        for column_name, column_def in columns_to_add.items():
-            if column_name.lower() not in existing_columns:
-                log(f"Adding column '{column_name}' to voyages table")
-                cursor.execute(f"ALTER TABLE voyages ADD COLUMN {column_name} {column_def};")
-                conn.commit()
-                # Verify the column was added successfully
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns 
-                    WHERE table_name = 'voyages' AND column_name = %s AND table_schema = 'public'
-                """, (column_name,))
-                if cursor.fetchone():
-                    log(f"Successfully added column '{column_name}' to voyages table")
-                else:
-                    log(f"Failed to add column '{column_name}' to voyages table. Will retry.")
-                    try:
-                        # Try one more time with a different approach
-                        cursor.execute(f"ALTER TABLE voyages ADD COLUMN IF NOT EXISTS {column_name} {column_def};")
-                        conn.commit()
-                        log(f"Second attempt to add column '{column_name}' completed")
-                    except Exception as inner_e:
-                        log(f"Second attempt to add column '{column_name}' failed: {inner_e}")
-        
-        # Check and update arrivals table schema
-        cursor.execute("""
-            SELECT column_name FROM information_schema.columns 
-            WHERE table_name = 'arrivals' AND table_schema = 'public'
-        """)
-        existing_columns = [row[0].lower() for row in cursor.fetchall()]
-        log(f"Current columns in arrivals table: {existing_columns}")
-        
-        # Add new columns to arrivals table if they don't exist
-        columns_to_add = {
-            'ata_xml_url': 'TEXT DEFAULT NULL'
-        }
-        
-        for column_name, column_def in columns_to_add.items():
-            if column_name.lower() not in existing_columns:
-                log(f"Adding column '{column_name}' to arrivals table")
-                cursor.execute(f"ALTER TABLE arrivals ADD COLUMN {column_name} {column_def};")
-                conn.commit()
-                # Verify the column was added successfully
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns 
-                    WHERE table_name = 'arrivals' AND column_name = %s AND table_schema = 'public'
-                """, (column_name,))
-                if cursor.fetchone():
-                    log(f"Successfully added column '{column_name}' to arrivals table")
-                else:
-                    log(f"Failed to add column '{column_name}' to arrivals table. Will retry.")
-                    try:
-                        # Try one more time with a different approach
-                        cursor.execute(f"ALTER TABLE arrivals ADD COLUMN IF NOT EXISTS {column_name} {column_def};")
-                        conn.commit()
-                        log(f"Second attempt to add column '{column_name}' completed")
-                    except Exception as inner_e:
-                        log(f"Second attempt to add column '{column_name}' failed: {inner_e}")
-        
-        cursor.close()
-        conn.close()
-        log("Schema updates complete.")
+        try:
+            version = apply_migrations(conn)
+        finally:
+            conn.close()
+        log(f"Database and tables setup complete. Schema version: {version}")
     except Exception as e:
-        log(f"Error updating database schema: {e}")
+        log(f"Error setting up database and tables: {e}")
 
-def parse_arguments():
+def parse_arguments(argv=None):
     """Parse command-line arguments and environment variables."""
     parser = argparse.ArgumentParser(description="Portman JSON Input Options")
     parser.add_argument("--input-file", help="Path to a JSON input file")
     parser.add_argument("--input-dir", help="Directory containing JSON files (portnet*.json)")
     parser.add_argument("--imo", help="Comma-separated list of IMO numbers to track")
-    args = parser.parse_args()
+    parser.add_argument("--workers", type=int, help="Number of worker processes parsing backfill files")
+    args = parser.parse_args(argv)
 
     return {
         "input_file": args.input_file or os.getenv("INPUT_FILE"),
         "input_dir": args.input_dir or os.getenv("INPUT_DIR"),
-        "tracked_vessels": set(map(int, args.imo.split(","))) if args.imo else set(map(int, os.getenv("TRACKED_VESSELS", "").split(","))) if os.getenv("TRACKED_VESSELS") else None
+        "tracked_vessels": set(map(int, args.imo.split(","))) if args.imo else set(map(int, os.getenv("TRACKED_VESSELS", "").split(","))) if os.getenv("TRACKED_VESSELS") else None,
+        "workers": get_backfill_workers(args.workers)
     }
 
-def get_json_source(input_file, input_dir, tracked_vessels):
+def get_json_source(input_file, input_dir, tracked_vessels, workers=None):
     """Determine JSON data source: single file or directory of files."""
     if input_file:
         log(f"Reading JSON from file: {input_file}")
-        return read_json_from_file(input_file)
+        read_json_file_in_batches(input_file, tracked_vessels)  # Streams the file in batches
+        return None  # Processing is already handled
 
     elif input_dir:
         log(f"Reading JSON files from directory: {input_dir}")
-        read_json_from_directory(input_dir, tracked_vessels)  # Now processes files one by one
+        read_json_from_directory(input_dir, tracked_vessels, workers=workers)  # Processes files in natsort order
         return None  # Processing is already handled
 
     log("No input file or directory specified. Fetching from API instead.")
@@ -278,48 +113,319 @@ def read_json_from_file(filepath):
         log(f"Error reading JSON file {filepath}: {e}")
         return None
 
-def read_json_from_directory(directory, tracked_vessels, conn=None):
-    """Read and process each JSON file separately, saving its data to the database."""
+def iter_port_calls(file):
+    """Yield the entries of a port call document's portCalls array one at a time.
+
+    file is a binary file-like object. With ijson installed the document is parsed
+    incrementally, so memory use does not grow with the document size.
+    """
+    if ijson is None:
+        data = json.load(file)
+        yield from (data.get("portCalls") or []) if isinstance(data, dict) else data
+        return
+    yield from ijson.items(file, "portCalls.item", use_float=True)
+
+def save_port_calls_in_batches(port_calls, tracked_vessels=None, conn=None, batch_size=None):
+    """Normalise and save port calls from an iterable in fixed-size batches.
+
+    Only one PortCallBatch is held in memory at a time. Each batch is saved and committed by
+    save_results_to_db. Returns the number of port calls saved.
+    """
+    batch_size = batch_size or INGEST_CONFIG["batch_size"]
+    saved_count = 0
+    # Port calls are decoded lazily, so decoding happens while batches are being normalised
+    batches = iter_port_call_batches(timed_iter("decode", port_calls), tracked_vessels, batch_size)
+    for batch in timed_iter("process", batches):
+        save_results_to_db(batch, conn)
+        saved_count += len(batch)
+    log(f"Saved {saved_count} port calls in batches of {batch_size}.")
+    return saved_count
+
+def read_json_file_in_batches(filepath, tracked_vessels, conn=None):
+    """Stream the port calls of a JSON file into the database in batches."""
+    with open(filepath, "rb") as file:
+        return save_port_calls_in_batches(iter_port_calls(file), tracked_vessels, conn)
+
+def parse_json_file(filepath, tracked_vessels=None):
+    """Parse and normalise all port calls of one backfill file into batches. Runs in a worker process."""
+    with open(filepath, "rb") as file:
+        return list(iter_port_call_batches(iter_port_calls(file), tracked_vessels))
+
+def get_backfill_workers(value=None):
+    """Return the number of backfill worker processes for a requested value.
+
+    Missing or non-numeric values give the configured default; the result is clamped to
+    between 1 and BACKFILL_CONFIG["max_workers"].
+    """
+    workers = BACKFILL_CONFIG["workers"]
+    if value is not None and value != "":
+        try:
+            workers = int(value)
+        except (TypeError, ValueError):
+            logger.warning("Invalid number of backfill workers %r, using %d", value, workers)
+    return max(1, min(workers, BACKFILL_CONFIG["max_workers"]))
+
+def iter_parsed_files(filepaths, tracked_vessels, workers):
+    """Parse files in a process pool and yield (filepath, batches, error) in input order.
+
+    At most two files per worker are parsed ahead of the file being written, which bounds
+    memory use while keeping the workers busy.
+    """
+    filepaths = iter(filepaths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque(
+            (filepath, executor.submit(parse_json_file, filepath, tracked_vessels))
+            for filepath in islice(filepaths, workers * 2)
+        )
+        while pending:
+            filepath, future = pending.popleft()
+            next_filepath = next(filepaths, None)
+            if next_filepath is not None:
+                pending.append((next_filepath, executor.submit(parse_json_file, next_filepath, tracked_vessels)))
+            try:
+                yield filepath, future.result(), None
+            except Exception as e:
+                yield filepath, None, e
+
+def get_backfill_checkpoints(cursor, directory):
+    """Return {filename: file_size} for the files of a directory that were fully imported."""
+    cursor.execute("SELECT filename, file_size FROM backfill_checkpoints WHERE directory = %s;", (directory,))
+    return {filename: file_size for filename, file_size in cursor.fetchall()}
+
+def record_backfill_checkpoint(cursor, directory, filepath, saved_count):
+    """Mark a backfill file as fully imported."""
+    cursor.execute("""
+        INSERT INTO backfill_checkpoints (directory, filename, file_size, saved_count, completed)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (directory, filename) DO UPDATE SET
+            file_size = EXCLUDED.file_size,
+            saved_count = EXCLUDED.saved_count,
+            completed = CURRENT_TIMESTAMP;
+    """, (directory, os.path.basename(filepath), os.path.getsize(filepath), saved_count))
+
+def read_json_from_directory(directory, tracked_vessels, conn=None, workers=None):
+    """Read and process each JSON file separately, saving its data to the database.
+
+    Files are written in natsort order so that ETA/ATA changes of a port call are detected in
+    the order the snapshots were taken. With more than one worker, files are parsed and
+    normalised in a process pool while earlier files are being written. Every fully imported
+    file is recorded in the backfill_checkpoints table and skipped when the directory is
+    imported again, unless its size has changed.
+    """
+    workers = get_backfill_workers(workers)
+    connection_managed_elsewhere = conn is not None
     try:
+        if conn is None:
+            conn = get_db_connection(DATABASE_CONFIG["dbname"])
+            if conn is None:
+                raise Exception("Failed to connect to database")
+
         file_pattern = os.path.join(directory, "portnet*.json")  # Match 'portnet*.json'
         files = glob.glob(file_pattern)
         sorted_files = natsort.natsorted(files)
 
         log(f"Found {len(sorted_files)} matching JSON files in {directory}: {sorted_files}")
 
-        for filepath in sorted_files:
+        checkpoint_directory = os.path.abspath(directory)
+        cursor = conn.cursor()
+        checkpoints = get_backfill_checkpoints(cursor, checkpoint_directory) if BACKFILL_CONFIG["resume"] else {}
+        pending_files = [
+            filepath for filepath in sorted_files
+            if checkpoints.get(os.path.basename(filepath)) != os.path.getsize(filepath)
+        ]
+        if len(pending_files) < len(sorted_files):
+            log(f"Resuming backfill: {len(sorted_files) - len(pending_files)} files already imported.")
+
+        if workers > 1:
+            log(f"Parsing files with {workers} worker processes.")
+            # Only the time spent waiting for the workers shows up in this process
+            parsed_files = timed_iter("parse_wait", iter_parsed_files(pending_files, tracked_vessels, workers))
+        else:
+            parsed_files = ((filepath, None, None) for filepath in pending_files)
+
+        for filepath, batches, error in parsed_files:
             try:
                 log(f"Processing file: {filepath}")
-                with open(filepath, "r", encoding="utf-8") as file:
-                    data = json.load(file)
+                if error is not None:
+                    raise error
+                if batches is None:
+                    saved_count = read_json_file_in_batches(filepath, tracked_vessels, conn)
+                else:
+                    for batch in batches:
+                        save_results_to_db(batch, conn)
+                    saved_count = sum(len(batch) for batch in batches)
 
-                if "portCalls" in data and isinstance(data["portCalls"], list):
-                    results = process_query(data, tracked_vessels)
-                    save_results_to_db(results, conn)  # Save after processing each file
-                    log(f"Finished processing {filepath}, {len(results)} voyages saved.")
+                record_backfill_checkpoint(cursor, checkpoint_directory, filepath, saved_count)
+                conn.commit()
+                if saved_count:
+                    log(f"Finished processing {filepath}, {saved_count} voyages saved.")
                 else:
                     log(f"Skipping file {filepath}: No valid 'portCalls' data found.")
 
             except Exception as e:
+                conn.rollback()
                 log(f"Skipping file {filepath} due to error: {e}")
+        cursor.close()
 
     except Exception as e:
         log(f"Error processing JSON directory {directory}: {e}")
+    finally:
+        if conn is not None and not connection_managed_elsewhere:
+            conn.close()
 
 
-def fetch_data_from_api():
-    """Fetch JSON data from the API."""
-    url = "https://meri.digitraffic.fi/api/port-call/v1/port-calls"
-    log("Fetching data from the API...")
+def fetch_data_from_api(since=None, validators=None, stream=False):
+    """Fetch JSON data from the API.
+
+    If since is given, only port calls updated on or after it are requested. validators is an
+    optional dict with the "etag" and "last_modified" of the previous response; they are sent as
+    conditional request headers and replaced with the values of this response. With stream=True
+    an iterator over the port calls is returned instead of the whole document, parsing the
+    response body while it is downloaded. Returns None if the request fails or the server
+    answers 304 Not Modified.
+    """
+    url = DIGITRAFFIC_CONFIG["url"]
+    params = {}
+    headers = {"Accept-Encoding": "gzip", "Digitraffic-User": DIGITRAFFIC_CONFIG["user"]}
+    if since is not None:
+        params["from"] = format_api_timestamp(since)
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    limiter = get_rate_limiter("digitraffic")
+    if not limiter.acquire():
+        log("Digitraffic rate limit reached, skipping this fetch.")
+        return None
+
+    log(f"Fetching data from the API{' updated since ' + params['from'] if params else ''}...")
     try:
-        response = requests.get(url)
+        with stage_timer("fetch"):
+            response = requests.get(url, params=params, headers=headers, timeout=DIGITRAFFIC_CONFIG["timeout"],
+                                    stream=stream)
+        if response.status_code == 304:
+            log("Data not modified since the previous fetch.")
+            response.close()
+            return None
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            log(f"Rate limited by Digitraffic, pausing requests for {retry_after}s.")
+            limiter.block_for(retry_after)
+            response.close()
+            return None
         response.raise_for_status()
+        if validators is not None:
+            validators["etag"] = response.headers.get("ETag")
+            validators["last_modified"] = response.headers.get("Last-Modified")
+        if stream:
+            return iter_response_port_calls(response)
         log("Data fetched successfully.")
-        return response.json()
+        with stage_timer("decode"):
+            return response.json()
     except requests.exceptions.RequestException as e:
         log(f"Error fetching data from API: {e}")
         return None
 
+def iter_response_port_calls(response):
+    """Yield port calls from a streamed API response and close it when done."""
+    try:
+        # Let urllib3 undo the gzip transfer encoding while ijson reads the raw stream
+        response.raw.decode_content = True
+        yield from iter_port_calls(response.raw)
+    finally:
+        response.close()
+
+def parse_api_timestamp(timestamp):
+    """Parse an API timestamp such as 2024-03-12T08:00:00.000+00:00 into an aware datetime."""
+    parsed = parse_iso_datetime(timestamp) if timestamp else None
+    if parsed is None:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def format_api_timestamp(timestamp):
+    """Format a datetime as the UTC ISO-8601 string accepted by the API's 'from' parameter."""
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def track_high_water_mark(port_calls, state):
+    """Pass port calls through, recording the latest portCallTimestamp in state["high_water_mark"]."""
+    for entry in port_calls:
+        timestamp = parse_api_timestamp(entry.get("portCallTimestamp"))
+        if timestamp and (state["high_water_mark"] is None or timestamp > state["high_water_mark"]):
+            state["high_water_mark"] = timestamp
+        yield entry
+
+def get_fetch_state(source=DIGITRAFFIC_SOURCE):
+    """Load the stored high-water mark and HTTP validators for an API source."""
+    state = {"high_water_mark": None, "etag": None, "last_modified": None}
+    conn = get_db_connection(DATABASE_CONFIG["dbname"])
+    if conn is None:
+        return state
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT high_water_mark, etag, last_modified FROM fetch_state WHERE source = %s;", (source,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        if row:
+            state["high_water_mark"], state["etag"], state["last_modified"] = row
+    except Exception as e:
+        log(f"Error reading fetch state for {source}: {e}")
+    finally:
+        conn.close()
+    return state
+
+def save_fetch_state(state, source=DIGITRAFFIC_SOURCE):
+    """Persist the high-water mark and HTTP validators for an API source.
+
+    The stored high-water mark never moves backwards.
+    """
+    conn = get_db_connection(DATABASE_CONFIG["dbname"])
+    if conn is None:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO fetch_state (source, high_water_mark, etag, last_modified, modified)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET
+                high_water_mark = GREATEST(fetch_state.high_water_mark, EXCLUDED.high_water_mark),
+                etag = EXCLUDED.etag,
+                last_modified = EXCLUDED.last_modified,
+                modified = CURRENT_TIMESTAMP;
+        """, (source, state["high_water_mark"], state["etag"], state["last_modified"]))
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        log(f"Error saving fetch state for {source}: {e}")
+    finally:
+        conn.close()
+
+def fetch_port_call_updates():
+    """Stream port calls updated since the stored high-water mark.
+
+    The request window starts overlap_seconds before the high-water mark so that port calls
+    committed out of order upstream are not missed; re-reading them is harmless because the
+    voyages upsert is idempotent. Returns an iterator over the port calls (None if nothing
+    changed) and the fetch state, which is updated while the iterator is consumed and should be
+    persisted with save_fetch_state once all port calls have been saved.
+    """
+    with stage_timer("fetch_state"):
+        state = get_fetch_state()
+    since = None
+    if state["high_water_mark"] is not None:
+        since = state["high_water_mark"] - timedelta(seconds=DIGITRAFFIC_CONFIG["overlap_seconds"])
+
+    validators = {"etag": state["etag"], "last_modified": state["last_modified"]}
+    port_calls = fetch_data_from_api(since, validators, stream=True)
+    if port_calls is None:
+        return None, None
+
+    fetch_state = {"high_water_mark": state["high_water_mark"], **validators}
+    return track_high_water_mark(port_calls, fetch_state), fetch_state
+
 def process_query(data, tracked_vessels=None):
     """Process the JSON data and prepare results for database insertion."""
     if isinstance(data, dict) and "portCalls" in data:
@@ -329,432 +435,208 @@ def process_query(data, tracked_vessels=None):
         log("Error: Expected a list of port calls in the JSON data.")
         return []
 
-    log(f"Tracking only these vessels: {tracked_vessels}" if tracked_vessels else "Tracking all vessels.")
-
-    results = []
-    for entry in data:
-        try:
-            port_call_id = int(entry.get("portCallId"))  # Ensure it's always an integer
-            #imo_number = int(entry.get("imoLloyds"))  # Ensure it's always an integer
-        except (TypeError, ValueError):
-            #log(f"Skipping entry with invalid portCallId {entry.get('portCallId')} or imoLloyds {entry.get('imoLloyds')}")
-            log(f"Skipping entry with invalid portCallId {entry.get('portCallId')}")
-            continue  # Skip invalid values
+    results = list(iter_processed_port_calls(data, tracked_vessels))
+    log("Processed %d records.", len(results))
+    return results
 
-        imo_number = int(entry.get("imoLloyds")) if entry.get("imoLloyds") is not None else None  # Ensure it's always an integer
-        mmsi = int(entry.get("mmsi")) if entry.get("mmsi") is not None else None  # Extract mmsi if available
-        
-        #log(f"Checking vessel {imo_number} with portCallId {port_call_id}...")  # Debugging
+def iter_processed_port_calls(port_calls, tracked_vessels=None):
+    """Yield database-ready results for an iterable of raw port calls, skipping invalid entries."""
+    if tracked_vessels:
+        log("Tracking only these vessels: %s", tracked_vessels)
+    else:
+        log("Tracking all vessels.")
 
-        # Skip if filtering is enabled and the IMO number is not in the list
-        if tracked_vessels and imo_number not in tracked_vessels:
-            #log(f"Skipping vessel {imo_number} (not in tracked list).")
+    for entry in port_calls:
+        normalised = normalise_port_call(entry, tracked_vessels)
+        if normalised is None:
             continue
+        row, extras = normalised
+        result = dict(zip(VOYAGE_COLUMN_KEYS, row))
+        result.update(extras)
+        result["contentHash"] = compute_content_hash(result)
+        yield result
+
+def normalise_port_call(entry, tracked_vessels=None):
+    """Flatten one raw port call into a voyages row.
+
+    Returns a tuple of the voyages column values in VOYAGE_COLUMNS order and a dict of the
+    fields that are not stored in voyages, or None if the entry is invalid or not tracked.
+    """
+    try:
+        port_call_id = int(entry.get("portCallId"))  # Ensure it's always an integer
+    except (TypeError, ValueError):
+        log("Skipping entry with invalid portCallId %s", entry.get('portCallId'))
+        return None  # Skip invalid values
 
-        if tracked_vessels:
-            log(f"Processing vessel {imo_number} with portCallId {port_call_id}...")  # Log vessel is being processed
-
-        # Extract agentName & shippingCompany from agentInfo[]
-        agent_name = None
-        shipping_company = None
-        for agent in entry.get("agentInfo", []):
-            if agent.get("role") == 1:
-                agent_name = agent.get("name")
-            elif agent.get("role") == 2:
-                shipping_company = agent.get("name")
-
-        # Extract passengers & crew from imoInformation[]
-        passengers_on_arrival = 0
-        passengers_on_departure = 0
-        crew_on_arrival = 0
-        crew_on_departure = 0
-
-        for imo in entry.get("imoInformation", []):
-            if imo.get("imoGeneralDeclaration") == "Arrival":
-                passengers_on_arrival = imo.get("numberOfPassangers", 0) or 0
-                crew_on_arrival = imo.get("numberOfCrew", 0) or 0
-            elif imo.get("imoGeneralDeclaration") == "Departure":
-                passengers_on_departure = imo.get("numberOfPassangers", 0) or 0
-                crew_on_departure = imo.get("numberOfCrew", 0) or 0
-
-        # Extract timestamps & berth info from portAreaDetails[0]
-        port_area_details = entry.get("portAreaDetails", [{}])
-        first_area = port_area_details[0] if port_area_details else {}
-
-        results.append({
-            "portCallId": port_call_id,
-            "portCallTimestamp": entry.get("portCallTimestamp"),
-            "imoLloyds": imo_number if imo_number else 0,
-            "mmsi": mmsi,  # Include mmsi in the results
-            "vesselTypeCode": entry.get("vesselTypeCode"),
-            "vesselName": entry.get("vesselName"),
-            "radioCallSign": entry.get("radioCallSign", ""),  # Include radio call sign
-            "prevPort": entry.get("prevPort"),
-            "portToVisit": entry.get("portToVisit"),
-            "nextPort": entry.get("nextPort"),
-            "agentName": agent_name,
-            "shippingCompany": shipping_company,
-            "eta": first_area.get("eta"),
-            "ata": first_area.get("ata"),
-            "portAreaCode": first_area.get("portAreaCode"),
-            "portAreaName": first_area.get("portAreaName"),
-            "berthCode": first_area.get("berthCode"),
-            "berthName": first_area.get("berthName"),
-            "etd": first_area.get("etd"),
-            "atd": first_area.get("atd"),
-            "passengersOnArrival": passengers_on_arrival,
-            "passengersOnDeparture": passengers_on_departure,
-            "crewOnArrival": crew_on_arrival,
-            "crewOnDeparture": crew_on_departure
-        })
-    log(f"Processed {len(results)} records.")
-    return results
+    imo_number = int(entry.get("imoLloyds")) if entry.get("imoLloyds") is not None else None  # Ensure it's always an integer
+    mmsi = int(entry.get("mmsi")) if entry.get("mmsi") is not None else None  # Extract mmsi if available
 
-def createNoaXml(voyage_data):
-    """Generate and store Notice of Arrival (NOA) XML document."""
+    # Skip if filtering is enabled and the IMO number is not in the list
+    if tracked_vessels and imo_number not in tracked_vessels:
+        return None
+
+    if tracked_vessels:
+        logger.debug("Processing vessel %s with portCallId %s", imo_number, port_call_id)
+
+    # Extract agentName & shippingCompany from agentInfo[]
+    agent_name = None
+    shipping_company = None
+    for agent in entry.get("agentInfo", []):
+        if agent.get("role") == 1:
+            agent_name = agent.get("name")
+        elif agent.get("role") == 2:
+            shipping_company = agent.get("name")
+
+    # Extract passengers & crew from imoInformation[]
+    passengers_on_arrival = 0
+    passengers_on_departure = 0
+    crew_on_arrival = 0
+    crew_on_departure = 0
+
+    for imo in entry.get("imoInformation", []):
+        if imo.get("imoGeneralDeclaration") == "Arrival":
+            passengers_on_arrival = imo.get("numberOfPassangers", 0) or 0
+            crew_on_arrival = imo.get("numberOfCrew", 0) or 0
+        elif imo.get("imoGeneralDeclaration") == "Departure":
+            passengers_on_departure = imo.get("numberOfPassangers", 0) or 0
+            crew_on_departure = imo.get("numberOfCrew", 0) or 0
+
+    # Extract timestamps & berth info from portAreaDetails[0]
+    port_area_details = entry.get("portAreaDetails", [{}])
+    first_area = port_area_details[0] if port_area_details else {}
+
+    row = (
+        port_call_id,
+        imo_number if imo_number else 0,
+        mmsi,
+        entry.get("vesselTypeCode"),
+        entry.get("vesselName"),
+        entry.get("prevPort"),
+        entry.get("portToVisit"),
+        entry.get("nextPort"),
+        agent_name,
+        shipping_company,
+        first_area.get("eta"),
+        first_area.get("ata"),
+        first_area.get("portAreaCode"),
+        first_area.get("portAreaName"),
+        first_area.get("berthCode"),
+        first_area.get("berthName"),
+        first_area.get("etd"),
+        first_area.get("atd"),
+        passengers_on_arrival,
+        passengers_on_departure,
+        crew_on_arrival,
+        crew_on_departure
+    )
+    extras = {
+        "portCallTimestamp": entry.get("portCallTimestamp"),
+        "radioCallSign": entry.get("radioCallSign", "")  # Include radio call sign
+    }
+    return row, extras
+
+class PortCallBatch:
+    """Column-oriented batch of normalised port calls, written by bulk_upsert_voyages as is.
+
+    Rows are kept as tuples in VOYAGE_COLUMNS order and keyed by portCallId, so later
+    duplicates replace earlier ones. They are transposed into per-column arrays only when
+    the batch is written, instead of building and re-reading a dict per port call.
+    """
+
+    __slots__ = ("rows", "extras", "content_hashes")
+
+    def __init__(self):
+        self.rows = {}
+        self.extras = {}
+        self.content_hashes = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row, extras):
+        port_call_id = row[0]
+        self.rows[port_call_id] = row
+        self.extras[port_call_id] = extras
+        self.content_hashes[port_call_id] = hash_voyage_row(row)
+
+    def voyage_columns(self):
+        """Return one parameter list per voyages column plus the content hashes."""
+        if not self.rows:
+            return [[] for _ in range(len(VOYAGE_COLUMNS) + 1)]
+        columns = [list(column) for column in zip(*self.rows.values())]
+        # Values normally arrive with the right type already; only convert columns that need it
+        for column, (_, pg_type) in zip(columns, VOYAGE_COLUMNS):
+            expected_type = int if pg_type == "integer" else str
+            if not set(map(type, column)) <= {expected_type, type(None)}:
+                convert = _to_int if pg_type == "integer" else _to_text
+                column[:] = [convert(value) for value in column]
+        columns.append(list(self.content_hashes.values()))
+        return columns
+
+    def entry(self, port_call_id):
+        """Return one port call as a result dict like process_query produces."""
+        result = dict(zip(VOYAGE_COLUMN_KEYS, self.rows[port_call_id]))
+        result.update(self.extras[port_call_id])
+        result["contentHash"] = self.content_hashes[port_call_id]
+        return result
+
+def iter_port_call_batches(port_calls, tracked_vessels=None, batch_size=None):
+    """Normalise raw port calls into PortCallBatch objects of at most batch_size port calls."""
+    batch_size = batch_size or INGEST_CONFIG["batch_size"]
+    log(f"Tracking only these vessels: {tracked_vessels}" if tracked_vessels else "Tracking all vessels.")
+
+    batch = PortCallBatch()
+    for entry in port_calls:
+        normalised = normalise_port_call(entry, tracked_vessels)
+        if normalised is None:
+            continue
+        batch.add(*normalised)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = PortCallBatch()
+    if len(batch):
+        yield batch
+
+def create_xml_document(formality, data):
+    """Generate one XML document via the converter and store its URL in the database."""
+    sas_url = request_xml_document(formality, data)
+    if not sas_url:
+        return None
+
+    conn = None
     try:
-        # Validate mandatory fields and data types
-        required_fields = ["portCallId", "imoLloyds", "vesselName", "eta", "portAreaName"]
-        for field in required_fields:
-            if field not in voyage_data or voyage_data[field] is None:
-                log(f"Cannot generate NOA XML: Missing required field '{field}' for portCallId {voyage_data.get('portCallId', 'unknown')}")
-                return None
-        
-        # Convert numeric fields to strings to avoid NoneType issues
-        for field in ["portCallId", "imoLloyds"]:
-            if field in voyage_data and voyage_data[field] is not None:
-                voyage_data[field] = str(voyage_data[field])
-        
-        # Store original portCallId for database operations
-        original_port_call_id = voyage_data.get("portCallId")
-        
-        # Ensure string fields have proper values
-        for field in ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName"]:
-            if field in voyage_data and voyage_data[field] is None:
-                voyage_data[field] = ""  # Replace None with empty string
-        
-        # Truncate IDs if needed to prevent validation errors (max 17 chars)
-        if "portCallId" in voyage_data and len(str(voyage_data["portCallId"])) > 17:
-            original_id = voyage_data["portCallId"]
-            voyage_data["portCallId"] = str(voyage_data["portCallId"])[-17:]  # Keep the last 17 chars
-            log(f"Warning: Truncated portCallId from {original_id} to {voyage_data['portCallId']} for XML compatibility")
-            
-        # Call the XML Storage Function
-        xml_converterfunction_url = XML_CONVERTER_CONFIG["function_url"]
-        xml_converter_function_key = XML_CONVERTER_CONFIG["function_key"]
-        
-        # Add the function key to the URL if it exists
-        if xml_converter_function_key:
-            if "?" in xml_converterfunction_url:
-                xml_converterfunction_url += f"&code={xml_converter_function_key}"
-            else:
-                xml_converterfunction_url += f"?code={xml_converter_function_key}"
-        
-        log(f"Calling xml-converter for NOA: {xml_converterfunction_url}")
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        if conn is None:
+            log(f"Failed to connect to database when storing {formality} XML URL")
+            return None
 
-        # Send the voyage data to the function for NOA generation
-        response = requests.post(
-            xml_converterfunction_url,
-            json={"portcall_data": voyage_data, "formality_type": "NOA"},
-            headers={"Content-Type": "application/json"}
-        )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            # Get SAS URL from the response (new format uses sasUrl instead of url)
-            sas_url = response_data.get('sasUrl')
-            
-            if not sas_url:
-                # Fallback to old response format if sasUrl is not found
-                plain_url = response_data.get('url')
-                if not plain_url:
-                    log(f"No URL found in XML converter response for portCallId {voyage_data.get('portCallId')}")
-                    return None
-                    
-                # Extract the blob name from the URL for SAS token generation
-                try:
-                    blob_path = plain_url.split('.net/')[1]  # Get container_name/blob_path
-                except (IndexError, AttributeError):
-                    log(f"Could not parse blob path from URL: {plain_url}")
-                    blob_path = plain_url  # Fallback to using the URL as is
-                
-                # Generate the SAS URL using the shared utility function
-                storage_connection_string = os.getenv("AzureWebJobsStorage")
-                sas_url = generate_blob_storage_link(blob_path, storage_connection_string)
-                
-                if not sas_url:
-                    log(f"Failed to generate SAS URL for blob: {blob_path}")
-                    sas_url = plain_url  # Fallback to plain URL if SAS generation fails
-            
-            log(f"NOA XML for portCallId {voyage_data.get('portCallId')} successfully generated and stored.")
-            
-            # Store the XML URL in the voyages table
-            try:
-                conn = get_db_connection(DATABASE_CONFIG["dbname"])
-                if conn is None:
-                    log(f"Failed to connect to database when storing NOA XML URL")
-                    return None
-                
-                cursor = conn.cursor()
-                
-                # Update the record with the NOA XML URL (use SAS URL if available)
-                cursor.execute(
-                    "UPDATE voyages SET noa_xml_url = %s WHERE portCallId = %s",
-                    (sas_url, original_port_call_id)
-                )
-                
-                affected = cursor.rowcount
-                if affected > 0:
-                    log(f"NOA XML URL (with SAS token) stored in voyages table for portCallId {original_port_call_id}")
-                else:
-                    log(f"No rows updated for portCallId {original_port_call_id}")
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return sas_url
-            except Exception as e:
-                log(f"Error storing NOA XML URL in voyages table: {str(e)}")
+        cursor = conn.cursor()
+        if store_xml_urls(cursor, [(formality, data["portCallId"], sas_url)]):
+            log(f"{formality} XML URL (with SAS token) stored for portCallId {data['portCallId']}")
         else:
-            log(f"Error with NOA XML generation/storage for portCallId {voyage_data.get('portCallId')}: Status {response.status_code}")
-            
+            log(f"No rows updated for portCallId {data['portCallId']}")
+        conn.commit()
+        cursor.close()
     except Exception as e:
-        log(f"Error triggering NOA XML function for portCallId {voyage_data.get('portCallId', 'unknown')}: {str(e)}")
-    
-    return None
+        log(f"Error storing {formality} XML URL: {str(e)}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return sas_url
+
+def createNoaXml(voyage_data):
+    """Generate and store Notice of Arrival (NOA) XML document."""
+    return create_xml_document("NOA", voyage_data)
 
 def createArrivalXml(arrival_data):
     """Generate and store Actual Time of Arrival (ATA) XML document."""
-    try:
-        # Validate mandatory fields and data types
-        required_fields = ["portCallId", "imoLloyds", "vesselName", "ata", "portAreaName"]
-        for field in required_fields:
-            if field not in arrival_data or arrival_data[field] is None:
-                log(f"Cannot generate ATA XML: Missing required field '{field}' for portCallId {arrival_data.get('portCallId', 'unknown')}")
-                return None
-        
-        # Convert numeric fields to strings to avoid NoneType issues
-        for field in ["portCallId", "imoLloyds"]:
-            if field in arrival_data and arrival_data[field] is not None:
-                arrival_data[field] = str(arrival_data[field])
-        
-        # Ensure string fields have proper values
-        for field in ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName"]:
-            if field in arrival_data and arrival_data[field] is None:
-                arrival_data[field] = ""  # Replace None with empty string
-        
-        # Truncate IDs if needed to prevent validation errors (max 17 chars)
-        if "portCallId" in arrival_data and len(str(arrival_data["portCallId"])) > 17:
-            original_id = arrival_data["portCallId"]
-            arrival_data["portCallId"] = str(arrival_data["portCallId"])[-17:]  # Keep the last 17 chars
-            log(f"Warning: Truncated portCallId from {original_id} to {arrival_data['portCallId']} for XML compatibility")
-            
-        # Call the XML Storage Function
-        xml_converterfunction_url = XML_CONVERTER_CONFIG["function_url"]
-        xml_converter_function_key = XML_CONVERTER_CONFIG["function_key"]
-        
-        # Add the function key to the URL if it exists
-        if xml_converter_function_key:
-            if "?" in xml_converterfunction_url:
-                xml_converterfunction_url += f"&code={xml_converter_function_key}"
-            else:
-                xml_converterfunction_url += f"?code={xml_converter_function_key}"
-        
-        log(f"Calling xml-converter: {xml_converterfunction_url}")
-
-        # Send the arrival data to the function
-        response = requests.post(
-            xml_converterfunction_url,
-            json={"portcall_data": arrival_data, "formality_type": "ATA"},
-            headers={"Content-Type": "application/json"}
-        )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            # Get SAS URL from the response (new format uses sasUrl instead of url)
-            sas_url = response_data.get('sasUrl')
-            
-            if not sas_url:
-                # Fallback to old response format if sasUrl is not found
-                plain_url = response_data.get('url')
-                if not plain_url:
-                    log(f"No URL found in XML converter response for portCallId {arrival_data.get('portCallId')}")
-                    return None
-                    
-                # Extract the blob name from the URL for SAS token generation
-                try:
-                    blob_path = plain_url.split('.net/')[1]  # Get container_name/blob_path
-                except (IndexError, AttributeError):
-                    log(f"Could not parse blob path from URL: {plain_url}")
-                    blob_path = plain_url  # Fallback to using the URL as is
-                
-                # Generate the SAS URL using the shared utility function
-                storage_connection_string = os.getenv("AzureWebJobsStorage")
-                sas_url = generate_blob_storage_link(blob_path, storage_connection_string)
-                
-                if not sas_url:
-                    log(f"Failed to generate SAS URL for blob: {blob_path}")
-                    sas_url = plain_url  # Fallback to plain URL if SAS generation fails
-            
-            log(f"ATA XML for portCallId {arrival_data.get('portCallId')} successfully generated and stored.")
-            
-            # Store the XML URL in the arrivals table
-            try:
-                conn = get_db_connection(DATABASE_CONFIG["dbname"])
-                if conn is not None:
-                    cursor = conn.cursor()
-                    
-                    # First find the ID of the most recent arrival record for this port call
-                    cursor.execute(
-                        "SELECT id FROM arrivals WHERE portCallId = %s ORDER BY id DESC LIMIT 1",
-                        (arrival_data.get('portCallId'),)
-                    )
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        arrival_id = result[0]
-                        # Then update that specific record with the SAS URL
-                        cursor.execute(
-                            "UPDATE arrivals SET ata_xml_url = %s WHERE id = %s",
-                            (sas_url, arrival_id)
-                        )
-                        
-                        # Also update the voyages table with the ATA XML URL
-                        cursor.execute(
-                            "UPDATE voyages SET ata_xml_url = %s WHERE portCallId = %s",
-                            (sas_url, arrival_data.get('portCallId'))
-                        )
-                        
-                        conn.commit()
-                        log(f"XML URL (with SAS token) stored in arrivals and voyages tables for portCallId {arrival_data.get('portCallId')}")
-                    else:
-                        log(f"No arrival record found for portCallId {arrival_data.get('portCallId')}")
-                    
-                    cursor.close()
-                    conn.close()
-                    return sas_url  # Return the XML URL on success
-            except Exception as e:
-                log(f"Error storing XML URL in arrivals table: {str(e)}")
-        else:
-            log(f"Error with XML generation/storage for portCallId {arrival_data.get('portCallId')}: Status {response.status_code}")
-            
-    except Exception as e:
-        log(f"Error triggering XML function for portCallId {arrival_data.get('portCallId', 'unknown')}: {str(e)}")
-    
-    return None  # Return None if unsuccessful
+    return create_xml_document("ATA", arrival_data)
 
 def createVidXml(voyage_data):
     """Generate and store Vessel Information Data (VID) XML document."""
-    try:
-        # Validate mandatory fields and data types
-        required_fields = ["portCallId", "imoLloyds", "vesselName", "eta", "portAreaName"]
-        for field in required_fields:
-            if field not in voyage_data or voyage_data[field] is None:
-                log(f"Cannot generate VID XML: Missing required field '{field}' for portCallId {voyage_data.get('portCallId', 'unknown')}")
-                return None
-        
-        # Convert numeric fields to strings to avoid NoneType issues
-        for field in ["portCallId", "imoLloyds", "mmsi"]:
-            if field in voyage_data and voyage_data[field] is not None:
-                voyage_data[field] = str(voyage_data[field])
-        
-        # Store original portCallId for database operations
-        original_port_call_id = voyage_data.get("portCallId")
-        
-        # Ensure string fields have proper values
-        for field in ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName", "radioCallSign"]:
-            if field in voyage_data and voyage_data[field] is None:
-                voyage_data[field] = ""  # Replace None with empty string
-        
-        # Truncate IDs if needed to prevent validation errors (max 17 chars)
-        if "portCallId" in voyage_data and len(str(voyage_data["portCallId"])) > 17:
-            original_id = voyage_data["portCallId"]
-            voyage_data["portCallId"] = str(voyage_data["portCallId"])[-17:]  # Keep the last 17 chars
-            log(f"Warning: Truncated portCallId from {original_id} to {voyage_data['portCallId']} for XML compatibility")
-            
-        # Call the XML Storage Function
-        xml_converterfunction_url = XML_CONVERTER_CONFIG["function_url"]
-        xml_converter_function_key = XML_CONVERTER_CONFIG["function_key"]
-        
-        # Add the function key to the URL if it exists
-        if xml_converter_function_key:
-            if "?" in xml_converterfunction_url:
-                xml_converterfunction_url += f"&code={xml_converter_function_key}"
-            else:
-                xml_converterfunction_url += f"?code={xml_converter_function_key}"
-        
-        log(f"Calling xml-converter for VID: {xml_converterfunction_url}")
-
-        # Send the voyage data to the function for VID generation
-        response = requests.post(
-            xml_converterfunction_url,
-            json={"portcall_data": voyage_data, "formality_type": "VID"},
-            headers={"Content-Type": "application/json"}
-        )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            # Get SAS URL from the response (new format uses sasUrl instead of url)
-            sas_url = response_data.get('sasUrl')
-            
-            if not sas_url:
-                # Fallback to old response format if sasUrl is not found
-                plain_url = response_data.get('url')
-                if not plain_url:
-                    log(f"No URL found in XML converter response for portCallId {voyage_data.get('portCallId')}")
-                    return None
-                    
-                # Extract the blob name from the URL for SAS token generation
-                try:
-                    blob_path = plain_url.split('.net/')[1]  # Get container_name/blob_path
-                except (IndexError, AttributeError):
-                    log(f"Could not parse blob path from URL: {plain_url}")
-                    blob_path = plain_url  # Fallback to using the URL as is
-                
-                # Generate the SAS URL using the shared utility function
-                storage_connection_string = os.getenv("AzureWebJobsStorage")
-                sas_url = generate_blob_storage_link(blob_path, storage_connection_string)
-                
-                if not sas_url:
-                    log(f"Failed to generate SAS URL for blob: {blob_path}")
-                    sas_url = plain_url  # Fallback to plain URL if SAS generation fails
-            
-            log(f"VID XML for portCallId {voyage_data.get('portCallId')} successfully generated and stored.")
-            
-            # Store the XML URL in the voyages table
-            try:
-                conn = get_db_connection(DATABASE_CONFIG["dbname"])
-                if conn is None:
-                    log(f"Failed to connect to database when storing VID XML URL")
-                    return None
-                
-                cursor = conn.cursor()
-                
-                # Update the record with the VID XML URL (use SAS URL if available)
-                cursor.execute(
-                    "UPDATE voyages SET vid_xml_url = %s WHERE portCallId = %s",
-                    (sas_url, original_port_call_id)
-                )
-                
-                affected = cursor.rowcount
-                if affected > 0:
-                    log(f"VID XML URL (with SAS token) stored in voyages table for portCallId {original_port_call_id}")
-                else:
-                    log(f"No rows updated for portCallId {original_port_call_id}")
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return sas_url
-            except Exception as e:
-                log(f"Error storing VID XML URL in voyages table: {str(e)}")
-        else:
-            log(f"Error with VID XML generation/storage for portCallId {voyage_data.get('portCallId')}: Status {response.status_code}")
-            
-    except Exception as e:
-        log(f"Error triggering VID XML function for portCallId {voyage_data.get('portCallId', 'unknown')}: {str(e)}")
-    
-    return None
+    return create_xml_document("VID", voyage_data)
 
 def diagnose_database_structure():
     """Diagnose database structure to help identify issues with XML URL storage."""
@@ -785,11 +667,196 @@ def diagnose_database_structure():
     except Exception as e:
         log(f"Error diagnosing database structure: {str(e)}")
 
+# Columns written to the voyages table by the bulk upsert, with their PostgreSQL types
+VOYAGE_COLUMNS = [
+    ("portCallId", "integer"),
+    ("imoLloyds", "integer"),
+    ("mmsi", "integer"),
+    ("vesselTypeCode", "text"),
+    ("vesselName", "text"),
+    ("prevPort", "text"),
+    ("portToVisit", "text"),
+    ("nextPort", "text"),
+    ("agentName", "text"),
+    ("shippingCompany", "text"),
+    ("eta", "timestamp"),
+    ("ata", "timestamp"),
+    ("portAreaCode", "text"),
+    ("portAreaName", "text"),
+    ("berthCode", "text"),
+    ("berthName", "text"),
+    ("etd", "timestamp"),
+    ("atd", "timestamp"),
+    ("passengersOnArrival", "integer"),
+    ("passengersOnDeparture", "integer"),
+    ("crewOnArrival", "integer"),
+    ("crewOnDeparture", "integer"),
+]
+
+VOYAGE_COLUMN_KEYS = [name for name, _ in VOYAGE_COLUMNS]
+_VOYAGE_COLUMN_NAMES = ", ".join(VOYAGE_COLUMN_KEYS)
+
+# Stages the whole batch with unnest(), upserts it and inserts the arrivals rows in a single
+# statement. All CTEs see the same snapshot, so `previous` still holds the pre-upsert ETA/ATA
+# values and the change detection happens server-side. Existing rows are only rewritten when
+# their content hash differs, so unchanged port calls cost no WAL and keep their `modified`.
+BULK_UPSERT_QUERY = f"""
+WITH incoming AS (
+    SELECT * FROM unnest({", ".join(f"%s::{pg_type}[]" for _, pg_type in VOYAGE_COLUMNS)}, %s::text[])
+        AS t({_VOYAGE_COLUMN_NAMES}, content_hash)
+),
+previous AS (
+    SELECT v.portCallId, v.eta, v.ata
+    FROM voyages v
+    JOIN incoming i ON i.portCallId = v.portCallId
+),
+upserted AS (
+    INSERT INTO voyages ({_VOYAGE_COLUMN_NAMES}, content_hash, modified)
+    SELECT {", ".join("date_trunc('minute', ata)" if name == "ata" else name for name, _ in VOYAGE_COLUMNS)},
+        content_hash, CURRENT_TIMESTAMP
+    FROM incoming
+    ON CONFLICT (portCallId) DO UPDATE SET
+        {", ".join(f"{name} = EXCLUDED.{name}" for name, _ in VOYAGE_COLUMNS[1:])},
+        content_hash = EXCLUDED.content_hash,
+        modified = CURRENT_TIMESTAMP
+    WHERE voyages.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING portCallId, eta, ata
+),
+changes AS (
+    SELECT u.portCallId,
+        p.portCallId IS NULL AS is_new,
+        (p.eta IS NOT NULL AND u.eta IS NOT NULL
+            AND date_trunc('minute', p.eta) <> date_trunc('minute', u.eta)) AS eta_changed,
+        (u.ata IS NOT NULL
+            AND (p.ata IS NULL OR date_trunc('minute', p.ata) <> u.ata)) AS ata_changed,
+        date_trunc('minute', p.eta) AS old_eta,
+        date_trunc('minute', p.ata) AS old_ata,
+        u.ata AS new_ata
+    FROM upserted u
+    LEFT JOIN previous p ON p.portCallId = u.portCallId
+),
+new_arrivals AS (
+    INSERT INTO arrivals (portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName, created)
+    SELECT c.portCallId, i.eta, c.old_ata, c.new_ata, i.vesselName, i.portAreaName, i.berthName,
+        CURRENT_TIMESTAMP
+    FROM changes c
+    JOIN incoming i ON i.portCallId = c.portCallId
+    WHERE c.ata_changed
+)
+SELECT portCallId, is_new, eta_changed, ata_changed, old_eta, new_ata
+FROM changes;
+"""
+
+_content_hash_encoder = json.JSONEncoder(default=str)
+
+def hash_voyage_row(row):
+    """Fingerprint a sequence of voyages column values in VOYAGE_COLUMNS order."""
+    return hashlib.blake2b(_content_hash_encoder.encode(row).encode("utf-8"), digest_size=16).hexdigest()
+
+def compute_content_hash(entry):
+    """Fingerprint the voyages column values of a processed port call."""
+    return hash_voyage_row([entry.get(name) for name in VOYAGE_COLUMN_KEYS])
+
+def normalize_to_minute(timestamp):
+    """Normalize a Digitraffic timestamp string to minute precision (e.g. 2024-03-13T10:00:00.000Z)."""
+    if not timestamp:
+        return None
+    normalized = to_minute_datetime(timestamp)
+    if normalized is None:
+        raise ValueError(f"Invalid timestamp: {timestamp}")
+    return normalized
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+def _to_text(value):
+    return str(value) if value is not None else None
+
+def build_voyage_columns(results):
+    """Convert processed results into one parameter list per voyages column for the bulk upsert.
+
+    Duplicate portCallIds are collapsed so that the last occurrence wins, as it would with
+    row-by-row updates.
+    """
+    unique_entries = {}
+    for entry in results:
+        unique_entries[int(entry["portCallId"])] = entry
+
+    converters = {"integer": _to_int, "text": _to_text, "timestamp": _to_text}
+    columns = []
+    for name, pg_type in VOYAGE_COLUMNS:
+        convert = converters[pg_type]
+        columns.append([convert(entry.get(name)) for entry in unique_entries.values()])
+    columns.append([entry.get("contentHash") or compute_content_hash(entry) for entry in unique_entries.values()])
+    return columns
+
+def bulk_upsert_voyages(cursor, results):
+    """Upsert all results into the voyages table in one round trip and return the change set.
+
+    results is either a list of process_query result dicts or a PortCallBatch.
+
+    Each change is a dict with portCallId, is_new, eta_changed, ata_changed, old_eta and new_ata
+    (normalized to minute level), covering only port calls that are new or whose ETA/ATA
+    changed. Arrival rows for ATA changes are inserted by the same statement. Also returns
+    counts of new, changed and unchanged port calls.
+    """
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    if not results:
+        return [], counts
+
+    if isinstance(results, PortCallBatch):
+        columns = results.voyage_columns()
+    else:
+        columns = build_voyage_columns(results)
+    cursor.execute(BULK_UPSERT_QUERY, tuple(columns))
+
+    changes = []
+    rows = cursor.fetchall()
+    for port_call_id, is_new, eta_changed, ata_changed, old_eta, new_ata in rows:
+        counts["new" if is_new else "changed"] += 1
+        if not (is_new or eta_changed or ata_changed):
+            continue
+        changes.append({
+            "portCallId": int(port_call_id),
+            "is_new": is_new,
+            "eta_changed": eta_changed,
+            "ata_changed": ata_changed,
+            "old_eta": old_eta.strftime("%Y-%m-%dT%H:%M:00.000Z") if old_eta else None,
+            "new_ata": new_ata.strftime("%Y-%m-%dT%H:%M:00.000Z") if new_ata else None
+        })
+    counts["unchanged"] = len(columns[0]) - len(rows)
+    return changes, counts
+
+def enqueue_xml_jobs(cursor, jobs):
+    """Write pending VID/NOA/ATA jobs to the xml_outbox table.
+
+    Jobs are (portCallId, formality, event_timestamp, payload) tuples. The outbox is keyed on
+    (portCallId, formality, event_timestamp), so re-queuing an already known event is a no-op.
+    Returns the number of newly queued jobs.
+    """
+    if not jobs:
+        return 0
+
+    port_call_ids, formalities, event_timestamps, payloads = zip(*jobs)
+    cursor.execute("""
+        INSERT INTO xml_outbox (portCallId, formality, event_timestamp, payload)
+        SELECT * FROM unnest(%s::integer[], %s::text[], %s::timestamp[], %s::jsonb[])
+        ON CONFLICT (portCallId, formality, event_timestamp) DO NOTHING
+        RETURNING id;
+    """, (list(port_call_ids), list(formalities), list(event_timestamps),
+          [json.dumps(payload) for payload in payloads]))
+    return len(cursor.fetchall())
+
 def save_results_to_db(results, conn=None):
-    """Save processed results into the 'voyages' table and trigger arrivals only when `ata` is updated at the minute level."""
+    """Save processed results into the 'voyages' table and trigger arrivals only when `ata` is updated at the minute level.
+
+    All rows are written with a single bulk upsert. VID/NOA/ATA documents are not generated here;
+    the jobs are written to the xml_outbox table in the same transaction and generated later by
+    the XML dispatcher.
+    """
+    connection_managed_elsewhere = conn is not None
     try:
-        log(f"Saving {len(results)} records to the database...")
-        connection_managed_elsewhere = conn is not None
+        log("Saving %d records to the database...", len(results))
 
         if conn is None:
             conn = get_db_connection(DATABASE_CONFIG["dbname"])
@@ -797,133 +864,28 @@ def save_results_to_db(results, conn=None):
                 raise Exception("Failed to connect to database")
 
         cursor = conn.cursor()
+        with stage_timer("upsert"):
+            changes, counts = bulk_upsert_voyages(cursor, results)
+        xml_jobs = []
 
         new_arrival_count = 0   # Track the count of new arrivals
         new_eta_count = 0       # Track the count of new eta timestamps for NOA generation
-        new_voyage_count = 0    # Track count of new voyages for VID generation
-        updated_voyage_count = 0 # Track count of updated existing voyages
-
-        # Extract unique portCallIds from JSON data
-        port_call_ids = list(set(entry["portCallId"] for entry in results))
-
-        # Fetch all old ata values and existing port calls in one query
-        old_ata_map = {}
-        old_eta_map = {}
-        existing_port_calls = set()
-        if port_call_ids:
-            # Detect if using SQLite
-            is_sqlite = isinstance(conn, sqlite3.Connection)
-            placeholder = "?" if is_sqlite else "%s"
-
-            # Fetch old ATA, ETA values and port call IDs using proper placeholders
-            port_call_ids = list(set(entry["portCallId"] for entry in results))
-            query = f"""
-                SELECT portCallId, ata, eta FROM voyages WHERE portCallId IN ({','.join([placeholder] * len(port_call_ids))});
-            """
-            cursor.execute(query, tuple(port_call_ids))
-
-            fetched_data = cursor.fetchall()
-
-            # Populate maps with data
-            for row in fetched_data:
-                port_call_id, old_ata, old_eta = row
-                existing_port_calls.add(int(port_call_id))
-                if old_ata:  # Only store valid timestamps
-                    old_ata_map[int(port_call_id)] = old_ata.strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize to minute level
-                if old_eta:  # Store valid ETA timestamps
-                    old_eta_map[int(port_call_id)] = old_eta.strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize to minute level
-
-        for entry in results:
-            port_call_id = int(entry["portCallId"])  # Ensure it's stored as an integer
-            imo_number = int(entry["imoLloyds"]) if entry["imoLloyds"] is not None else None  # Ensure it's always an integer
-            mmsi = int(entry["mmsi"]) if entry.get("mmsi") is not None else None  # Get mmsi if available
-            
-            new_ata = entry["ata"]
-            if new_ata:
-                new_ata = datetime.strptime(new_ata, "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize
-
-            new_eta = entry["eta"]
-            if new_eta:
-                new_eta = datetime.strptime(new_eta, "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize
-
-            # Fetch old values from the maps (default to None)
-            old_ata = old_ata_map.get(port_call_id, None)
-            old_eta = old_eta_map.get(port_call_id, None)
-
-            # Check if this is a new port call that needs VID
-            is_new_port_call = port_call_id not in existing_port_calls
-
-            # Determine operation - new insert or update existing
-            if is_new_port_call:
-                # For new port calls, use INSERT
-                insert_query = f"""
-                INSERT INTO voyages (portCallId, imoLloyds, mmsi, vesselTypeCode, vesselName, prevPort,
-                    portToVisit, nextPort, agentName, shippingCompany, eta, ata, portAreaCode,
-                    portAreaName, berthCode, berthName, etd, atd,
-                    passengersOnArrival, passengersOnDeparture, crewOnArrival, crewOnDeparture,
-                    modified)
-                VALUES ({','.join([placeholder] * 22)}, CURRENT_TIMESTAMP)
-                RETURNING portCallId;
-                """
-                
-                cursor.execute(insert_query, (
-                    port_call_id, imo_number, mmsi, entry["vesselTypeCode"], entry["vesselName"],
-                    entry["prevPort"], entry["portToVisit"], entry["nextPort"], entry["agentName"],
-                    entry["shippingCompany"], entry["eta"], new_ata, entry["portAreaCode"], entry["portAreaName"],
-                    entry["berthCode"], entry["berthName"], entry["etd"], entry["atd"],
-                    entry["passengersOnArrival"], entry["passengersOnDeparture"], entry["crewOnArrival"],
-                    entry["crewOnDeparture"]
-                ))
-                
-                new_voyage_count += 1
-            else:
-                # For existing port calls, use UPDATE
-                update_query = f"""
-                UPDATE voyages SET
-                    imoLloyds = %s,
-                    mmsi = %s,
-                    vesselTypeCode = %s,
-                    vesselName = %s,
-                    prevPort = %s,
-                    portToVisit = %s,
-                    nextPort = %s,
-                    agentName = %s,
-                    shippingCompany = %s,
-                    eta = %s,
-                    ata = %s,
-                    portAreaCode = %s,
-                    portAreaName = %s,
-                    berthCode = %s,
-                    berthName = %s,
-                    etd = %s,
-                    atd = %s,
-                    passengersOnArrival = %s,
-                    passengersOnDeparture = %s,
-                    crewOnArrival = %s,
-                    crewOnDeparture = %s,
-                    modified = CURRENT_TIMESTAMP
-                WHERE portCallId = %s
-                """
-                
-                cursor.execute(update_query, (
-                    imo_number, mmsi, entry["vesselTypeCode"], entry["vesselName"],
-                    entry["prevPort"], entry["portToVisit"], entry["nextPort"], entry["agentName"],
-                    entry["shippingCompany"], entry["eta"], new_ata, entry["portAreaCode"], entry["portAreaName"],
-                    entry["berthCode"], entry["berthName"], entry["etd"], entry["atd"],
-                    entry["passengersOnArrival"], entry["passengersOnDeparture"], entry["crewOnArrival"],
-                    entry["crewOnDeparture"], port_call_id
-                ))
-                
-                updated_voyage_count += 1
 
-            # Generate VID XML for new port calls with ETA data
-            if is_new_port_call and entry.get("eta"):
-                log(f"New port call detected for portCallId {port_call_id}. Generating VID-XML.")
-                
-                # IMPORTANT: Commit the transaction to ensure the new record is stored
-                # before generating the XML
-                conn.commit()
-                
+        if isinstance(results, PortCallBatch):
+            get_entry = results.entry
+        else:
+            get_entry = {int(entry["portCallId"]): entry for entry in results}.__getitem__
+
+        for change in changes:
+            port_call_id = change["portCallId"]
+            entry = get_entry(port_call_id)
+            imo_number = int(entry["imoLloyds"]) if entry.get("imoLloyds") is not None else None
+            mmsi = int(entry["mmsi"]) if entry.get("mmsi") is not None else None
+
+            # Queue VID XML for new port calls with ETA data
+            if change["is_new"] and entry.get("eta"):
+                logger.debug("New port call detected for portCallId %s. Queuing VID-XML.", port_call_id)
+
                 # Prepare data for VID XML generation, ensuring no None values
                 vid_data = {
                     "portCallId": port_call_id,
@@ -944,17 +906,14 @@ def save_results_to_db(results, conn=None):
                     "radioCallSign": entry.get("radioCallSign", "")
                 }
                 
-                # Generate and store the VID XML
-                createVidXml(vid_data)
+                xml_jobs.append((port_call_id, "VID", entry["eta"], vid_data))
+
+            # Queue NOA XML when ETA changes are detected
+            if change["eta_changed"]:
+                new_eta = normalize_to_minute(entry.get("eta"))
+                logger.debug("ETA change detected for portCallId %s (%s -> %s). Queuing NOA-XML.",
+                             port_call_id, change['old_eta'], new_eta)
 
-            # Generate NOA XML when ETA changes are detected
-            if old_eta is not None and old_eta != new_eta and new_eta is not None:
-                log(f"ETA change detected for portCallId {port_call_id}. Generating NOA-XML.")
-                log(f"Old ETA: {old_eta}, New ETA: {new_eta}")
-                
-                # Commit to ensure all changes are saved
-                conn.commit()
-                
                 # Prepare data for NOA XML generation
                 noa_data = {
                     "portCallId": port_call_id,
@@ -975,46 +934,31 @@ def save_results_to_db(results, conn=None):
                     "shippingCompany": entry.get("shippingCompany") or ""
                 }
                 
-                # Generate and store the NOA XML
-                noa_url = createNoaXml(noa_data)
-                if noa_url:
-                    new_eta_count += 1
-                    log(f"NOA XML generated for portCallId {port_call_id} due to ETA change")
-
-            # Generate ATA XML for arrivals with updated ATA
-            if old_ata != new_ata and new_ata is not None:
-                insert_arrival_query = f"""
-                INSERT INTO arrivals (portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName, created)
-                VALUES ({','.join([placeholder] * 7)}, CURRENT_TIMESTAMP);
-                """
-                cursor.execute(insert_arrival_query, (
-                    port_call_id, entry["eta"], old_ata, new_ata,
-                    entry["vesselName"], entry["portAreaName"], entry["berthName"]
-                ))
-                
-                # Commit the arrival record before XML generation
-                conn.commit()
-                
+                xml_jobs.append((port_call_id, "NOA", new_eta, noa_data))
+                new_eta_count += 1
+
+            # Queue ATA XML for arrivals with updated ATA (the arrivals row is inserted by the upsert)
+            if change["ata_changed"]:
+                new_ata = change["new_ata"]
                 new_arrival_count += 1
-                print(
-                    f"-----------------------------\n"
-                    f"Port Call ID: {port_call_id}\n"
-                    f"Port Call Time Stamp: {entry['portCallTimestamp']}\n\n"
-                    f"Aluksen IMO/nimi: {imo_number}/{entry['vesselName']}\n"
-                    f"Aluksen MMSI: {mmsi}\n\n"
-                    f"Satamakoodi: {entry['portToVisit']}\n"
-                    f"Satama: {entry['portAreaName']}\n"
-                    f"Laituri: {entry['berthName']}\n\n"
-                    f"Saapuminen\n"
-                    f"Arvioitu saapumisaika (UTC): {datetime.strptime(entry['eta'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('eta') else 'N/A'}\n"
-                    f"Toteutunut saapumisaika (UTC): {datetime.strptime(new_ata, '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if new_ata else 'N/A'}\n"
-                    f"Miehistön lukumäärä: {entry['crewOnArrival']}\n"
-                    f"Matkustajien lukumäärä: {entry['passengersOnArrival']}\n\n"
-                    f"Lähtö\n"
-                    f"Arvioitu lähtöaika (UTC): {datetime.strptime(entry['etd'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('etd') else 'N/A'}\n"
-                    f"Toteutunut lähtöaika (UTC): {datetime.strptime(entry['atd'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('atd') else 'N/A'}\n"
-                    f"Miehistön lukumäärä: {entry['crewOnDeparture']}\n"
-                    f"Matkustajien lukumäärä: {entry['passengersOnDeparture']}\n"
+                log_event(
+                    logger, "arrival_detected",
+                    portCallId=port_call_id,
+                    portCallTimestamp=entry.get("portCallTimestamp"),
+                    imo=imo_number,
+                    mmsi=mmsi,
+                    vesselName=entry.get("vesselName"),
+                    portToVisit=entry.get("portToVisit"),
+                    portAreaName=entry.get("portAreaName"),
+                    berthName=entry.get("berthName"),
+                    eta=entry.get("eta"),
+                    ata=new_ata,
+                    etd=entry.get("etd"),
+                    atd=entry.get("atd"),
+                    crewOnArrival=entry.get("crewOnArrival"),
+                    passengersOnArrival=entry.get("passengersOnArrival"),
+                    crewOnDeparture=entry.get("crewOnDeparture"),
+                    passengersOnDeparture=entry.get("passengersOnDeparture")
                 )
                 
                 # Prepare data for ATA XML generation, ensuring no None values
@@ -1037,51 +981,88 @@ def save_results_to_db(results, conn=None):
                     "shippingCompany": entry.get("shippingCompany") or ""
                 }
                 
-                createArrivalXml(ata_data)
+                xml_jobs.append((port_call_id, "ATA", new_ata, ata_data))
 
-        # Final commit at the end of processing all records
-        conn.commit()
+        with stage_timer("enqueue"):
+            queued_count = enqueue_xml_jobs(cursor, xml_jobs)
+
+        # Single commit for the voyages, arrivals and outbox writes
+        with stage_timer("commit"):
+            conn.commit()
         cursor.close()
-        if not connection_managed_elsewhere:
-            conn.close()
-        log(f"{len(results)} records saved/updated in the database.")
-        log(f"Total new voyages: {new_voyage_count}, updated voyages: {updated_voyage_count}, new arrivals: {new_arrival_count}, eta updated: {new_eta_count}")
+
+        log_event(
+            logger, "results_saved",
+            records=len(results),
+            new=counts['new'],
+            changed=counts['changed'],
+            unchanged=counts['unchanged'],
+            arrivals=new_arrival_count,
+            eta_updates=new_eta_count,
+            xml_jobs_queued=queued_count
+        )
+        increment("batches")
+        increment("records", len(results))
+        increment("voyages_new", counts['new'])
+        increment("voyages_changed", counts['changed'])
+        increment("arrivals", new_arrival_count)
+        increment("eta_updates", new_eta_count)
+        increment("xml_jobs_queued", queued_count)
+        return changes
 
     except Exception as e:
         log(f"Error saving results to the database: {e}")
         raise  # Re-raise the exception to be caught by the test
+    finally:
+        # Return the connection to the pool (rolling back a failed batch) unless the caller owns it
+        if not connection_managed_elsewhere and conn is not None:
+            conn.close()
 
-def main(req=None):
-    log("Program started.")
-    create_database_and_tables()
-    update_database_schema()
+def main(req=None, args=None):
+    """Ingest port calls from the input file or directory of an HTTP request or CLI args, else from the API."""
+    with run_metrics("ingest"):
+        log("Program started.")
+        # Migrations run on the first invocation of each worker process only
+        with stage_timer("schema"):
+            ensure_database_schema()
     
-    # Parse CLI arguments and environment variables
-    args = {}
-    if req:
-        req.params.get("input-file"), req.params.get("input-dir"), req.params.get("imo")
-        args = {
-            "input_file": req.params.get("input-file"),
-            "input_dir": req.params.get("input-dir"),
-            "tracked_vessels": set(map(int, req.params.get("imo").split(","))) if req.params.get("imo") else None
-        }
-
-    # Process JSON from input file or directory
-    data = None
-    if args and (args["input_file"] or args["input_dir"]):
-        data = get_json_source(args["input_file"], args["input_dir"], args["tracked_vessels"])
-    else:
-        # If no file/directory is specified, fetch data from API
-        log("No input file or directory specified. Fetching from API...")
-        data = fetch_data_from_api()
-
-    if data:
-        if args:
-            results = process_query(data, args["tracked_vessels"])
+        # Parse CLI arguments and environment variables
+        args = args or {}
+        if req:
+            req.params.get("input-file"), req.params.get("input-dir"), req.params.get("imo")
+            args = {
+                "input_file": req.params.get("input-file"),
+                "input_dir": req.params.get("input-dir"),
+                "tracked_vessels": set(map(int, req.params.get("imo").split(","))) if req.params.get("imo") else None,
+                "workers": get_backfill_workers(req.params.get("workers"))
+            }
+
+        # Process JSON from input file or directory
+        tracked_vessels = args["tracked_vessels"] if args else None
+        if args and (args["input_file"] or args["input_dir"]):
+            # Files are streamed into the database batch by batch while they are read
+            get_json_source(args["input_file"], args["input_dir"], tracked_vessels, args["workers"])
         else:
-            results = process_query(data)
-        save_results_to_db(results)
-    else:
-        log("No data available to process.")
+            fetch_state = None
+            if DIGITRAFFIC_CONFIG["incremental"]:
+                # If no file/directory is specified, fetch updates since the previous run from API
+                log("No input file or directory specified. Fetching updates from API...")
+                port_calls, fetch_state = fetch_port_call_updates()
+            else:
+                # If no file/directory is specified, fetch data from API
+                log("No input file or directory specified. Fetching from API...")
+                port_calls = fetch_data_from_api(stream=True)
+
+            if port_calls is not None:
+                save_port_calls_in_batches(port_calls, tracked_vessels)
+                if fetch_state:
+                    # Only advance the high-water mark once the fetched port calls are stored
+                    with stage_timer("fetch_state"):
+                        save_fetch_state(fetch_state)
+            else:
+                log("No data available to process.")
+
+        log("Program completed.")
 
-    log("Program completed.")
+if __name__ == "__main__":
+    main(args=parse_arguments())
@@ -0,0 +1,239 @@
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from config import DATABASE_CONFIG, RATE_LIMIT_CONFIG
+from PortmanTrigger.db_pool import get_db_connection
+from PortmanTrigger.migrations import ensure_database_schema
+
+logger = logging.getLogger('PortmanTrigger')
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+class TokenBucketLimiter:
+    """Token bucket rate limit shared by all instances through the rate_limit_buckets table.
+
+    Tokens are taken from the shared bucket with one atomic UPDATE, in leases of up to
+    lease_seconds worth of the rate; the leased tokens are handed out from memory until they
+    run out or expire. After a refused request the database is not asked again until a token
+    can be available. If the database cannot be reached (or shared is False) the bucket is
+    kept in memory for this instance only.
+
+    The lock is not held during the database round trip; one thread takes a lease at a time
+    and the others wait for it rather than asking the database again.
+    """
+
+    def __init__(self, name, per_minute, burst, max_wait_seconds=0, lease_seconds=5, shared=True):
+        if per_minute <= 0:
+            raise ValueError(f"Rate limit {name} must allow more than 0 requests per minute")
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst, 1)
+        self.max_wait_seconds = max_wait_seconds
+        self.lease_seconds = lease_seconds
+        self.shared = shared
+        self.lock = threading.Lock()
+        self._lease_taken = threading.Condition(self.lock)
+        self._taking = False
+        self._leased = 0
+        self._lease_expires = 0.0
+        self._next_check = 0.0
+        self._blocked_until = 0.0
+        self._local_tokens = float(self.capacity)
+        self._local_updated = time.monotonic()
+        self._bucket_created = False
+
+    def try_acquire(self):
+        """Take one token if one is available now, without waiting."""
+        return self._try_acquire(time.monotonic()) == 0
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to timeout seconds (max_wait_seconds by default).
+
+        Returns False if no token became available in time.
+        """
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            wait = self._try_acquire(now)
+            if wait == 0:
+                return True
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def seconds_until_available(self):
+        """Return how long until a token can be available again (0 if one may be now)."""
+        with self.lock:
+            now = time.monotonic()
+            if self._leased and now < self._lease_expires:
+                return 0
+            return max(self._blocked_until - now, self._next_check - now, 0)
+
+    def block_for(self, seconds):
+        """Stop handing out tokens for seconds, on all instances (e.g. after a 429 Retry-After)."""
+        with self.lock:
+            self._leased = 0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        if self.shared:
+            try:
+                self._execute("""
+                    UPDATE rate_limit_buckets SET
+                        blocked_until = GREATEST(COALESCE(blocked_until, clock_timestamp()),
+                                                 clock_timestamp() + make_interval(secs => %s))
+                    WHERE name = %s;
+                """, (float(seconds), self.name))
+            except Exception as e:
+                logger.warning(f"Could not share the {self.name} rate limit block: {e}")
+
+    def _try_acquire(self, now):
+        """Take one token; return 0 on success, else the seconds until one may be available."""
+        with self.lock:
+            while True:
+                if now < self._blocked_until:
+                    return self._blocked_until - now
+                if self._leased and now < self._lease_expires:
+                    self._leased -= 1
+                    return 0
+                if now < self._next_check:
+                    return self._next_check - now
+                if not self._taking:
+                    break
+                # Another thread is taking a lease; use it instead of asking the database again
+                self._lease_taken.wait()
+                now = time.monotonic()
+            self._taking = True
+
+        wanted = min(self.capacity, max(1, math.floor(self.rate * self.lease_seconds)))
+        try:
+            granted, available, blocked = self._take(wanted)
+        except BaseException:
+            with self.lock:
+                self._taking = False
+                self._lease_taken.notify_all()
+            raise
+
+        with self.lock:
+            self._taking = False
+            self._lease_taken.notify_all()
+            now = time.monotonic()
+            if blocked > 0:
+                self._blocked_until = max(self._blocked_until, now + blocked)
+            if now < self._blocked_until:
+                # Blocked by the database or by block_for() during the round trip
+                self._leased = 0
+                return self._blocked_until - now
+            if granted == 0:
+                self._next_check = now + (1 - available) / self.rate
+                self._leased = 0
+                return self._next_check - now
+            self._leased = granted - 1
+            self._lease_expires = now + self.lease_seconds
+            return 0
+
+    def _take(self, wanted):
+        """Take up to wanted tokens. Returns (granted, tokens left, seconds still blocked)."""
+        if self.shared:
+            try:
+                return self._take_shared(wanted)
+            except Exception as e:
+                logger.warning(f"Shared {self.name} rate limit unavailable, limiting this instance only: {e}")
+        return self._take_local(wanted)
+
+    def _take_local(self, wanted):
+        now = time.monotonic()
+        available = min(self.capacity, self._local_tokens + self.rate * (now - self._local_updated))
+        granted = min(wanted, math.floor(available))
+        self._local_tokens = available - granted
+        self._local_updated = now
+        return granted, available - granted, 0
+
+    def _take_shared(self, wanted):
+        if not self._bucket_created:
+            self._execute("""
+                INSERT INTO rate_limit_buckets (name, tokens, updated)
+                VALUES (%s, %s, clock_timestamp())
+                ON CONFLICT (name) DO NOTHING;
+            """, (self.name, float(self.capacity)))
+            self._bucket_created = True
+
+        # The row lock taken by the UPDATE serialises instances taking from the same bucket
+        rows = self._execute("""
+            WITH bucket AS (
+                SELECT name,
+                       LEAST(%s, tokens + %s * EXTRACT(EPOCH FROM clock_timestamp() - updated)) AS available,
+                       GREATEST(EXTRACT(EPOCH FROM blocked_until - clock_timestamp()), 0) AS blocked
+                FROM rate_limit_buckets WHERE name = %s
+                FOR UPDATE
+            ), taken AS (
+                SELECT name, available, blocked,
+                       CASE WHEN blocked > 0 THEN 0 ELSE LEAST(%s, FLOOR(available)) END AS granted
+                FROM bucket
+            )
+            UPDATE rate_limit_buckets b SET
+                tokens = taken.available - taken.granted,
+                updated = clock_timestamp()
+            FROM taken
+            WHERE b.name = taken.name
+            RETURNING taken.granted, taken.available - taken.granted, taken.blocked;
+        """, (float(self.capacity), self.rate, self.name, wanted))
+        if not rows:
+            # The bucket row was removed; recreate it on the next call
+            self._bucket_created = False
+            raise Exception(f"Rate limit bucket {self.name} does not exist")
+        granted, available, blocked = rows[0]
+        return int(granted), float(available), float(blocked)
+
+    def _execute(self, query, params):
+        ensure_database_schema()
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        if conn is None:
+            raise Exception("Failed to connect to database")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall() if cursor.description else []
+            conn.commit()
+            cursor.close()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+def parse_retry_after(value, default=60):
+    """Return the seconds to wait from a Retry-After header (seconds or an HTTP date)."""
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return default
+
+def get_rate_limiter(name):
+    """Return the process-wide limiter of a rate limit in RATE_LIMIT_CONFIG["limits"]."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limit = RATE_LIMIT_CONFIG["limits"][name]
+                limiter = _limiters[name] = TokenBucketLimiter(
+                    name,
+                    limit["per_minute"],
+                    limit["burst"],
+                    max_wait_seconds=limit["max_wait_seconds"],
+                    lease_seconds=RATE_LIMIT_CONFIG["lease_seconds"],
+                    shared=RATE_LIMIT_CONFIG["shared"]
+                )
+    return limiter
@@ -0,0 +1,339 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import XML_CONVERTER_CONFIG
+from PortmanTrigger.metrics import with_run_context
+try:
+    from PortmanTrigger.blob_utils import generate_blob_storage_link
+except ImportError:
+    try:
+        # Try alternative import path
+        from blob_utils import generate_blob_storage_link
+    except ImportError:
+        # Fallback definition if the module can't be imported
+        def generate_blob_storage_link(blob_name, connection_string=None):
+            logging.warning("generate_blob_storage_link function not available")
+            return ""
+
+logger = logging.getLogger('PortmanTrigger')
+
+# Mandatory fields, numeric fields sent as strings and string fields defaulted to "" per formality type
+XML_FIELD_RULES = {
+    "NOA": {
+        "required": ["portCallId", "imoLloyds", "vesselName", "eta", "portAreaName"],
+        "numeric": ["portCallId", "imoLloyds"],
+        "strings": ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName"]
+    },
+    "ATA": {
+        "required": ["portCallId", "imoLloyds", "vesselName", "ata", "portAreaName"],
+        "numeric": ["portCallId", "imoLloyds"],
+        "strings": ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName"]
+    },
+    "VID": {
+        "required": ["portCallId", "imoLloyds", "vesselName", "eta", "portAreaName"],
+        "numeric": ["portCallId", "imoLloyds", "mmsi"],
+        "strings": ["vesselName", "portAreaName", "portToVisit", "prevPort", "berthName", "radioCallSign"]
+    }
+}
+
+class XMLPayloadError(ValueError):
+    """Port call data the XML converter can never accept (e.g. a missing mandatory field)."""
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_converter_session():
+    """Return the process-wide keep-alive session used for XML converter calls."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=XML_CONVERTER_CONFIG["max_concurrency"])
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers.update({"Content-Type": "application/json"})
+        return _session
+
+def get_converter_url(batch=False):
+    """Build the XML converter function URL, including the function key if configured.
+
+    With batch=True the URL of the batch endpoint is returned; unless configured separately it
+    is the single-document URL with a "-batch" suffix on the route.
+    """
+    xml_converterfunction_url = XML_CONVERTER_CONFIG["function_url"]
+    xml_converter_function_key = XML_CONVERTER_CONFIG["function_key"]
+
+    if batch:
+        if XML_CONVERTER_CONFIG["batch_function_url"]:
+            xml_converterfunction_url = XML_CONVERTER_CONFIG["batch_function_url"]
+        else:
+            base_url, separator, query = xml_converterfunction_url.partition("?")
+            xml_converterfunction_url = f"{base_url.rstrip('/')}-batch{separator}{query}"
+
+    # Add the function key to the URL if it exists
+    if xml_converter_function_key:
+        if "?" in xml_converterfunction_url:
+            xml_converterfunction_url += f"&code={xml_converter_function_key}"
+        else:
+            xml_converterfunction_url += f"?code={xml_converter_function_key}"
+    return xml_converterfunction_url
+
+def prepare_xml_payload(formality, data):
+    """Validate and normalise port call data for the XML converter.
+
+    Returns the prepared payload. Raises XMLPayloadError if a mandatory field is missing, as
+    retrying cannot fix that.
+    """
+    rules = XML_FIELD_RULES[formality]
+    for field in rules["required"]:
+        if field not in data or data[field] is None:
+            raise XMLPayloadError(f"Missing required field '{field}'")
+
+    payload = dict(data)
+
+    # Convert numeric fields to strings to avoid NoneType issues
+    for field in rules["numeric"]:
+        if field in payload and payload[field] is not None:
+            payload[field] = str(payload[field])
+
+    # Ensure string fields have proper values
+    for field in rules["strings"]:
+        if field in payload and payload[field] is None:
+            payload[field] = ""  # Replace None with empty string
+
+    # Truncate IDs if needed to prevent validation errors (max 17 chars)
+    if len(payload["portCallId"]) > 17:
+        original_id = payload["portCallId"]
+        payload["portCallId"] = payload["portCallId"][-17:]  # Keep the last 17 chars
+        logger.warning("Truncated portCallId from %s to %s for XML compatibility", original_id, payload['portCallId'])
+
+    return payload
+
+class HttpConverterTransport:
+    """Sends documents to the XML converter function over HTTP (for split deployments)."""
+
+    name = "http"
+
+    def convert(self, formality, payload):
+        """Convert one prepared payload and return the converter response body."""
+        response = get_converter_session().post(
+            get_converter_url(),
+            json={"portcall_data": payload, "formality_type": formality},
+            timeout=XML_CONVERTER_CONFIG["timeout"]
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"XML converter failed with status {response.status_code}: {response.text}")
+        return response.json()
+
+    def convert_batch(self, items):
+        """Convert {portcall_data, formality_type} items and return the per-item results."""
+        response = get_converter_session().post(
+            get_converter_url(batch=True),
+            json={"items": items},
+            timeout=XML_CONVERTER_CONFIG["batch_timeout"]
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"XML converter failed with status {response.status_code}: {response.text}")
+        return response.json().get("results") or []
+
+class InProcessConverterTransport:
+    """Calls the XML converter directly when it runs in the same Function App process."""
+
+    name = "inprocess"
+
+    def convert(self, formality, payload):
+        """Convert one prepared payload and return a response body like the HTTP endpoint's."""
+        result = self.convert_batch([{"portcall_data": payload, "formality_type": formality}])[0]
+        if result["status"] != "success":
+            raise RuntimeError(result["message"])
+        return result
+
+    def convert_batch(self, items):
+        """Convert {portcall_data, formality_type} items and return the per-item results."""
+        # Imported lazily so split deployments of the trigger do not load the converter
+        from PortmanXMLConverter.xml_converter import convert_portcall_batch
+        return convert_portcall_batch(items)
+
+CONVERTER_TRANSPORTS = {
+    HttpConverterTransport.name: HttpConverterTransport(),
+    InProcessConverterTransport.name: InProcessConverterTransport()
+}
+
+def get_converter_transport():
+    """Return the XML converter transport selected by XML_CONVERTER_CONFIG["transport"]."""
+    transport = XML_CONVERTER_CONFIG["transport"]
+    if transport not in CONVERTER_TRANSPORTS:
+        raise ValueError(f"Unknown XML converter transport: {transport}")
+    return CONVERTER_TRANSPORTS[transport]
+
+def request_xml_document(formality, data):
+    """Generate one XML document through the converter and return its SAS URL (None on failure)."""
+    return generate_xml_document(formality, data)[0]
+
+def generate_xml_document(formality, data):
+    """Generate one XML document through the converter.
+
+    Returns (sas_url, error, permanent): the SAS URL, or None and the reason the document could
+    not be generated, with permanent set if the port call data itself was rejected.
+    """
+    try:
+        try:
+            payload = prepare_xml_payload(formality, data)
+        except XMLPayloadError as e:
+            logger.warning("Cannot generate %s XML: %s for portCallId %s", formality, e, data.get('portCallId', 'unknown'))
+            return None, str(e), True
+
+        try:
+            response_data = get_converter_transport().convert(formality, payload)
+        except Exception as e:
+            logger.error("Error with %s XML generation/storage for portCallId %s: %s", formality, payload['portCallId'], e)
+            return None, str(e), False
+
+        # Get SAS URL from the response (new format uses sasUrl instead of url)
+        sas_url = response_data.get('sasUrl')
+
+        if not sas_url:
+            # Fallback to old response format if sasUrl is not found
+            plain_url = response_data.get('url')
+            if not plain_url:
+                logger.error("No URL found in XML converter response for portCallId %s", payload['portCallId'])
+                return None, "No URL in XML converter response", False
+
+            # Extract the blob name from the URL for SAS token generation
+            try:
+                blob_path = plain_url.split('.net/')[1]  # Get container_name/blob_path
+            except (IndexError, AttributeError):
+                logger.warning("Could not parse blob path from URL: %s", plain_url)
+                blob_path = plain_url  # Fallback to using the URL as is
+
+            # Generate the SAS URL using the shared utility function
+            sas_url = generate_blob_storage_link(blob_path, os.getenv("AzureWebJobsStorage"))
+
+            if not sas_url:
+                logger.warning("Failed to generate SAS URL for blob: %s", blob_path)
+                sas_url = plain_url  # Fallback to plain URL if SAS generation fails
+
+        logger.debug("%s XML for portCallId %s successfully generated and stored.", formality, payload['portCallId'])
+        return sas_url, None, False
+    except Exception as e:
+        logger.error("Error triggering %s XML function for portCallId %s: %s", formality, data.get('portCallId', 'unknown'), e)
+        return None, str(e), False
+
+def request_xml_batch(jobs):
+    """Generate XML documents for (formality, data) jobs with a single batch converter call.
+
+    Returns a (sas_url, error, permanent) result per job, as generate_xml_document does, in the
+    same order as the jobs. If the batch request itself fails, the documents are requested one
+    at a time instead.
+    """
+    payloads = []
+    results = [None] * len(jobs)
+    for i, (formality, data) in enumerate(jobs):
+        try:
+            payloads.append(prepare_xml_payload(formality, data))
+        except Exception as e:
+            logger.warning("Error preparing %s XML payload for portCallId %s: %s", formality, data.get('portCallId', 'unknown'), e)
+            payloads.append(None)
+            results[i] = (None, str(e), isinstance(e, XMLPayloadError))
+
+    positions = [i for i, payload in enumerate(payloads) if payload is not None]
+    if not positions:
+        return results
+
+    try:
+        converted = get_converter_transport().convert_batch([
+            {"portcall_data": payloads[i], "formality_type": jobs[i][0]} for i in positions
+        ])
+        if len(converted) != len(positions):
+            raise ValueError(f"Expected {len(positions)} results, got {len(converted)}")
+    except Exception as e:
+        logger.warning("Error with batch XML generation of %d documents, requesting them one at a time: %s", len(positions), e)
+        for i in positions:
+            results[i] = generate_xml_document(*jobs[i])
+        return results
+
+    for i, result in zip(positions, converted):
+        formality, port_call_id = jobs[i][0], payloads[i]["portCallId"]
+        if result.get("status") == "success" and result.get("sasUrl"):
+            results[i] = (result["sasUrl"], None, False)
+            logger.debug("%s XML for portCallId %s successfully generated and stored.", formality, port_call_id)
+        else:
+            logger.error("Error with %s XML generation/storage for portCallId %s: %s", formality, port_call_id, result.get('message'))
+            results[i] = (None, result.get("message") or "XML generation failed", False)
+    return results
+
+def request_xml_documents(jobs, max_concurrency=None, batch_size=None):
+    """Generate XML documents for (formality, data) jobs concurrently.
+
+    Jobs are sent to the batch endpoint in chunks of batch_size, so a burst of documents costs
+    one converter invocation per chunk. With batch_size 1 every document is requested
+    separately. Returns a (sas_url, error, permanent) result per job in the same order as the
+    jobs; see generate_xml_document.
+    """
+    if not jobs:
+        return []
+    max_concurrency = max_concurrency or XML_CONVERTER_CONFIG["max_concurrency"]
+    batch_size = batch_size or XML_CONVERTER_CONFIG["batch_size"]
+
+    if batch_size > 1 and len(jobs) > 1:
+        chunks = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks))) as executor:
+            return [result for results in executor.map(with_run_context(request_xml_batch), chunks)
+                    for result in results]
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(jobs))) as executor:
+        return list(executor.map(with_run_context(lambda job: generate_xml_document(*job)), jobs))
+
+def store_xml_urls(cursor, documents):
+    """Store generated XML URLs in the voyages and arrivals tables with a single UPDATE.
+
+    documents is a list of (formality, portCallId, xml_url) tuples; later entries win when a
+    port call has several documents of the same type. ATA URLs go to the most recent arrival
+    record of the port call and, if one exists, to the voyage. Returns the updated portCallIds.
+    """
+    urls = {}
+    for formality, port_call_id, xml_url in documents:
+        if xml_url:
+            urls.setdefault(int(port_call_id), {})[formality] = xml_url
+    if not urls:
+        return []
+
+    port_call_ids = list(urls)
+    cursor.execute("""
+        WITH urls AS (
+            SELECT * FROM unnest(%s::integer[], %s::text[], %s::text[], %s::text[])
+                AS u(portCallId, vid_xml_url, noa_xml_url, ata_xml_url)
+        ),
+        latest_arrivals AS (
+            SELECT DISTINCT ON (a.portCallId) a.id, u.ata_xml_url
+            FROM arrivals a
+            JOIN urls u ON u.portCallId = a.portCallId
+            WHERE u.ata_xml_url IS NOT NULL
+            ORDER BY a.portCallId, a.id DESC
+        ),
+        updated_arrivals AS (
+            UPDATE arrivals a SET ata_xml_url = l.ata_xml_url
+            FROM latest_arrivals l
+            WHERE a.id = l.id
+            RETURNING a.portCallId
+        )
+        UPDATE voyages v SET
+            vid_xml_url = COALESCE(u.vid_xml_url, v.vid_xml_url),
+            noa_xml_url = COALESCE(u.noa_xml_url, v.noa_xml_url),
+            ata_xml_url = CASE WHEN u.portCallId IN (SELECT portCallId FROM updated_arrivals)
+                THEN u.ata_xml_url ELSE v.ata_xml_url END
+        FROM urls u
+        WHERE v.portCallId = u.portCallId
+        RETURNING v.portCallId;
+    """, (
+        port_call_ids,
+        [urls[port_call_id].get("VID") for port_call_id in port_call_ids],
+        [urls[port_call_id].get("NOA") for port_call_id in port_call_ids],
+        [urls[port_call_id].get("ATA") for port_call_id in port_call_ids]
+    ))
+    return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,154 @@
+from config import DATABASE_CONFIG, XML_CONVERTER_CONFIG, XML_OUTBOX_CONFIG
+from PortmanTrigger.portman import log, get_db_connection
+from PortmanTrigger.metrics import increment, run_metrics, stage_timer
+from PortmanTrigger.migrations import ensure_database_schema
+from PortmanTrigger.xml_client import request_xml_documents, store_xml_urls
+
+def claim_xml_jobs(conn, batch_size, stale_after_seconds, max_attempts):
+    """Claim up to batch_size due outbox jobs and mark them as processing.
+
+    Jobs left in 'processing' for longer than stale_after_seconds (e.g. by a crashed worker)
+    are claimed again, unless they have used up max_attempts; those are marked failed so a job
+    that keeps crashing its worker is not claimed forever. SKIP LOCKED lets several dispatchers
+    drain the outbox concurrently.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE xml_outbox SET
+            status = 'failed',
+            last_error = 'Processing did not finish',
+            modified = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM xml_outbox
+            WHERE status = 'processing'
+              AND modified < CURRENT_TIMESTAMP - make_interval(secs => %s)
+              AND attempts >= %s
+            FOR UPDATE SKIP LOCKED
+        );
+    """, (stale_after_seconds, max_attempts))
+    cursor.execute("""
+        UPDATE xml_outbox SET
+            status = 'processing',
+            attempts = attempts + 1,
+            modified = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM xml_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'processing' AND modified < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                   AND attempts < %s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, portCallId, formality, payload, attempts;
+    """, (stale_after_seconds, max_attempts, batch_size))
+    # Keep outbox order so later documents for the same port call win when URLs are stored
+    jobs = sorted(cursor.fetchall(), key=lambda job: job[0])
+    conn.commit()
+    cursor.close()
+    return jobs
+
+def record_xml_job_results(cursor, jobs, results, max_attempts, retry_backoff_seconds):
+    """Mark finished jobs as done and schedule failed ones for retry with exponential backoff.
+
+    results are the (sas_url, error, permanent) results of request_xml_documents. Jobs whose
+    data was rejected outright are marked failed without retrying; the error of every failed
+    job is kept in last_error.
+    """
+    done_ids, done_urls = [], []
+    failed_ids, failed_statuses, failed_errors, failed_delays = [], [], [], []
+
+    for (job_id, port_call_id, formality, _, attempts), (xml_url, error, permanent) in zip(jobs, results):
+        if xml_url:
+            done_ids.append(job_id)
+            done_urls.append(xml_url)
+            continue
+        failed_ids.append(job_id)
+        failed_statuses.append("failed" if permanent or attempts >= max_attempts else "pending")
+        failed_errors.append(error or "XML generation failed")
+        failed_delays.append(retry_backoff_seconds * 2 ** (attempts - 1))
+
+    if done_ids:
+        cursor.execute("""
+            UPDATE xml_outbox o SET
+                status = 'done',
+                xml_url = r.xml_url,
+                last_error = NULL,
+                modified = CURRENT_TIMESTAMP
+            FROM unnest(%s::integer[], %s::text[]) AS r(id, xml_url)
+            WHERE o.id = r.id;
+        """, (done_ids, done_urls))
+    if failed_ids:
+        cursor.execute("""
+            UPDATE xml_outbox o SET
+                status = r.status,
+                last_error = r.error,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => r.delay),
+                modified = CURRENT_TIMESTAMP
+            FROM unnest(%s::integer[], %s::text[], %s::text[], %s::integer[]) AS r(id, status, error, delay)
+            WHERE o.id = r.id;
+        """, (failed_ids, failed_statuses, failed_errors, failed_delays))
+    return len(done_ids), failed_statuses.count("pending"), failed_statuses.count("failed")
+
+def dispatch_xml_outbox(max_workers=None, batch_size=None, max_attempts=None):
+    """Drain the xml_outbox table, generating queued VID/NOA/ATA documents concurrently.
+
+    Each claimed batch is sent to the XML converter over a shared connection pool with at most
+    max_workers requests in flight. The resulting URLs and outbox statuses are then written with
+    a handful of batched statements in one transaction. Failed jobs are retried with exponential
+    backoff until max_attempts is reached, after which they are marked failed; jobs whose port
+    call data the converter can never accept are marked failed right away.
+    """
+    max_workers = max_workers or XML_CONVERTER_CONFIG["max_concurrency"]
+    batch_size = batch_size or XML_OUTBOX_CONFIG["batch_size"]
+    max_attempts = max_attempts or XML_OUTBOX_CONFIG["max_attempts"]
+
+    with run_metrics("xml_outbox"):
+        totals = _dispatch_xml_outbox(max_workers, batch_size, max_attempts)
+        for name, value in totals.items():
+            increment(f"jobs_{name}", value)
+    return totals
+
+def _dispatch_xml_outbox(max_workers, batch_size, max_attempts):
+    totals = {"done": 0, "retrying": 0, "failed": 0}
+    with stage_timer("schema"):
+        ensure_database_schema()
+    conn = get_db_connection(DATABASE_CONFIG["dbname"])
+    if conn is None:
+        log("Failed to connect to database when dispatching XML outbox")
+        return totals
+
+    try:
+        while True:
+            with stage_timer("claim"):
+                jobs = claim_xml_jobs(conn, batch_size, XML_OUTBOX_CONFIG["stale_after_seconds"], max_attempts)
+            if not jobs:
+                break
+            log(f"Dispatching {len(jobs)} XML jobs from outbox...")
+            with stage_timer("convert"):
+                results = request_xml_documents(
+                    [(formality, payload) for _, _, formality, payload, _ in jobs], max_workers
+                )
+
+            cursor = conn.cursor()
+            with stage_timer("store_urls"):
+                store_xml_urls(cursor, [
+                    (formality, port_call_id, xml_url)
+                    for (_, port_call_id, formality, _, _), (xml_url, _, _) in zip(jobs, results)
+                ])
+                done, retrying, failed = record_xml_job_results(
+                    cursor, jobs, results, max_attempts, XML_OUTBOX_CONFIG["retry_backoff_seconds"]
+                )
+            with stage_timer("commit"):
+                conn.commit()
+            cursor.close()
+            increment("batches")
+
+            totals["done"] += done
+            totals["retrying"] += retrying
+            totals["failed"] += failed
+    finally:
+        conn.close()
+
+    log(f"XML outbox dispatch complete. Done: {totals['done']}, retrying: {totals['retrying']}, failed: {totals['failed']}")
+    return totals
@@ -25,4 +25,9 @@ XML_SCHEMA_CONFIG = {
         "schema_path": "schemas/VID/",
         "root_schema": "VID_Envelope_1p0.xsd"
     }
-} 
\ No newline at end of file
+}
+
+# Number of recently seen timestamp strings whose parsed and formatted values are kept
+DATETIME_CONFIG = {
+    "cache_size": int(os.environ.get("DATETIME_CACHE_SIZE", 4096))
+}
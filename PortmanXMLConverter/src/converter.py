@@ -8,15 +8,11 @@ from typing import Dict, Any, Optional, Tuple, Union
 from lxml import etree
 
 from .converter_config import OUTPUT_DIR
-from .validator import XMLValidator
+from .validator import XMLValidator, validation_policy
 from .parser import XMLParser
+from .templates import notification_fields
 from .transformer import XMLTransformer
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 class EMSWeConverter:
@@ -70,21 +66,44 @@ class EMSWeConverter:
         Returns:
             Tuple containing (success, output_path_or_error)
         """
+        success, result, _ = self._convert_to_emswe(portman_data, output_filename)
+        return success, result
 
+    def convert_to_emswe_document(self, portman_data: Dict[str, Any]) -> Tuple[bool, str, Dict[str, str]]:
+        """
+        Convert Portman agent data to an EMSWe-compliant XML string and its notification fields.
+
+        Args:
+            portman_data: Dictionary containing Portman agent data
+
+        Returns:
+            Tuple containing (success, xml_or_error, notification_fields); the fields are the
+            values Slack notifications show for the document (see templates.NOTIFICATION_SLOTS),
+            empty if the document was not rendered from a template
+        """
+        success, result, values = self._convert_to_emswe(portman_data)
+        if not success or values is None:
+            return success, result, {}
+        return True, result, notification_fields(self.formality_type, values)
+
+    def _convert_to_emswe(self, portman_data: Dict[str, Any],
+                          output_filename: str = None) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
         try:
             # Transform data to EMSWe XML
-            xml_root = self.transformer.portman_to_emswe(portman_data, self.formality_type)
+            xml_root, values = self.transformer.render_emswe(portman_data, self.formality_type)
 
             if xml_root is None:
-                return False, "Failed to transform data to EMSWe XML"
+                return False, "Failed to transform data to EMSWe XML", None
 
-            # Validate the generated XML
-            is_valid, errors = self.validator.validate(xml_root)
+            # Validate the generated XML if the validation policy selects this document
+            if validation_policy.should_validate(self.formality_type, portman_data):
+                is_valid, errors = self.validator.validate(xml_root)
+                validation_policy.record_result(self.formality_type, is_valid)
 
-            if not is_valid:
-                error_message = "\n".join(errors)
-                logger.error(f"Generated XML validation failed: {error_message}")
-                return False, error_message
+                if not is_valid:
+                    error_message = "\n".join(errors)
+                    logger.error(f"Generated XML validation failed: {error_message}")
+                    return False, error_message, None
 
             # Save to file if output filename is provided
             if output_filename:
@@ -94,17 +113,17 @@ class EMSWeConverter:
                 output_path = self.transformer.save_xml(xml_root, output_filename)
 
                 if not output_path:
-                    return False, "Failed to save XML to file"
+                    return False, "Failed to save XML to file", None
 
-                return True, output_path
+                return True, output_path, values
 
             # Return XML as string if no output filename
             xml_string = etree.tostring(xml_root, pretty_print=True, xml_declaration=True, encoding="UTF-8").decode("utf-8")
-            return True, xml_string
+            return True, xml_string, values
 
         except Exception as e:
             logger.error(f"Error converting to EMSWe: {str(e)}")
-            return False, f"Error: {str(e)}"
+            return False, f"Error: {str(e)}", None
 
     def convert_from_emswe(self, xml_file_path: str) -> Tuple[bool, Union[Dict[str, Any], str]]:
         """
@@ -34,6 +34,15 @@ SCHEMA_PATHS = {
     }
 }
 
+# Compile all schemas when the worker starts instead of on the first request per formality type
+SCHEMA_WARMUP = os.getenv("XML_SCHEMA_WARMUP", "false").lower() == "true"
+
+# Validation of generated documents: "always", "sampled" (every Nth document per formality type
+# plus every document with a new input shape) or "off" (documents are validated by the golden
+# tests in CI instead)
+VALIDATION_POLICY = os.getenv("XML_VALIDATION_POLICY", "always").lower()
+VALIDATION_SAMPLE_EVERY = int(os.getenv("XML_VALIDATION_SAMPLE_EVERY", 100))
+
 # XML namespaces used in EMSWe documents
 NAMESPACES = {
     "mai": "urn:un:unece:uncefact:data:standard:MAI:MMTPlus",
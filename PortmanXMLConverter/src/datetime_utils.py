@@ -0,0 +1,27 @@
+"""
+Timestamp helpers of the converter.
+
+These are the shared top-level datetime_utils module, which the ingest trigger uses too. When
+the converter is run from its own directory (the command-line interface) the repository root
+is not importable, so the shared module is loaded from its file instead.
+"""
+
+try:
+    import datetime_utils as _shared
+except ImportError:
+    import importlib.util
+    import os
+    import sys
+
+    _path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "datetime_utils.py"))
+    _spec = importlib.util.spec_from_file_location("datetime_utils", _path)
+    _shared = importlib.util.module_from_spec(_spec)
+    sys.modules["datetime_utils"] = _shared
+    _spec.loader.exec_module(_shared)
+
+parse_iso_datetime = _shared.parse_iso_datetime
+to_xml_datetime = _shared.to_xml_datetime
+to_minute_datetime = _shared.to_minute_datetime
+to_display_datetime = _shared.to_display_datetime
+get_datetime_cache_stats = _shared.get_datetime_cache_stats
+clear_datetime_caches = _shared.clear_datetime_caches
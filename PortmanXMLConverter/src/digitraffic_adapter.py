@@ -5,11 +5,34 @@ Adapter module for converting Digitraffic port call data to the format expected
 import json
 import logging
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from .datetime_utils import to_xml_datetime
 
 logger = logging.getLogger(__name__)
 
 
+def _format_timestamp(value: Any, label: str) -> Optional[str]:
+    """
+    Normalise a Digitraffic timestamp to the XML format, keeping the original value if it cannot be parsed.
+
+    Args:
+        value: Timestamp from the port call
+        label: Field name used in log messages
+
+    Returns:
+        Formatted timestamp, the original string, or None for missing and non-string values
+    """
+    if not value or not isinstance(value, str):
+        return None
+    formatted = to_xml_datetime(value)
+    if formatted is None:
+        logger.warning("Could not format %s: %s, using original value", label, value)
+        return value
+    logger.debug("Formatted %s: %s", label, formatted)
+    return formatted
+
+
 def adapt_digitraffic_to_portman(digitraffic_data: Dict[str, Any], xml_type=None) -> Dict[str, Any]:
     """
     Adapt Digitraffic port call data to the Portman format expected by the EMSWe converter.
@@ -30,11 +53,12 @@ def adapt_digitraffic_to_portman(digitraffic_data: Dict[str, Any], xml_type=None
         
         # Check and handle IMO number 0 case - treat as not present for all XML types
         if imo_lloyds == "0" or imo_lloyds == 0 or imo_lloyds == "unknown":
-            logger.info(f"IMO number is {imo_lloyds} for port call {port_call_id}. Setting to None for XML generation.")
+            logger.debug("IMO number is %s for port call %s. Setting to None for XML generation.", imo_lloyds, port_call_id)
             imo_lloyds = None
         
         # Log original values for debugging
-        logger.info(f"Adapting data for port call {port_call_id} - Original vesselName: {vessel_name}, imoLloyds: {imo_lloyds}, mmsi: {mmsi}")
+        logger.debug("Adapting data for port call %s - Original vesselName: %s, imoLloyds: %s, mmsi: %s",
+                     port_call_id, vessel_name, imo_lloyds, mmsi)
 
         # Arrival information
         eta = digitraffic_data.get("eta")
@@ -42,78 +66,11 @@ def adapt_digitraffic_to_portman(digitraffic_data: Dict[str, Any], xml_type=None
         etd = digitraffic_data.get("etd")
 
         # Log original eta value
-        logger.info(f"Original ETA value: {eta}")
-        logger.info(f"Original ETD value: {etd}")
+        logger.debug("Original ETA value: %s, ETD value: %s", eta, etd)
         
-        # Format ETA for XML usage if available
-        formatted_eta = None
-        if eta:
-            try:
-                # Handle different datetime formats
-                if isinstance(eta, str):
-                    # Try to standardize the format for ETA
-                    if '+' in eta:
-                        # Handle timezone offset format
-                        dt_part = eta.split('+')[0]
-                        if '.' in dt_part:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
-                        formatted_eta = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    elif 'Z' in eta:
-                        # Already in UTC format but ensure no milliseconds
-                        dt_part = eta.replace('Z', '')
-                        if '.' in dt_part:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
-                        formatted_eta = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    else:
-                        # No timezone, treat as UTC and add Z
-                        if '.' in eta:
-                            dt_obj = datetime.strptime(eta, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(eta, "%Y-%m-%dT%H:%M:%S")
-                        formatted_eta = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                logger.info(f"Formatted ETA: {formatted_eta}")
-            except Exception as e:
-                logger.warning(f"Could not format ETA: {str(e)}, using original value")
-                formatted_eta = eta
-        
-        # Format ETD for XML usage if available
-        formatted_etd = None
-        if etd:
-            try:
-                # Handle different datetime formats
-                if isinstance(etd, str):
-                    # Try to standardize the format for ETD
-                    if '+' in etd:
-                        # Handle timezone offset format
-                        dt_part = etd.split('+')[0]
-                        if '.' in dt_part:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
-                        formatted_etd = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    elif 'Z' in etd:
-                        # Already in UTC format but ensure no milliseconds
-                        dt_part = etd.replace('Z', '')
-                        if '.' in dt_part:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
-                        formatted_etd = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                    else:
-                        # No timezone, treat as UTC and add Z
-                        if '.' in etd:
-                            dt_obj = datetime.strptime(etd, "%Y-%m-%dT%H:%M:%S.%f")
-                        else:
-                            dt_obj = datetime.strptime(etd, "%Y-%m-%dT%H:%M:%S")
-                        formatted_etd = dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-                logger.info(f"Formatted ETD: {formatted_etd}")
-            except Exception as e:
-                logger.warning(f"Could not format ETD: {str(e)}, using original value")
-                formatted_etd = etd
+        # Format ETA and ETD for XML usage if available
+        formatted_eta = _format_timestamp(eta, "ETA")
+        formatted_etd = _format_timestamp(etd, "ETD")
         
         port_area_name = digitraffic_data.get("portAreaName", "")
         port_area_code = digitraffic_data.get("portAreaCode", "")
@@ -142,7 +99,7 @@ def adapt_digitraffic_to_portman(digitraffic_data: Dict[str, Any], xml_type=None
                 crew_on_arrival = None
 
         # Log passenger and crew counts for debugging
-        logger.info(f"Adapting port call {port_call_id} with passengers: {passengers_on_arrival}, crew: {crew_on_arrival}")
+        logger.debug("Adapting port call %s with passengers: %s, crew: %s", port_call_id, passengers_on_arrival, crew_on_arrival)
 
         # Build destination string, excluding unknown or empty values
         destination_parts = [port_to_visit]
@@ -228,12 +185,13 @@ def adapt_digitraffic_to_portman(digitraffic_data: Dict[str, Any], xml_type=None
             portman_data["crewOnArrival"] = crew_on_arrival
                 
         # Log the vessel info we're passing through
-        logger.info(f"Adapted Portman data contains vesselName: {portman_data.get('vesselName')}, imoLloyds: {portman_data.get('imoLloyds')}, mmsi: {portman_data.get('mmsi')}, eta: {portman_data.get('eta')}")
+        logger.debug("Adapted Portman data contains vesselName: %s, imoLloyds: %s, mmsi: %s, eta: %s",
+                     portman_data.get('vesselName'), portman_data.get('imoLloyds'), portman_data.get('mmsi'), portman_data.get('eta'))
 
         return portman_data
 
     except Exception as e:
-        logger.error(f"Error adapting Digitraffic data: {str(e)}")
+        logger.error("Error adapting Digitraffic data: %s", e)
         # Return minimal valid structure
         return {
             "document_id": f"MSGID-{datetime.now().timestamp()}",
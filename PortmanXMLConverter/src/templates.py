@@ -0,0 +1,285 @@
+"""
+Precompiled XML templates for generating EMSWe documents.
+
+Each formality type has a skeleton tree containing every element its document can have, built
+once per process. Rendering a document copies the skeleton, fills the variable slots and removes
+the optional elements that are not used, which is much cheaper than creating every element
+with its namespaced tag per document.
+"""
+
+from copy import deepcopy
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from lxml import etree
+
+from .converter_config import NAMESPACES
+
+# Slot value that removes an element (and its children) from the rendered document
+OMIT = object()
+
+class Node(NamedTuple):
+    """Template node: a prefixed tag, an optional slot name and static content."""
+    tag: str
+    slot: Optional[str] = None
+    text: Optional[str] = None
+    attrib: Optional[Dict[str, str]] = None
+    children: Tuple["Node", ...] = ()
+    optional: bool = False
+
+def node(tag: str, *children: Node, slot: Optional[str] = None, text: Optional[str] = None,
+         attrib: Optional[Dict[str, str]] = None, optional: bool = False) -> Node:
+    """Shorthand for declaring template nodes."""
+    return Node(tag, slot, text, attrib, children, optional)
+
+class XMLTemplate:
+    """
+    Skeleton XML document with named slots.
+
+    Slots on leaf elements receive text; slots on container elements only control whether the
+    element is kept. Optional elements are removed unless their slot is given a value other
+    than OMIT.
+    """
+
+    def __init__(self, nsmap: Dict[Optional[str], str], children: Tuple[Node, ...], root_tag: str = "Envelope"):
+        """
+        Build the skeleton tree.
+
+        Args:
+            nsmap: Namespace map of the root element
+            children: Top-level template nodes
+            root_tag: Tag of the root element
+        """
+        self._skeleton = etree.Element(root_tag, nsmap=nsmap)
+        self._slots = {}  # slot name -> (index in document order, is text slot)
+        self._optional = []
+        for child in children:
+            self._add(self._skeleton, child)
+
+        # Element indices follow document order of the skeleton (root is 0)
+        index = {element: i for i, element in enumerate(self._skeleton.iter())}
+        self._slots = {name: (index[element], is_text) for name, (element, is_text) in self._slots.items()}
+
+    def _add(self, parent: etree._Element, spec: Node) -> None:
+        prefix, local_name = spec.tag.split(":")
+        element = etree.SubElement(parent, f"{{{NAMESPACES[prefix]}}}{local_name}")
+        if spec.text is not None:
+            element.text = spec.text
+        if spec.attrib:
+            for name, value in spec.attrib.items():
+                element.set(name, value)
+        if spec.slot:
+            if spec.slot in self._slots:
+                raise ValueError(f"Duplicate template slot: {spec.slot}")
+            self._slots[spec.slot] = (element, not spec.children)
+            if spec.optional:
+                self._optional.append(spec.slot)
+        elif spec.optional:
+            raise ValueError(f"Optional template node {spec.tag} needs a slot")
+        for child in spec.children:
+            self._add(element, child)
+
+    def render(self, values: Dict[str, Any]) -> etree._Element:
+        """
+        Render a document.
+
+        Args:
+            values: Slot values; text for leaf slots, any value other than OMIT to keep an
+                optional container
+
+        Returns:
+            Root element of the rendered document
+        """
+        root = deepcopy(self._skeleton)
+        elements = list(root.iter())
+        removed = []
+
+        for name in self._optional:
+            if values.get(name, OMIT) is OMIT:
+                removed.append(elements[self._slots[name][0]])
+
+        for name, value in values.items():
+            if value is OMIT:
+                continue
+            position, is_text = self._slots[name]
+            if is_text:
+                elements[position].text = value
+
+        for element in removed:
+            element.getparent().remove(element)
+        return root
+
+def _mai_nodes() -> Node:
+    """MAI part shared by all formality types."""
+    return node("mai:MAI",
+        node("mai:ExchangedDocument",
+            node("ram:ID", slot="document_id"),
+            node("ram:TypeCode", slot="type_code"),
+            node("ram:PurposeCode", text="9"),
+            node("ram:VersionID", text="1.0"),
+            node("ram:FirstSignatoryDocumentAuthentication",
+                node("ram:ActualDateTime",
+                    node("udt:DateTimeString", slot="timestamp")))),
+        node("mai:ExchangedDeclaration",
+            node("ram:ID", slot="declaration_id"),
+            node("ram:DeclarantTradeParty",
+                node("ram:ID", slot="declarant_id", optional=True),
+                node("ram:Name", slot="declarant_name", optional=True),
+                node("ram:RoleCode", slot="declarant_role_code", optional=True),
+                node("ram:DefinedTradeContact",
+                    node("ram:PersonName", slot="contact_name", optional=True),
+                    node("ram:TelephoneUniversalCommunication",
+                        node("ram:CompleteNumber", slot="contact_phone"),
+                        slot="contact_phone_element", optional=True),
+                    node("ram:EmailURIUniversalCommunication",
+                        node("ram:URIID", slot="contact_email"),
+                        slot="contact_email_element", optional=True),
+                    slot="contact", optional=True),
+                node("ram:PostalTradeAddress",
+                    node("ram:PostcodeCode", slot="address_postcode", optional=True),
+                    node("ram:StreetName", slot="address_street", optional=True),
+                    node("ram:CityName", slot="address_city", optional=True),
+                    node("ram:CountryID", slot="address_country", optional=True),
+                    node("ram:BuildingNumber", slot="address_building", optional=True),
+                    slot="address", optional=True),
+                slot="declarant", optional=True)),
+        node("mai:SpecifiedLogisticsTransportMovement",
+            node("ram:CallTransportEvent",
+                node("ram:ID", slot="call_id")),
+            slot="call_transport", optional=True))
+
+def _ata_nodes() -> Node:
+    return node("ata:ATA",
+        node("ata:ExchangedDocument",
+            node("ram:Remarks", slot="remarks", optional=True)),
+        node("ata:SpecifiedLogisticsTransportMovement",
+            node("ram:ArrivalTransportEvent",
+                node("ram:ActualArrivalRelatedDateTime",
+                    node("qdt:DateTimeString", slot="arrival_datetime"),
+                    slot="arrival_datetime_element", optional=True),
+                node("ram:OccurrenceLogisticsLocation",
+                    node("ram:ID", slot="location"),
+                    slot="location_element", optional=True),
+                slot="arrival_event", optional=True),
+            node("ram:CallTransportEvent",
+                node("ram:ActualArrivalRelatedDateTime",
+                    node("qdt:DateTimeString", slot="call_datetime"),
+                    slot="call_datetime_element", optional=True),
+                node("ram:MaritimeAnchorageIndicator", slot="anchorage_indicator", optional=True),
+                slot="call_event", optional=True)))
+
+def _noa_nodes() -> Node:
+    return node("noa:NOA",
+        node("noa:ExchangedDocument",
+            node("ram:Remarks", slot="remarks", attrib={"languageID": "EN"}, optional=True),
+            # Non-text remarks produce an empty element without a language
+            node("ram:Remarks", slot="remarks_empty", optional=True)),
+        node("noa:SpecifiedLogisticsTransportMovement",
+            node("ram:ModeCode", slot="mode_code"),
+            node("ram:ID", slot="voyage_id"),
+            node("ram:PassengerQuantity", slot="passenger_count", optional=True),
+            node("ram:CrewQuantity", slot="crew_count", optional=True),
+            node("ram:CargoDescription", slot="cargo_description", attrib={"languageID": "EN"}),
+            node("ram:DangerousGoodsIndicator", slot="dangerous_goods_indicator"),
+            node("ram:CallPurposeCode", slot="call_purpose_code"),
+            node("ram:RegularServiceIndicator", slot="regular_service_indicator"),
+            node("ram:TotalOnboardPersonQuantity", slot="total_count"),
+            node("ram:FoundStowawayIndicator", slot="found_stowaway_indicator"),
+            node("ram:UsedLogisticsTransportMeans",
+                node("ram:TypeCode", slot="vessel_type_code", optional=True),
+                node("ram:RegistrationTransportEvent",
+                    node("ram:ID", slot="imo"),
+                    slot="registration_event", optional=True),
+                node("ram:ShipCompanyTradeParty",
+                    node("ram:Name", slot="shipping_company"),
+                    slot="shipping_company_element", optional=True),
+                slot="used_means", optional=True),
+            node("ram:ItineraryTransportRoute",
+                node("ram:ItineraryStopTransportEvent",
+                    node("ram:ArrivalRelatedDateTime",
+                        node("qdt:DateTimeString", slot="stop_arrival_datetime")),
+                    node("ram:DepartureRelatedDateTime",
+                        node("qdt:DateTimeString", slot="stop_departure_datetime")),
+                    node("ram:SequenceNumeric", text="1"),
+                    node("ram:OccurrenceLogisticsLocation",
+                        node("ram:ID", slot="port_id"))),
+                slot="itinerary", optional=True),
+            node("ram:CallTransportEvent",
+                node("ram:EstimatedTransportMeansArrivalOccurrenceDateTime",
+                    node("qdt:DateTimeString", slot="eta")),
+                node("ram:EstimatedTransportMeansDepartureOccurrenceDateTime",
+                    node("qdt:DateTimeString", slot="etd")),
+                node("ram:ExpectedArrivalPortAreaRelatedLogisticsLocation",
+                    node("ram:Name", slot="berth_name"),
+                    slot="berth", optional=True))))
+
+def _vid_nodes() -> Node:
+    return node("vid:VID",
+        node("vid:SpecifiedLogisticsTransportMovement",
+            node("ram:UsedLogisticsTransportMeans",
+                node("ram:Name", slot="vessel_name"),
+                node("ram:IMONumberIndicator", slot="imo_indicator"),
+                node("ram:IMOID", slot="imo", optional=True),
+                node("ram:MMSIID", slot="mmsi", optional=True),
+                node("ram:TypeCode", slot="vessel_type_code", optional=True),
+                node("ram:CallSignID", slot="call_sign", optional=True)),
+            node("ram:CallTransportEvent",
+                node("ram:EstimatedTransportMeansArrivalOccurrenceDateTime",
+                    node("qdt:DateTimeString", slot="eta")),
+                node("ram:OccurrenceLogisticsLocation",
+                    node("ram:ID", slot="location_id")))))
+
+FORMALITY_NODES = {
+    "ATA": _ata_nodes,
+    "NOA": _noa_nodes,
+    "VID": _vid_nodes
+}
+
+# Template slots holding the values shown in Slack notifications, per formality type. The VID
+# notification shows the MAI document ID in place of a port call ID.
+NOTIFICATION_SLOTS = {
+    "ATA": {"port_call_id": "call_id", "time_value": "call_datetime", "remarks": "remarks", "port": "location"},
+    "NOA": {"port_call_id": "call_id", "time_value": "eta", "remarks": "remarks", "port": "port_id",
+            "passengers_count": "passenger_count", "crew_count": "crew_count"},
+    "VID": {"port_call_id": "document_id", "time_value": "eta", "port": "location_id",
+            "vessel_name": "vessel_name", "imo": "imo", "mmsi": "mmsi"}
+}
+
+def notification_fields(formality_type: str, values: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Pick the notification fields out of the slot values a document was rendered from.
+
+    Args:
+        formality_type: Type of formality (ATA, NOA or VID)
+        values: Slot values passed to XMLTemplate.render
+
+    Returns:
+        Dictionary of field name to text, without the fields missing from the document
+    """
+    fields = {}
+    for field, slot in NOTIFICATION_SLOTS.get(formality_type, {}).items():
+        value = values.get(slot)
+        if value is not None and value is not OMIT:
+            fields[field] = str(value)
+    return fields
+
+@lru_cache(maxsize=None)
+def get_template(formality_type: str) -> XMLTemplate:
+    """
+    Return the compiled template for a formality type, building it on first use.
+
+    Args:
+        formality_type: Type of formality (ATA, NOA or VID)
+
+    Returns:
+        Compiled XMLTemplate
+    """
+    prefix = formality_type.lower()
+    nsmap = {
+        None: "",  # Default namespace
+        "mai": NAMESPACES["mai"],
+        "qdt": NAMESPACES["qdt"],
+        "ram": NAMESPACES["ram"],
+        "udt": NAMESPACES["udt"],
+        prefix: NAMESPACES[prefix]
+    }
+    return XMLTemplate(nsmap, (_mai_nodes(), FORMALITY_NODES[formality_type]()))
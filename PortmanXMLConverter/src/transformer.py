@@ -5,11 +5,13 @@ Transformer module for converting between Portman agent data and EMSWe-compliant
 import os
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, Optional, Tuple, Union
 from lxml import etree
 
 from .converter_config import NAMESPACES, OUTPUT_DIR
+from .datetime_utils import to_xml_datetime
 from .parser import XMLParser
+from .templates import OMIT, get_template
 
 logger = logging.getLogger(__name__)
 
@@ -18,12 +20,17 @@ class XMLTransformer:
     Transforms data between Portman agent format and EMSWe-compliant XML.
     """
 
-    def __init__(self):
+    def __init__(self, use_templates: bool = True):
         """
         Initialize the XML transformer.
+
+        Args:
+            use_templates: Render documents from precompiled templates instead of building
+                them element by element
         """
         self.namespaces = NAMESPACES
         self.parser = XMLParser()
+        self.use_templates = use_templates
 
         # Ensure output directory exists
         #os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -39,6 +46,30 @@ class XMLTransformer:
         Returns:
             Root element of the generated XML document or None if transformation fails
         """
+        return self.render_emswe(portman_data, formality_type)[0]
+
+    def render_emswe(self, portman_data: Dict[str, Any],
+                     formality_type: str = "ATA") -> Tuple[Optional[etree._Element], Optional[Dict[str, Any]]]:
+        """
+        Transform Portman agent data to EMSWe-compliant XML, keeping the template slot values.
+
+        Args:
+            portman_data: Dictionary containing Portman agent data
+            formality_type: Type of formality to generate (e.g., "ATA", "NOA")
+
+        Returns:
+            Tuple of the root element (None if transformation fails) and the slot values the
+            document was rendered from (None when it was built element by element)
+        """
+        if self.use_templates and formality_type in self.TEMPLATE_VALUES:
+            try:
+                values = self._mai_template_values(portman_data, formality_type)
+                values.update(self.TEMPLATE_VALUES[formality_type](self, portman_data))
+                return get_template(formality_type).render(values), values
+            except Exception as e:
+                logger.error(f"Error transforming Portman data to EMSWe: {str(e)}")
+                return None, None
+
         try:
             # Create root element with namespaces
             nsmap = {
@@ -74,10 +105,10 @@ class XMLTransformer:
                 formality_element = self._generate_vid_element(portman_data)
                 root.append(formality_element)
 
-            return root
+            return root, None
         except Exception as e:
             logger.error(f"Error transforming Portman data to EMSWe: {str(e)}")
-            return None
+            return None, None
 
     def emswe_to_portman(self, xml_root: etree._Element) -> Dict[str, Any]:
         """
@@ -624,6 +655,221 @@ class XMLTransformer:
         
         return vid_element
 
+    def _mai_template_values(self, portman_data: Dict[str, Any], formality_type: str) -> Dict[str, Any]:
+        """
+        Compute the MAI template slot values (same content as _generate_mai_element).
+
+        Args:
+            portman_data: Dictionary containing Portman agent data
+            formality_type: Type of formality (e.g., "ATA", "NOA")
+
+        Returns:
+            Dictionary of slot values
+        """
+        values = {
+            "document_id": portman_data["document_id"] if "document_id" in portman_data
+                else f"MSGID{int(datetime.now().timestamp())}",
+            "type_code": formality_type,
+            "timestamp": self._format_datetime_for_xml(
+                portman_data["timestamp"] if "timestamp" in portman_data
+                else datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+            ),
+            "declaration_id": portman_data["declaration_id"] if "declaration_id" in portman_data
+                else f"DECL-PT-{datetime.now().strftime('%y-%m%d%H%M')}"
+        }
+
+        if "declarant" in portman_data:
+            declarant = portman_data["declarant"]
+            values["declarant"] = True
+            for key, slot in (("id", "declarant_id"), ("name", "declarant_name"), ("role_code", "declarant_role_code")):
+                if key in declarant:
+                    values[slot] = declarant[key]
+
+            if "contact" in declarant:
+                contact = declarant["contact"]
+                values["contact"] = True
+                if "name" in contact:
+                    values["contact_name"] = contact["name"]
+                if "phone" in contact:
+                    values["contact_phone_element"] = True
+                    values["contact_phone"] = contact["phone"]
+                if "email" in contact:
+                    values["contact_email_element"] = True
+                    values["contact_email"] = contact["email"]
+
+            if "address" in declarant:
+                address = declarant["address"]
+                values["address"] = True
+                for key in ("postcode", "street", "city", "country", "building"):
+                    if key in address:
+                        values[f"address_{key}"] = address[key]
+
+        # Transport movement with call ID - ONLY for ATA and NOA, NOT for VID
+        if "call_id" in portman_data and formality_type != "VID":
+            values["call_transport"] = True
+            values["call_id"] = portman_data["call_id"]
+            logger.debug("Added CallTransportEvent with ID %s for %s", portman_data['call_id'], formality_type)
+
+        return values
+
+    def _ata_template_values(self, portman_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute the ATA template slot values (same content as _generate_ata_element)."""
+        values = {}
+        if "remarks" in portman_data:
+            values["remarks"] = portman_data["remarks"]
+
+        if "arrival_datetime" in portman_data or "location" in portman_data:
+            values["arrival_event"] = True
+            if "arrival_datetime" in portman_data:
+                values["arrival_datetime_element"] = True
+                values["arrival_datetime"] = self._format_datetime_for_xml(portman_data["arrival_datetime"])
+            if "location" in portman_data:
+                values["location_element"] = True
+                values["location"] = portman_data["location"]
+
+        if "call_datetime" in portman_data or "anchorage_indicator" in portman_data:
+            values["call_event"] = True
+            if "call_datetime" in portman_data:
+                values["call_datetime_element"] = True
+                values["call_datetime"] = self._format_datetime_for_xml(portman_data["call_datetime"])
+            if "anchorage_indicator" in portman_data:
+                values["anchorage_indicator"] = portman_data["anchorage_indicator"]
+
+        return values
+
+    def _noa_template_values(self, portman_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute the NOA template slot values (same content as _generate_noa_element)."""
+        values = {}
+        if "remarks" in portman_data:
+            if isinstance(portman_data["remarks"], str):
+                values["remarks"] = portman_data["remarks"]
+            else:
+                values["remarks_empty"] = None
+
+        values["mode_code"] = portman_data.get("mode_code", "1")
+        values["voyage_id"] = portman_data["voyage_id"] if "voyage_id" in portman_data \
+            else f"VYG-{portman_data.get('call_id') if 'call_id' in portman_data else str(int(datetime.now().timestamp()))}"
+
+        # Passenger and crew counts are optional elements, but must be >= 1 when included
+        counts = []
+        for field, slot in (("passengersOnArrival", "passenger_count"), ("crewOnArrival", "crew_count")):
+            count = None
+            if field in portman_data and portman_data[field] is not None:
+                try:
+                    value = portman_data[field]
+                    count = value if isinstance(value, int) else int(value)
+                    if count > 0:
+                        values[slot] = str(count)
+                    else:
+                        count = None
+                except (ValueError, TypeError):
+                    count = None
+            counts.append(count)
+        passenger_count, crew_count = counts
+
+        values["cargo_description"] = portman_data.get("cargo_description", "Standard cargo")
+        values["dangerous_goods_indicator"] = portman_data.get("dangerous_goods_indicator", "0")
+        values["call_purpose_code"] = portman_data.get("call_purpose_code", "1")
+        values["regular_service_indicator"] = portman_data.get("regular_service_indicator", "0")
+
+        # Schema requires at least 1 person on board
+        total_count = max(1, (passenger_count or 0) + (crew_count or 0))
+        values["total_count"] = str(total_count)
+        values["found_stowaway_indicator"] = portman_data.get("found_stowaway_indicator", "0")
+
+        logger.debug("NOA XML generation - PassengersOnArrival: %s, CrewOnArrival: %s, passenger count: %s, "
+                     "crew count: %s, total count: %s", portman_data.get('passengersOnArrival'),
+                     portman_data.get('crewOnArrival'), passenger_count, crew_count, total_count)
+
+        if "imoLloyds" in portman_data or "vesselName" in portman_data:
+            values["used_means"] = True
+            if "vesselTypeCode" in portman_data:
+                values["vessel_type_code"] = str(portman_data["vesselTypeCode"])
+            if "imoLloyds" in portman_data and portman_data["imoLloyds"] is not None and str(portman_data["imoLloyds"]) != "0":
+                values["registration_event"] = True
+                values["imo"] = str(portman_data["imoLloyds"])
+            if "shippingCompany" in portman_data:
+                values["shipping_company_element"] = True
+                values["shipping_company"] = portman_data["shippingCompany"]
+
+        now_string = None
+        if "eta" not in portman_data or "etd" not in portman_data:
+            now_string = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        if "portToVisit" in portman_data or "location" in portman_data:
+            values["itinerary"] = True
+            values["stop_arrival_datetime"] = self._format_datetime_for_xml(portman_data.get("eta", now_string))
+            values["stop_departure_datetime"] = self._format_datetime_for_xml(portman_data.get("etd", now_string))
+            values["port_id"] = portman_data["portToVisit"] if "portToVisit" in portman_data \
+                else portman_data.get("location", "PORT1")
+
+        eta_value = portman_data["eta"] if "eta" in portman_data \
+            else portman_data.get("arrival_datetime", now_string)
+        values["eta"] = self._format_datetime_for_xml(eta_value)
+        etd_value = portman_data["etd"] if "etd" in portman_data \
+            else portman_data.get("departure_datetime", now_string)
+        values["etd"] = self._format_datetime_for_xml(etd_value)
+
+        if "berthCode" in portman_data or "berthName" in portman_data:
+            values["berth"] = True
+            values["berth_name"] = portman_data["berthName"] if "berthName" in portman_data \
+                else portman_data.get("berthCode", "")
+
+        return values
+
+    def _vid_template_values(self, portman_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute the VID template slot values (same content as _generate_vid_element)."""
+        values = {"vessel_name": portman_data.get("vesselName", "")}
+
+        imo_value = portman_data.get("imoLloyds")
+        has_valid_imo = imo_value and str(imo_value) != "0" and str(imo_value) != "unknown"
+        values["imo_indicator"] = "1" if has_valid_imo else "0"
+        if has_valid_imo:
+            # IMO numbers are exactly 7 digits
+            imo_text = str(imo_value)
+            if len(imo_text) < 7:
+                imo_text = imo_text.zfill(7)
+            if len(imo_text) > 7:
+                imo_text = imo_text[-7:]
+            values["imo"] = imo_text
+
+        if portman_data.get("mmsi"):
+            mmsi_value = str(portman_data["mmsi"]).strip()
+            if len(mmsi_value) == 9 and mmsi_value.isdigit() and mmsi_value != "000000000":
+                values["mmsi"] = mmsi_value
+            else:
+                logger.warning(f"MMSI value {mmsi_value} is invalid (must be 9 digits). Skipping MMSIID element.")
+
+        if "vesselTypeCode" in portman_data:
+            values["vessel_type_code"] = str(portman_data["vesselTypeCode"])
+
+        if "radioCallSign" in portman_data and portman_data["radioCallSign"]:
+            call_sign = portman_data["radioCallSign"].strip()
+            if call_sign:
+                values["call_sign"] = call_sign
+
+        eta_value = None
+        if "eta" in portman_data and portman_data["eta"]:
+            eta_value = portman_data["eta"]
+        elif "arrival_datetime" in portman_data and portman_data["arrival_datetime"]:
+            eta_value = portman_data["arrival_datetime"]
+        if eta_value:
+            values["eta"] = self._format_datetime_for_xml(eta_value)
+        else:
+            # Only use current time + 1 hour as a fallback if no ETA provided
+            values["eta"] = self._format_datetime_for_xml((datetime.now() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.000Z"))
+            logger.warning(f"No ETA provided for VID, using generated timestamp: {values['eta']}")
+
+        values["location_id"] = portman_data["portToVisit"] if portman_data.get("portToVisit") else "XXXXX"
+        return values
+
+    # Slot value builders for the formality-specific part of each template
+    TEMPLATE_VALUES = {
+        "ATA": _ata_template_values,
+        "NOA": _noa_template_values,
+        "VID": _vid_template_values
+    }
+
     def _transform_to_portman_format(self, extracted_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Transform extracted XML data to Portman agent format.
@@ -681,43 +927,18 @@ class XMLTransformer:
         """
         if not dt_string:
             return datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-            
-        try:
-            # Handle multiple possible formats
-            dt_obj = None
-            if '.' in dt_string and 'Z' in dt_string:
-                # Format with milliseconds and Z
-                dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%S.%fZ")
-            elif '+' in dt_string:
-                # Format with timezone offset
-                dt_part = dt_string.split('+')[0]
-                if '.' in dt_part:
-                    dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
-                else:
-                    dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
-            elif 'Z' in dt_string:
-                # Format without milliseconds but with Z
-                try:
-                    dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%SZ")
-                except ValueError:
-                    # Try removing Z and parsing
-                    dt_string_no_z = dt_string.replace('Z', '')
-                    dt_obj = datetime.strptime(dt_string_no_z, "%Y-%m-%dT%H:%M:%S")
-            else:
-                # Try basic format without Z
-                dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%S")
-            
-            # Format to the required XML format without milliseconds
-            return dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
-        except ValueError as e:
-            # If parsing fails, return as is
-            logger.warning(f"Could not format datetime string: {dt_string} - {str(e)}")
-            # Try to return a valid format anyway
-            if isinstance(dt_string, str) and 'T' in dt_string:
-                # Try to extract just the date and time part (remove timezone if present)
-                parts = dt_string.split('T')
-                if len(parts) == 2:
-                    date_part = parts[0]
-                    time_part = parts[1].split('+')[0].split('.')[0].replace('Z', '')
-                    return f"{date_part}T{time_part}Z"
-            return dt_string
+
+        formatted = to_xml_datetime(dt_string)
+        if formatted is not None:
+            return formatted
+
+        logger.warning(f"Could not format datetime string: {dt_string}")
+        # Try to return a valid format anyway
+        if isinstance(dt_string, str) and 'T' in dt_string:
+            # Try to extract just the date and time part (remove timezone if present)
+            parts = dt_string.split('T')
+            if len(parts) == 2:
+                date_part = parts[0]
+                time_part = parts[1].split('+')[0].split('.')[0].replace('Z', '')
+                return f"{date_part}T{time_part}Z"
+        return dt_string
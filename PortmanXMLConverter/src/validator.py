@@ -3,14 +3,236 @@ XML validation module for EMSWe-compliant XML documents.
 """
 
 import os
+import time
 import logging
+import threading
 from lxml import etree
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from .converter_config import SCHEMA_PATHS, NAMESPACES
+from .converter_config import SCHEMA_PATHS, NAMESPACES, VALIDATION_POLICY, VALIDATION_SAMPLE_EVERY
 
 logger = logging.getLogger(__name__)
 
+class SchemaRegistry:
+    """
+    Process-wide, thread-safe cache of compiled XSD schemas keyed by formality type.
+
+    Each schema is compiled once, on first use or by warmup(). Compile times and cache
+    hit/miss counters are kept per formality type and returned by get_stats().
+    """
+
+    def __init__(self):
+        self._schemas = {}
+        self._compile_locks = {}
+        self._validation_locks = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _locks_for(self, formality_type: str) -> Tuple[threading.Lock, threading.Lock]:
+        with self._lock:
+            if formality_type not in self._compile_locks:
+                self._compile_locks[formality_type] = threading.Lock()
+                self._validation_locks[formality_type] = threading.Lock()
+                self._stats[formality_type] = {"hits": 0, "misses": 0, "compile_seconds": None}
+            return self._compile_locks[formality_type], self._validation_locks[formality_type]
+
+    def _compile(self, formality_type: str) -> etree.XMLSchema:
+        schema_paths = SCHEMA_PATHS.get(formality_type, {})
+        if not schema_paths:
+            raise ValueError(f"No schema paths defined for formality type: {formality_type}")
+
+        main_schema_path = schema_paths.get("main")
+        if not main_schema_path or not os.path.exists(main_schema_path):
+            # Add debug information
+            print(f"DEBUG: Schema file not found at: {main_schema_path}")
+            print(f"DEBUG: Current working directory: {os.getcwd()}")
+            print(
+                f"DEBUG: Files in schemas directory: {os.listdir(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schemas')) if os.path.exists(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schemas')) else 'schemas directory not found'}")
+
+            raise FileNotFoundError(f"Main schema file not found: {main_schema_path}")
+
+        # Create XML parser with schema resolution
+        parser = etree.XMLParser(resolve_entities=False)
+
+        # Load and parse the schema
+        schema_doc = etree.parse(main_schema_path, parser)
+        return etree.XMLSchema(schema_doc)
+
+    def get(self, formality_type: str) -> etree.XMLSchema:
+        """
+        Return the compiled schema for a formality type, compiling it on first use.
+
+        Args:
+            formality_type: The type of formality (e.g., "ATA", "NOA")
+
+        Returns:
+            The compiled lxml XMLSchema
+        """
+        compile_lock, _ = self._locks_for(formality_type)
+        schema = self._schemas.get(formality_type)
+        if schema is None:
+            with compile_lock:
+                schema = self._schemas.get(formality_type)
+                if schema is None:
+                    started = time.perf_counter()
+                    schema = self._compile(formality_type)
+                    elapsed = time.perf_counter() - started
+                    self._schemas[formality_type] = schema
+                    with self._lock:
+                        self._stats[formality_type]["misses"] += 1
+                        self._stats[formality_type]["compile_seconds"] = elapsed
+                    logger.info(f"Compiled schema for {formality_type} in {elapsed * 1000:.1f} ms")
+                    return schema
+        with self._lock:
+            self._stats[formality_type]["hits"] += 1
+        return schema
+
+    def validation_lock(self, formality_type: str) -> threading.Lock:
+        """
+        Return the lock guarding validation with a formality type's schema.
+
+        A compiled schema keeps the error log of its last validation, so concurrent
+        validations with the same schema object must not interleave.
+        """
+        return self._locks_for(formality_type)[1]
+
+    def warmup(self, formality_types: Optional[List[str]] = None) -> None:
+        """
+        Compile schemas ahead of the first request.
+
+        Args:
+            formality_types: Formality types to compile (default: all configured types)
+        """
+        for formality_type in formality_types or SCHEMA_PATHS.keys():
+            self.get(formality_type)
+
+    def get_stats(self) -> Dict[str, Dict[str, Union[int, float, None]]]:
+        """
+        Return compile time and cache hit/miss counters per formality type.
+        """
+        with self._lock:
+            return {formality_type: dict(stats) for formality_type, stats in self._stats.items()}
+
+    def clear(self) -> None:
+        """
+        Drop all compiled schemas and counters.
+        """
+        with self._lock:
+            self._schemas.clear()
+            self._stats = {formality_type: {"hits": 0, "misses": 0, "compile_seconds": None}
+                           for formality_type in self._compile_locks}
+
+# Shared by all XMLValidator instances in the process
+schema_registry = SchemaRegistry()
+
+class ValidationPolicy:
+    """
+    Decides which generated documents are validated against the XSDs.
+
+    Policies:
+        always: validate every document
+        sampled: validate every Nth document per formality type, and every document whose
+            input shape (keys, value types and empty values) has not been seen before
+        off: never validate generated documents
+
+    Counters per formality type show how many documents were validated and how many of
+    those failed validation.
+    """
+
+    POLICIES = ("always", "sampled", "off")
+
+    def __init__(self, policy: str = "always", sample_every: int = 100, max_shapes: int = 10000):
+        """
+        Initialize the validation policy.
+
+        Args:
+            policy: One of POLICIES; unknown values fall back to "always"
+            sample_every: Validate every Nth document with the sampled policy
+            max_shapes: Maximum number of input shapes remembered per formality type
+        """
+        if policy not in self.POLICIES:
+            logger.warning(f"Unknown XML validation policy '{policy}', validating every document")
+            policy = "always"
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def input_shape(data: Any) -> Any:
+        """
+        Return a hashable description of the structure of the input data.
+
+        Two inputs with the same shape produce documents with the same elements.
+        """
+        if isinstance(data, dict):
+            return tuple(sorted((key, ValidationPolicy.input_shape(value)) for key, value in data.items()))
+        return type(data).__name__, bool(data)
+
+    def _stats_for(self, formality_type: str) -> Dict[str, int]:
+        stats = self._stats.get(formality_type)
+        if stats is None:
+            stats = self._stats[formality_type] = {"documents": 0, "validated": 0, "skipped": 0, "failed": 0}
+        return stats
+
+    def should_validate(self, formality_type: str, data: Dict[str, Any]) -> bool:
+        """
+        Decide whether to validate the document generated from the input data.
+
+        Args:
+            formality_type: The type of formality (e.g., "ATA", "NOA")
+            data: Input the document was generated from
+
+        Returns:
+            True if the document should be validated
+        """
+        with self._lock:
+            stats = self._stats_for(formality_type)
+            stats["documents"] += 1
+            if self.policy == "always":
+                validate = True
+            elif self.policy == "off":
+                validate = False
+            else:
+                shapes = self._shapes.setdefault(formality_type, set())
+                shape = self.input_shape(data)
+                validate = (stats["documents"] - 1) % self.sample_every == 0 or shape not in shapes
+                if shape not in shapes and len(shapes) < self.max_shapes:
+                    shapes.add(shape)
+            stats["validated" if validate else "skipped"] += 1
+            return validate
+
+    def record_result(self, formality_type: str, is_valid: bool) -> None:
+        """
+        Record the outcome of a validation decided by should_validate().
+        """
+        if not is_valid:
+            with self._lock:
+                self._stats_for(formality_type)["failed"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return the policy and document/validated/skipped/failed counters per formality type.
+        """
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "formality_types": {formality_type: dict(stats) for formality_type, stats in self._stats.items()}
+            }
+
+    def reset(self) -> None:
+        """
+        Forget seen input shapes and counters.
+        """
+        with self._lock:
+            self._shapes.clear()
+            self._stats.clear()
+
+# Shared by all converters in the process
+validation_policy = ValidationPolicy(VALIDATION_POLICY, VALIDATION_SAMPLE_EVERY)
+
 class XMLValidator:
     """
     Validates XML documents against EMSWe XSD schemas.
@@ -28,33 +250,13 @@ class XMLValidator:
         self.schema = None
         self._load_schema()
 
-    # Updated _load_schema method
     def _load_schema(self) -> None:
         """
-        Load the XSD schema for validation.
+        Load the XSD schema for validation from the process-wide schema registry.
         """
-        if not self.schema_paths:
-            raise ValueError(f"No schema paths defined for formality type: {self.formality_type}")
-
         try:
-            main_schema_path = self.schema_paths.get("main")
-            if not main_schema_path or not os.path.exists(main_schema_path):
-                # Add debug information
-                print(f"DEBUG: Schema file not found at: {main_schema_path}")
-                print(f"DEBUG: Current working directory: {os.getcwd()}")
-                print(
-                    f"DEBUG: Files in schemas directory: {os.listdir(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schemas')) if os.path.exists(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schemas')) else 'schemas directory not found'}")
-
-                raise FileNotFoundError(f"Main schema file not found: {main_schema_path}")
-
-            # Create XML parser with schema resolution
-            parser = etree.XMLParser(resolve_entities=False)
-
-            # Load and parse the schema
-            schema_doc = etree.parse(main_schema_path, parser)
-            self.schema = etree.XMLSchema(schema_doc)
-
-            logger.info(f"Successfully loaded schema for {self.formality_type}")
+            self.schema = schema_registry.get(self.formality_type)
+            self._validation_lock = schema_registry.validation_lock(self.formality_type)
         except Exception as e:
             logger.error(f"Failed to load schema: {str(e)}")
             raise
@@ -83,12 +285,13 @@ class XMLValidator:
                 xml_doc = xml_content
 
             # Validate against schema
-            is_valid = self.schema.validate(xml_doc)
+            with self._validation_lock:
+                is_valid = self.schema.validate(xml_doc)
 
-            # Collect error messages if validation failed
-            if not is_valid:
-                for error in self.schema.error_log:
-                    errors.append(f"Line {error.line}, Column {error.column}: {error.message}")
+                # Collect error messages if validation failed
+                if not is_valid:
+                    for error in self.schema.error_log:
+                        errors.append(f"Line {error.line}, Column {error.column}: {error.message}")
 
             return is_valid, errors
 
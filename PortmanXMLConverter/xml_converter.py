@@ -11,46 +11,79 @@ import json
 import argparse
 import logging
 import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 
 try:
     # Try importing with package prefix
     from PortmanXMLConverter.src.converter import EMSWeConverter
     from PortmanXMLConverter.src.digitraffic_adapter import adapt_digitraffic_to_portman
+    from PortmanXMLConverter.src.validator import schema_registry, validation_policy
+    from PortmanXMLConverter.src.converter_config import SCHEMA_WARMUP
 except ImportError:
     # Try importing directly when running from within the package directory
     from src.converter import EMSWeConverter
     from src.digitraffic_adapter import adapt_digitraffic_to_portman
+    from src.validator import schema_registry, validation_policy
+    from src.converter_config import SCHEMA_WARMUP
 try:
     import azure.functions as func
 except ImportError:
     # For command-line usage
     func = None
-try:
-    from azure.storage.blob import BlobServiceClient
-except ImportError:
-    # For command-line usage without Azure SDK
-    BlobServiceClient = None
 from config import AZURE_STORAGE_CONFIG
 
 # Try to import the shared blob utilities
 try:
-    from PortmanTrigger.blob_utils import generate_blob_storage_link
+    from PortmanTrigger.blob_utils import NOTIFICATION_METADATA_KEY, generate_blob_storage_link, get_blob_url, upload_blobs
 except ImportError:
     try:
         # Try alternative import path
-        from blob_utils import generate_blob_storage_link
+        from blob_utils import NOTIFICATION_METADATA_KEY, generate_blob_storage_link, get_blob_url, upload_blobs
     except ImportError:
-        # Fallback definition if the module can't be imported
+        # Fallback definitions if the module (or the Azure SDK) can't be imported
         def generate_blob_storage_link(blob_name, connection_string=None):
             logging.warning("generate_blob_storage_link function not available in XML Converter")
             return None
+        get_blob_url = None
+        upload_blobs = None
+        # Documents are only saved locally, so no notification metadata is attached
+        NOTIFICATION_METADATA_KEY = None
+
+# Try to import the shared logging setup
+try:
+    from PortmanTrigger.log_utils import configure_logging, log_payload
+except ImportError:
+    try:
+        from log_utils import configure_logging, log_payload
+    except ImportError:
+        def configure_logging():
+            logging.basicConfig(
+                level=logging.INFO,
+                format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            )
+
+        def log_payload(logger, kind, payload, sample_every=None):
+            logger.debug("%s payload: %s", kind, payload)
+            return True
+
+# Try to import the shared run metrics
+try:
+    from PortmanTrigger.metrics import run_metrics, stage_timer
+except ImportError:
+    try:
+        from metrics import run_metrics, stage_timer
+    except ImportError:
+        from contextlib import nullcontext
+
+        def run_metrics(name):
+            return nullcontext()
+
+        def stage_timer(stage):
+            return nullcontext()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger('PortmanXMLConverter')
 
 # Try to import storage configuration or use fallback
@@ -62,6 +95,21 @@ except ImportError:
         "connection_string": None,
         "container_name": None
     }
+try:
+    from config import XML_CONVERTER_CONFIG
+except ImportError:
+    XML_CONVERTER_CONFIG = {
+        "upload_concurrency": 8,
+        "max_batch_items": 500
+    }
+
+# Compile the EMSWe schemas once at worker startup if configured
+if SCHEMA_WARMUP:
+    try:
+        schema_registry.warmup()
+        logger.info(f"Schema cache warmed up: {schema_registry.get_stats()}")
+    except Exception as e:
+        logger.error(f"Schema warmup failed, schemas will be compiled on first use: {str(e)}")
 
 def parse_arguments():
     """Parse command-line arguments."""
@@ -298,16 +346,20 @@ def convert_from_digitraffic(args):
 
         return 0
     
-def convert_from_portcall_data(portcall_data, xml_type=None):
-    """Convert Digitraffic port call data to EMSWe XML."""
-    # Read JSON file
+def build_xml_document(portcall_data, xml_type=None):
+    """Build and validate the EMSWe XML for one Digitraffic port call.
+
+    Returns:
+        Tuple of (success, result) where result is a (filename, xml, metadata) tuple on
+        success or the error message on failure. metadata holds the fields shown in Slack
+        notifications, so the notifier does not need to parse the document.
+    """
     converter = EMSWeConverter(formality_type=xml_type)
 
     # Process single port call (either the whole file or the first port call)
     if isinstance(portcall_data, dict) and "portCalls" in portcall_data and portcall_data["portCalls"]:
         port_call = portcall_data["portCalls"][0]
-        logger.info(f"Processing first port call from a list of {len(portcall_data['portCalls'])} port calls")
-        print(f"Processing first port call from a list of {len(portcall_data['portCalls'])} port calls")
+        logger.info("Processing first port call from a list of %d port calls", len(portcall_data['portCalls']))
     else:
         port_call = portcall_data
 
@@ -315,7 +367,8 @@ def convert_from_portcall_data(portcall_data, xml_type=None):
     original_vessel_name = port_call.get('vesselName')
     original_imo_lloyds = port_call.get('imoLloyds')
     
-    logger.info(f"Original values before adaptation - vesselName: {original_vessel_name}, imoLloyds: {original_imo_lloyds}")
+    logger.debug("Original values before adaptation - vesselName: %s, imoLloyds: %s",
+                 original_vessel_name, original_imo_lloyds)
 
     # Adapt Digitraffic data to Portman format
     portman_data = adapt_digitraffic_to_portman(port_call, xml_type)
@@ -323,11 +376,11 @@ def convert_from_portcall_data(portcall_data, xml_type=None):
     # Ensure critical fields are preserved
     if original_vessel_name and not portman_data.get('vesselName'):
         portman_data['vesselName'] = original_vessel_name
-        logger.info(f"Restored original vesselName: {original_vessel_name}")
+        logger.debug("Restored original vesselName: %s", original_vessel_name)
         
     if original_imo_lloyds and not portman_data.get('imoLloyds'):
         portman_data['imoLloyds'] = original_imo_lloyds
-        logger.info(f"Restored original imoLloyds: {original_imo_lloyds}")
+        logger.debug("Restored original imoLloyds: %s", original_imo_lloyds)
             
     # Special handling for VID format
     if xml_type == 'VID':
@@ -336,77 +389,146 @@ def convert_from_portcall_data(portcall_data, xml_type=None):
             portman_data['vesselName'] = port_call['vesselName']
         if not portman_data.get('imoLloyds') and 'imoLloyds' in port_call:
             portman_data['imoLloyds'] = port_call['imoLloyds']
-        logger.info(f"Final Portman data for VID - vesselName: {portman_data.get('vesselName')}, imoLloyds: {portman_data.get('imoLloyds')}, eta: {portman_data.get('eta')}")
+        logger.debug("Final Portman data for VID - vesselName: %s, imoLloyds: %s, eta: %s",
+                     portman_data.get('vesselName'), portman_data.get('imoLloyds'), portman_data.get('eta'))
 
-    # Generate a unique filename based on formality type
+    # Generate a unique filename based on formality type. The timestamp only has second
+    # resolution and documents are uploaded with overwrite, so a random suffix keeps documents
+    # of the same type for one port call built in the same second apart
     port_call_id = portcall_data.get('portCallId')
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     
     # Use appropriate prefix based on the XML type (default to ATA if not specified)
     xml_prefix = xml_type if xml_type in ["ATA", "NOA", "VID"] else "ATA"
-    filename = f"{xml_prefix}_{port_call_id}_{timestamp}.xml"
+    filename = f"{xml_prefix}_{port_call_id}_{timestamp}_{uuid.uuid4().hex[:8]}.xml"
 
     # Convert to EMSWe XML
-    success, result = converter.convert_to_emswe(portman_data)
+    success, result, fields = converter.convert_to_emswe_document(portman_data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Schema cache stats: %s, validation stats: %s",
+                     schema_registry.get_stats(), validation_policy.get_stats())
 
     if not success:
-        logger.error(f"Conversion failed: {result}")
-        print(f"Conversion failed: {result}")
-        return None
+        logger.error("Conversion failed: %s", result)
+        return False, result
+
+    metadata = None
+    if fields and NOTIFICATION_METADATA_KEY:
+        metadata = {NOTIFICATION_METADATA_KEY: "1", "xml_type": xml_prefix, **fields}
+    return True, (filename, result, metadata)
+
+def save_xml_locally(filename, xml):
+    """Save an XML document under the local output directory and return its path."""
+    os.makedirs("output", exist_ok=True)
+    local_filename = os.path.join("output", filename)
+    with open(local_filename, "w", encoding="utf-8") as f:
+        f.write(xml)
+    logger.info("Saved XML to local file: %s", local_filename)
+    return local_filename
+
+def store_xml_documents(documents, max_workers=None):
+    """Store (filename, xml, metadata) documents in blob storage, uploading them concurrently.
+
+    Storage clients are shared for the whole process (see PortmanTrigger.blob_utils), so
+    storing a document costs a single upload request.
+
+    Args:
+        documents: List of (filename, xml) or (filename, xml, metadata) tuples
+        max_workers: Maximum number of concurrent uploads
+
+    Returns:
+        List of SAS URLs (or local file paths when blob storage is not available) in input order
+    """
+    if not documents:
+        return []
 
     # Get storage connection string from app settings
     connection_string = AZURE_STORAGE_CONFIG["connection_string"]
     container_name = AZURE_STORAGE_CONFIG["container_name"]
     
-    if (not connection_string or not container_name or 'PYTEST_CURRENT_TEST' in os.environ):
+    if (not connection_string or not container_name or upload_blobs is None
+            or 'PYTEST_CURRENT_TEST' in os.environ):
         # For local/command-line usage, save to a local file
-        os.makedirs("output", exist_ok=True)
-        local_filename = os.path.join("output", filename)
-        with open(local_filename, "w", encoding="utf-8") as f:
-            f.write(result)
-        logger.info(f"Saved XML to local file: {local_filename}")
-        return local_filename
+        return [save_xml_locally(document[0], document[1]) for document in documents]
     
+    max_workers = max_workers or XML_CONVERTER_CONFIG["upload_concurrency"]
     try:
-        # Connect to blob storage
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-        container_client = blob_service_client.get_container_client(container_name)
-        
-        # Create container if it doesn't exist
-        if not container_client.exists():
-            container_client.create_container()
-        
-        # Upload XML to Blob Storage
-        blob_client = container_client.get_blob_client(filename)
-        blob_client.upload_blob(result, overwrite=True, content_type="application/xml")
-        
-        # Get the full blob path for generating SAS URL
-        blob_path = f"{container_name}/{filename}"
-        
+        errors = upload_blobs(container_name, documents, connection_string, max_workers)
+    except Exception as e:
+        errors = [e] * len(documents)
+
+    stored = []
+    for document, error in zip(documents, errors):
+        filename, xml = document[0], document[1]
+        if error is not None:
+            # Handle storage-related exceptions
+            logger.error("Error storing XML to Azure Blob Storage: %s", error)
+            # Fall back to local file storage
+            stored.append(save_xml_locally(filename, xml))
+            continue
+
         # Generate SAS URL using the shared utility function
-        sas_url = generate_blob_storage_link(blob_path, connection_string)
+        sas_url = generate_blob_storage_link(f"{container_name}/{filename}", connection_string)
         
         # If SAS URL generation failed, fall back to plain URL
         if not sas_url:
-            logger.warning(f"Failed to generate SAS URL, falling back to plain URL")
-            sas_url = blob_client.url
+            logger.warning("Failed to generate SAS URL, falling back to plain URL")
+            sas_url = get_blob_url(container_name, filename, connection_string)
         
-        logger.info(f"XML stored with SAS URL: {sas_url}")
-        
-        return sas_url
-    except Exception as e:
-        # Handle storage-related exceptions
-        logger.error(f"Error storing XML to Azure Blob Storage: {str(e)}")
-        # Fall back to local file storage
-        os.makedirs("output", exist_ok=True)
-        local_filename = os.path.join("output", filename)
-        with open(local_filename, "w", encoding="utf-8") as f:
-            f.write(result)
-        logger.info(f"Saved XML to local file: {local_filename}")
-        return local_filename
+        logger.debug("XML stored with SAS URL: %s", sas_url)
+        stored.append(sas_url)
+    return stored
+
+def convert_from_portcall_data(portcall_data, xml_type=None):
+    """Convert Digitraffic port call data to EMSWe XML and store it.
+
+    Returns the SAS URL (or local file path) of the stored document, or None if conversion failed.
+    """
+    success, result = build_xml_document(portcall_data, xml_type)
+    if not success:
+        return None
+    return store_xml_documents([result])[0]
+
+def convert_portcall_batch(items, max_workers=None):
+    """Convert a batch of port calls to EMSWe XML and store them.
+
+    Documents are built and validated one after another, then uploaded concurrently.
+
+    Args:
+        items: List of dicts with portcall_data and formality_type (default ATA)
+        max_workers: Maximum number of concurrent uploads
+
+    Returns:
+        List of per-item result dicts in input order, each with status "success" and the
+        sasUrl of the document, or status "error" and a message.
+    """
+    results = [None] * len(items)
+    documents, positions = [], []
+    with stage_timer("build"):
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('portcall_data'):
+                results[i] = {"status": "error", "message": "Missing portcall_data"}
+                continue
+            formality_type = item.get('formality_type', 'ATA')
+            if formality_type not in ['ATA', 'NOA', 'VID']:
+                results[i] = {"status": "error", "message": f"Invalid formality_type: {formality_type}"}
+                continue
+            try:
+                success, result = build_xml_document(item['portcall_data'], formality_type)
+            except Exception as e:
+                success, result = False, str(e)
+            if not success:
+                results[i] = {"status": "error", "message": f"{formality_type} XML generation failed: {result}"}
+                continue
+            documents.append(result)
+            positions.append(i)
+
+    for i, sas_url in zip(positions, store_xml_documents(documents, max_workers)):
+        results[i] = {"status": "success", "sasUrl": sas_url}
+    return results
 
 def xml_converter(req: func.HttpRequest) -> func.HttpResponse:
-    logging.info('Portman XML converter function processing a request')
+    logger.info('Portman XML converter function processing a request')
     try:
         req_body = req.get_json()
             
@@ -418,8 +540,8 @@ def xml_converter(req: func.HttpRequest) -> func.HttpResponse:
         
         portcall_data = req_body.get('portcall_data')
         
-        # Log detailed port call data for debugging
-        logging.info(f"Received port call data: {json.dumps(portcall_data)}")
+        # Log full port call data for debugging (sampled, DEBUG only)
+        log_payload(logger, "XML converter request", portcall_data)
         
         formality_type = req_body.get('formality_type', 'ATA')  # Default to ATA if not specified
         
@@ -431,7 +553,8 @@ def xml_converter(req: func.HttpRequest) -> func.HttpResponse:
                 status_code=400
             )
         
-        logging.info(f"Generating {formality_type}-XML message from: {portcall_data}")
+        logger.info("Generating %s-XML message for portCallId %s", formality_type,
+                    portcall_data.get('portCallId') if isinstance(portcall_data, dict) else None)
         sas_url = convert_from_portcall_data(portcall_data, formality_type)
 
         if sas_url is None:
@@ -452,13 +575,61 @@ def xml_converter(req: func.HttpRequest) -> func.HttpResponse:
                 status_code=200
             )
     except Exception as e:
-        logging.error(f"Error processing arrival data: {str(e)}")
+        logger.error("Error processing arrival data: %s", e)
         return func.HttpResponse(
             json.dumps({"status": "error", "message": str(e)}),
             mimetype="application/json", 
             status_code=500
         )
 
+def xml_converter_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """Convert a batch of port calls to EMSWe XML in one invocation.
+
+    Expects {"items": [{"portcall_data": {...}, "formality_type": "NOA"}, ...]} and returns the
+    per-item results in request order.
+    """
+    logger.info('Portman XML converter function processing a batch request')
+    try:
+        req_body = req.get_json()
+        items = req_body.get('items') if isinstance(req_body, dict) else None
+
+        if not isinstance(items, list) or not items:
+            return func.HttpResponse(
+                "Please pass a non-empty items list in the request body",
+                status_code=400
+            )
+
+        max_items = XML_CONVERTER_CONFIG["max_batch_items"]
+        if len(items) > max_items:
+            return func.HttpResponse(
+                json.dumps({"status": "error", "message": f"Batch of {len(items)} items exceeds the limit of {max_items}"}),
+                mimetype="application/json",
+                status_code=400
+            )
+
+        with run_metrics("xml_converter_batch"):
+            results = convert_portcall_batch(items)
+        succeeded = sum(1 for result in results if result["status"] == "success")
+        logger.info("Batch XML conversion complete. %d of %d documents generated and stored.", succeeded, len(items))
+
+        return func.HttpResponse(
+            json.dumps({
+                "status": "success" if succeeded == len(items) else "partial",
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "results": results
+            }),
+            mimetype="application/json",
+            status_code=200
+        )
+    except Exception as e:
+        logger.error("Error processing XML batch: %s", e)
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": str(e)}),
+            mimetype="application/json",
+            status_code=500
+        )
+
 if __name__ == "__main__":
     """Main entry point for command-line usage."""
     args = parse_arguments()
@@ -0,0 +1,101 @@
+"""
+Benchmark for normalising Digitraffic timestamps.
+
+Compares timestamps per second of the strptime ladder the converter used before with the shared
+fromisoformat-based normaliser, for each timestamp variant Digitraffic sends, and checks that
+both give the same result. The normaliser is measured with a cold cache (every timestamp
+unique) and with a realistic share of repeated timestamps.
+
+Usage:
+    python -m benchmarks.bench_datetime [--timestamps 100000] [--distinct 2000] [--repeat 3]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from datetime_utils import clear_datetime_caches, to_xml_datetime
+
+# Timestamp variants seen in the Digitraffic port call API
+VARIANTS = {
+    "millis+offset": "%Y-%m-%dT%H:%M:%S.000+00:00",
+    "offset": "%Y-%m-%dT%H:%M:%S+00:00",
+    "millis+Z": "%Y-%m-%dT%H:%M:%S.000Z",
+    "Z": "%Y-%m-%dT%H:%M:%SZ",
+    "naive": "%Y-%m-%dT%H:%M:%S"
+}
+
+
+def legacy_format(dt_string):
+    """The strptime ladder previously used by XMLTransformer._format_datetime_for_xml."""
+    try:
+        if '.' in dt_string and 'Z' in dt_string:
+            dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%S.%fZ")
+        elif '+' in dt_string:
+            dt_part = dt_string.split('+')[0]
+            if '.' in dt_part:
+                dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S.%f")
+            else:
+                dt_obj = datetime.strptime(dt_part, "%Y-%m-%dT%H:%M:%S")
+        elif 'Z' in dt_string:
+            try:
+                dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%SZ")
+            except ValueError:
+                dt_obj = datetime.strptime(dt_string.replace('Z', ''), "%Y-%m-%dT%H:%M:%S")
+        else:
+            dt_obj = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%S")
+        return dt_obj.strftime("%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return None
+
+
+def generate_timestamps(count, distinct, date_format):
+    """Generate `count` timestamps cycling through `distinct` values, ETA-style on the minute."""
+    start = datetime(2024, 3, 13, 6, 0)
+    values = [(start + timedelta(minutes=5 * i)).strftime(date_format) for i in range(distinct)]
+    return [values[i % distinct] for i in range(count)]
+
+
+def format_all(func, timestamps):
+    return [func(timestamp) for timestamp in timestamps]
+
+
+def format_all_cold(func, timestamps):
+    clear_datetime_caches()
+    return format_all(func, timestamps)
+
+
+def best_time(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Digitraffic timestamp normalisation")
+    parser.add_argument("--timestamps", type=int, default=100000, help="Timestamps normalised per run")
+    parser.add_argument("--distinct", type=int, default=2000, help="Distinct timestamps in the repeated workload")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    print(f"{'variant':>13} | {'legacy ts/s':>11} | {'cold ts/s':>10} | {'cached ts/s':>11} | "
+          f"{'cold':>6} | {'cached':>7} | {'identical':>9}")
+    for name, date_format in VARIANTS.items():
+        unique = generate_timestamps(args.timestamps, args.timestamps, date_format)
+        repeated = generate_timestamps(args.timestamps, args.distinct, date_format)
+        identical = format_all(legacy_format, unique) == format_all_cold(to_xml_datetime, unique)
+
+        legacy = best_time(format_all, args.repeat, legacy_format, repeated)
+        cold = best_time(format_all_cold, args.repeat, to_xml_datetime, unique)
+        clear_datetime_caches()
+        cached = best_time(format_all, args.repeat, to_xml_datetime, repeated)
+        print(f"{name:>13} | {args.timestamps / legacy:>11.0f} | {args.timestamps / cold:>10.0f} | "
+              f"{args.timestamps / cached:>11.0f} | {legacy / cold:>5.1f}x | {legacy / cached:>6.1f}x | "
+              f"{str(identical):>9}")
+
+
+if __name__ == "__main__":
+    main()
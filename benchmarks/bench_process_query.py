@@ -0,0 +1,105 @@
+"""
+Benchmark for normalising raw port calls into voyages column arrays.
+
+Compares the dict-per-row path (process_query followed by build_voyage_columns) with the
+columnar PortCallBatch path used by the streaming ingest. No database is needed.
+
+Usage:
+    python -m benchmarks.bench_process_query [--sizes 10000,100000] [--repeat 3]
+"""
+
+import argparse
+import time
+import tracemalloc
+from unittest.mock import patch
+
+from PortmanTrigger import portman
+
+
+def generate_port_calls(count):
+    """Generate `count` raw port calls shaped like the Digitraffic API response."""
+    port_calls = []
+    for i in range(count):
+        port_calls.append({
+            "portCallId": 5000000 + i,
+            "portCallTimestamp": "2024-03-12T08:00:00.000+00:00",
+            "imoLloyds": 9000000 + i % 2000,
+            "mmsi": 230000000 + i,
+            "vesselTypeCode": "20",
+            "vesselName": f"Bench Vessel {i}",
+            "radioCallSign": "OJAA",
+            "prevPort": "FIMHQ",
+            "portToVisit": "FITKU",
+            "nextPort": "FILAN",
+            "agentInfo": [
+                {"role": 1, "name": "Bench Agent"},
+                {"role": 2, "name": "Bench Lines"}
+            ],
+            "imoInformation": [
+                {"imoGeneralDeclaration": "Arrival", "numberOfPassangers": i % 300, "numberOfCrew": 40},
+                {"imoGeneralDeclaration": "Departure", "numberOfPassangers": i % 250, "numberOfCrew": 40}
+            ],
+            "portAreaDetails": [{
+                "eta": "2024-03-13T10:00:00.000+00:00",
+                "ata": None,
+                "portAreaCode": "PASSE",
+                "portAreaName": "Matkustajasatama",
+                "berthCode": "v1",
+                "berthName": "viking1",
+                "etd": "2024-03-13T18:00:00.000+00:00",
+                "atd": None
+            }]
+        })
+    return port_calls
+
+
+def dict_per_row(port_calls, tracked_vessels):
+    return portman.build_voyage_columns(portman.process_query(port_calls, tracked_vessels))
+
+
+def columnar(port_calls, tracked_vessels):
+    batches = portman.iter_port_call_batches(port_calls, tracked_vessels, batch_size=len(port_calls))
+    return [batch.voyage_columns() for batch in batches]
+
+
+def best_time(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def peak_memory(func, *args):
+    """Peak memory allocated while running func, in MB."""
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark port call normalisation")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated port call counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    tracked = set(range(9000000, 9000050))
+    print(f"{'port calls':>10} | {'filter':<8} | {'dict per row':>12} | {'columnar':>9} | {'speedup':>7} | "
+          f"{'peak MB (dict / columnar)':>25}")
+    with patch.object(portman, "log"):
+        for size in (int(value) for value in args.sizes.split(",")):
+            port_calls = generate_port_calls(size)
+            for label, tracked_vessels in (("all", None), ("tracked", tracked)):
+                baseline = best_time(dict_per_row, args.repeat, port_calls, tracked_vessels)
+                batched = best_time(columnar, args.repeat, port_calls, tracked_vessels)
+                memory = f"{peak_memory(dict_per_row, port_calls, tracked_vessels):.1f} / " \
+                         f"{peak_memory(columnar, port_calls, tracked_vessels):.1f}"
+                print(f"{size:>10} | {label:<8} | {baseline:>11.3f}s | {batched:>8.3f}s | "
+                      f"{baseline / batched:>6.2f}x | {memory:>25}")
+
+
+if __name__ == "__main__":
+    main()
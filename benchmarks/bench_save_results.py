@@ -0,0 +1,186 @@
+"""
+Benchmark for writing port calls to the voyages table.
+
+Compares the previous row-by-row INSERT/UPDATE loop with the bulk upsert used by
+save_results_to_db. Both run against a scratch schema (portman_bench) in the configured
+database, so the real voyages/arrivals/xml_outbox tables are left untouched.
+
+Usage:
+    python -m benchmarks.bench_save_results [--sizes 1000,10000,50000]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from config import DATABASE_CONFIG
+from PortmanTrigger import portman
+
+BENCH_SCHEMA = "portman_bench"
+
+
+class CountingCursor:
+    """Cursor proxy that counts statements sent to the server."""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter["round_trips"] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection:
+    """Connection proxy that counts statements and commits."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.counter = {"round_trips": 0}
+
+    def cursor(self):
+        return CountingCursor(self._conn.cursor(), self.counter)
+
+    def commit(self):
+        self.counter["round_trips"] += 1
+        return self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def generate_results(count, eta_shift_minutes=0):
+    """Generate `count` processed port call records like process_query returns."""
+    base = datetime(2024, 3, 13, 10, 0) + timedelta(minutes=eta_shift_minutes)
+    results = []
+    for i in range(count):
+        eta = base + timedelta(minutes=i % 1440)
+        results.append({
+            "portCallId": 5000000 + i,
+            "portCallTimestamp": "2024-03-12T08:00:00.000+00:00",
+            "imoLloyds": 9000000 + i,
+            "mmsi": 230000000 + i,
+            "vesselTypeCode": "20",
+            "vesselName": f"Bench Vessel {i}",
+            "radioCallSign": "OJAA",
+            "prevPort": "FIMHQ",
+            "portToVisit": "FITKU",
+            "nextPort": "FILAN",
+            "agentName": "Bench Agent",
+            "shippingCompany": "Bench Lines",
+            "eta": eta.strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+            "ata": None,
+            "portAreaCode": "PASSE",
+            "portAreaName": "Matkustajasatama",
+            "berthCode": "v1",
+            "berthName": "viking1",
+            "etd": (eta + timedelta(hours=8)).strftime("%Y-%m-%dT%H:%M:%S.000+00:00"),
+            "atd": None,
+            "passengersOnArrival": i % 300,
+            "passengersOnDeparture": i % 250,
+            "crewOnArrival": 40,
+            "crewOnDeparture": 40,
+        })
+    return results
+
+
+def legacy_save_results_to_db(results, conn):
+    """The previous per-row write loop (XML generation removed)."""
+    cursor = conn.cursor()
+    port_call_ids = list(set(entry["portCallId"] for entry in results))
+    existing_port_calls = set()
+    cursor.execute(
+        f"SELECT portCallId, ata, eta FROM voyages WHERE portCallId IN ({','.join(['%s'] * len(port_call_ids))});",
+        tuple(port_call_ids)
+    )
+    for port_call_id, _, _ in cursor.fetchall():
+        existing_port_calls.add(int(port_call_id))
+
+    for entry in results:
+        new_ata = portman.normalize_to_minute(entry["ata"])
+        values = (
+            entry["imoLloyds"], entry["mmsi"], entry["vesselTypeCode"], entry["vesselName"],
+            entry["prevPort"], entry["portToVisit"], entry["nextPort"], entry["agentName"],
+            entry["shippingCompany"], entry["eta"], new_ata, entry["portAreaCode"], entry["portAreaName"],
+            entry["berthCode"], entry["berthName"], entry["etd"], entry["atd"],
+            entry["passengersOnArrival"], entry["passengersOnDeparture"], entry["crewOnArrival"],
+            entry["crewOnDeparture"]
+        )
+        if entry["portCallId"] not in existing_port_calls:
+            cursor.execute(
+                "INSERT INTO voyages (portCallId, imoLloyds, mmsi, vesselTypeCode, vesselName, prevPort, "
+                "portToVisit, nextPort, agentName, shippingCompany, eta, ata, portAreaCode, portAreaName, "
+                "berthCode, berthName, etd, atd, passengersOnArrival, passengersOnDeparture, crewOnArrival, "
+                f"crewOnDeparture, modified) VALUES ({','.join(['%s'] * 22)}, CURRENT_TIMESTAMP)",
+                (entry["portCallId"],) + values
+            )
+        else:
+            cursor.execute(
+                "UPDATE voyages SET imoLloyds = %s, mmsi = %s, vesselTypeCode = %s, vesselName = %s, "
+                "prevPort = %s, portToVisit = %s, nextPort = %s, agentName = %s, shippingCompany = %s, "
+                "eta = %s, ata = %s, portAreaCode = %s, portAreaName = %s, berthCode = %s, berthName = %s, "
+                "etd = %s, atd = %s, passengersOnArrival = %s, passengersOnDeparture = %s, "
+                "crewOnArrival = %s, crewOnDeparture = %s, modified = CURRENT_TIMESTAMP WHERE portCallId = %s",
+                values + (entry["portCallId"],)
+            )
+    conn.commit()
+    cursor.close()
+
+
+def reset_bench_schema(conn):
+    """(Re)create empty voyages/arrivals/xml_outbox tables in the scratch schema and select it."""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cursor.execute(f"CREATE TABLE {BENCH_SCHEMA}.voyages (LIKE public.voyages INCLUDING ALL)")
+    cursor.execute(f"CREATE TABLE {BENCH_SCHEMA}.arrivals (LIKE public.arrivals INCLUDING ALL)")
+    cursor.execute(f"CREATE TABLE {BENCH_SCHEMA}.xml_outbox (LIKE public.xml_outbox INCLUDING ALL)")
+    cursor.execute(f"SET search_path TO {BENCH_SCHEMA}")
+    conn.commit()
+    cursor.close()
+
+
+def timed_run(writer, results, conn):
+    counting_conn = CountingConnection(conn)
+    started = time.perf_counter()
+    writer(results, counting_conn)
+    return time.perf_counter() - started, counting_conn.counter["round_trips"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark voyages table writes")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated row counts")
+    args = parser.parse_args()
+
+    portman.create_database_and_tables()
+    conn = portman.get_db_connection(DATABASE_CONFIG["dbname"])
+
+    writers = [("row-by-row loop", legacy_save_results_to_db), ("bulk upsert", portman.save_results_to_db)]
+    print(f"{'rows':>7} | {'writer':<16} | {'phase':<7} | {'round trips':>11} | {'wall time':>9}")
+    try:
+        with patch.object(portman, "log"):
+            for size in (int(value) for value in args.sizes.split(",")):
+                for label, writer in writers:
+                    reset_bench_schema(conn)
+                    # First run inserts the snapshot, second run updates it with shifted ETAs and
+                    # the third re-ingests the same snapshot, which should be a no-op
+                    updated = generate_results(size, eta_shift_minutes=30)
+                    for phase, results in (("insert", generate_results(size)),
+                                           ("update", updated),
+                                           ("repeat", updated)):
+                        elapsed, round_trips = timed_run(writer, results, conn)
+                        print(f"{size:>7} | {label:<16} | {phase:<7} | {round_trips:>11} | {elapsed:>8.2f}s")
+    finally:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
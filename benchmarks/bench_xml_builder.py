@@ -0,0 +1,90 @@
+"""
+Benchmark for building EMSWe XML documents.
+
+Compares documents per second of the element-by-element builder with the precompiled template
+builder for each formality type, and checks that both produce byte-identical XML. Validation
+and storage are not included.
+
+Usage:
+    python -m benchmarks.bench_xml_builder [--documents 5000] [--repeat 3]
+"""
+
+import argparse
+import logging
+import time
+
+from lxml import etree
+
+from PortmanXMLConverter.src.digitraffic_adapter import adapt_digitraffic_to_portman
+from PortmanXMLConverter.src.transformer import XMLTransformer
+
+
+def generate_port_calls(count):
+    """Generate `count` port calls in the shape the trigger sends to the converter."""
+    return [{
+        "portCallId": str(5000000 + i),
+        "imoLloyds": str(9000000 + i % 2000),
+        "mmsi": str(230000000 + i),
+        "vesselTypeCode": "20",
+        "vesselName": f"Bench Vessel {i}",
+        "radioCallSign": "OJAA",
+        "prevPort": "FIMHQ",
+        "portToVisit": "FITKU",
+        "portAreaName": "Matkustajasatama",
+        "berthName": "viking1",
+        "eta": "2024-03-13T10:00:00.000+00:00",
+        "ata": "2024-03-13T10:04:00.000+00:00",
+        "etd": "2024-03-13T18:00:00.000+00:00",
+        "passengersOnArrival": i % 300,
+        "crewOnArrival": 40
+    } for i in range(count)]
+
+
+def build_all(transformer, documents, formality_type):
+    return [transformer.portman_to_emswe(document, formality_type) for document in documents]
+
+
+def best_time(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def serialise(root):
+    return etree.tostring(root, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark EMSWe XML document building")
+    parser.add_argument("--documents", type=int, default=5000, help="Documents built per run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    # Per-document INFO logging would dominate both builders
+    logging.disable(logging.INFO)
+    element_builder = XMLTransformer(use_templates=False)
+    template_builder = XMLTransformer(use_templates=True)
+    port_calls = generate_port_calls(args.documents)
+
+    print(f"{'formality':>9} | {'documents':>9} | {'element docs/s':>14} | {'template docs/s':>15} | "
+          f"{'speedup':>7} | {'identical':>9}")
+    for formality_type in ("ATA", "NOA", "VID"):
+        documents = [adapt_digitraffic_to_portman(port_call, formality_type) for port_call in port_calls]
+        identical = all(
+            serialise(element_root) == serialise(template_root)
+            for element_root, template_root in zip(
+                build_all(element_builder, documents, formality_type),
+                build_all(template_builder, documents, formality_type)
+            )
+        )
+        baseline = best_time(build_all, args.repeat, element_builder, documents, formality_type)
+        templated = best_time(build_all, args.repeat, template_builder, documents, formality_type)
+        print(f"{formality_type:>9} | {len(documents):>9} | {len(documents) / baseline:>14.0f} | "
+              f"{len(documents) / templated:>15.0f} | {baseline / templated:>6.2f}x | {str(identical):>9}")
+
+
+if __name__ == "__main__":
+    main()
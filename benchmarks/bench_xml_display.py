@@ -0,0 +1,104 @@
+"""
+Benchmark for formatting EMSWe XML documents for Slack messages.
+
+Compares the minidom pretty-printer format_xml_for_display used before with the bounded
+streaming formatter, for VID and NOA documents of growing size, and checks that both give the
+same output, truncated to the Slack limit and in full. Large documents are made by repeating
+the formality part of a generated document, which keeps the structure realistic for display
+even though the result is not schema-valid.
+
+format_xml_for_display has no caller in the notification path at present, so these numbers
+describe the function itself, not a change in notification latency.
+
+Usage:
+    python -m benchmarks.bench_xml_display [--copies 1 20 200 2000] [--max-length 2500] [--repeat 5]
+"""
+
+import argparse
+import copy
+import logging
+import time
+from xml.dom import minidom
+
+from lxml import etree
+
+from PortmanNotificator.slack_notificator import format_xml_for_display
+from PortmanXMLConverter.src.digitraffic_adapter import adapt_digitraffic_to_portman
+from PortmanXMLConverter.src.transformer import XMLTransformer
+
+PORT_CALL = {
+    "portCallId": "5000000",
+    "imoLloyds": "9606900",
+    "mmsi": "230629000",
+    "vesselTypeCode": "20",
+    "vesselName": "Bench Vessel",
+    "radioCallSign": "OJAA",
+    "prevPort": "FIMHQ",
+    "portToVisit": "FITKU",
+    "portAreaName": "Matkustajasatama",
+    "berthName": "viking1",
+    "eta": "2024-03-13T10:00:00.000+00:00",
+    "etd": "2024-03-13T18:00:00.000+00:00",
+    "passengersOnArrival": 235,
+    "crewOnArrival": 40
+}
+
+
+def legacy_format(xml_content, max_length=2500):
+    """The minidom implementation previously used by format_xml_for_display."""
+    try:
+        pretty_xml = minidom.parseString(xml_content).toprettyxml(indent="  ")
+        pretty_xml = "\n".join([line for line in pretty_xml.split("\n") if line.strip()])
+        if len(pretty_xml) > max_length:
+            return pretty_xml[:max_length] + "\n... (truncated)"
+        return pretty_xml
+    except Exception:
+        if len(xml_content) > max_length:
+            return xml_content[:max_length] + "\n... (truncated)"
+        return xml_content
+
+
+def generate_document(formality_type, copies):
+    """Generate a document with `copies` copies of its formality part."""
+    transformer = XMLTransformer()
+    root = transformer.portman_to_emswe(adapt_digitraffic_to_portman(PORT_CALL, formality_type), formality_type)
+    formality = root[-1]
+    for _ in range(copies - 1):
+        root.append(copy.deepcopy(formality))
+    return etree.tostring(root, pretty_print=True, xml_declaration=True, encoding="UTF-8").decode("utf-8")
+
+
+def best_time(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark formatting XML for Slack display")
+    parser.add_argument("--copies", type=int, nargs="+", default=[1, 20, 200, 2000],
+                        help="Copies of the formality part per document")
+    parser.add_argument("--max-length", type=int, default=2500, help="Display limit in characters")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    print(f"{'formality':>9} | {'size KiB':>8} | {'minidom ms':>10} | {'streaming ms':>12} | "
+          f"{'speedup':>8} | {'identical':>9}")
+    for formality_type in ("VID", "NOA"):
+        for copies in args.copies:
+            document = generate_document(formality_type, copies)
+            identical = (legacy_format(document, args.max_length) == format_xml_for_display(document, args.max_length)
+                         and legacy_format(document, len(document) * 2)
+                         == format_xml_for_display(document, len(document) * 2))
+            legacy = best_time(legacy_format, args.repeat, document, args.max_length)
+            streaming = best_time(format_xml_for_display, args.repeat, document, args.max_length)
+            print(f"{formality_type:>9} | {len(document) / 1024:>8.1f} | {legacy * 1000:>10.2f} | "
+                  f"{streaming * 1000:>12.3f} | {legacy / streaming:>7.1f}x | {str(identical):>9}")
+
+
+if __name__ == "__main__":
+    main()
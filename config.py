@@ -9,13 +9,144 @@ DATABASE_CONFIG = {
     "port": int(os.getenv("DB_PORT", 5432))
 }
 
+# Process-wide PostgreSQL connection pool settings
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+    "max_idle_seconds": int(os.getenv("DB_POOL_MAX_IDLE_SECONDS", 300)),
+    "health_check_interval_seconds": int(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS", 30)),
+    "acquire_timeout_seconds": int(os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", 30))
+}
+
 # Default Azure Storage settings
 AZURE_STORAGE_CONFIG = {
     "connection_string": os.getenv("AzureWebJobsStorage"),
     "container_name": os.getenv("AZURE_STORAGE_CONTAINER_NAME", "emswe-xml-messages"),
 }
 
+# SAS links to stored blobs: validity, minimum remaining validity for a cached link to be
+# reused and the number of links cached per process
+BLOB_SAS_CONFIG = {
+    "expiry_days": int(os.getenv("BLOB_SAS_EXPIRY_DAYS", 7)),
+    "min_remaining_hours": int(os.getenv("BLOB_SAS_MIN_REMAINING_HOURS", 24)),
+    "cache_size": int(os.getenv("BLOB_SAS_CACHE_SIZE", 10000))
+}
+
+# Digitraffic port call API settings
+DIGITRAFFIC_CONFIG = {
+    "url": os.getenv("DIGITRAFFIC_PORT_CALLS_URL", "https://meri.digitraffic.fi/api/port-call/v1/port-calls"),
+    "user": os.getenv("DIGITRAFFIC_USER", "portman-agent"),
+    "incremental": os.getenv("DIGITRAFFIC_INCREMENTAL", "true").lower() == "true",
+    "overlap_seconds": int(os.getenv("DIGITRAFFIC_OVERLAP_SECONDS", 300)),
+    "timeout": float(os.getenv("DIGITRAFFIC_TIMEOUT_SECONDS", 60))
+}
+
+# Number of recently seen timestamp strings whose parsed and formatted values are kept (see
+# datetime_utils)
+DATETIME_CONFIG = {
+    "cache_size": int(os.getenv("DATETIME_CACHE_SIZE", 4096))
+}
+
+# Number of port calls processed and saved per transaction when streaming large inputs
+INGEST_CONFIG = {
+    "batch_size": int(os.getenv("INGEST_BATCH_SIZE", 1000))
+}
+
+# Directory backfill settings: worker processes parsing files (default and the most a request
+# may ask for) and whether to skip imported files
+BACKFILL_CONFIG = {
+    "workers": int(os.getenv("BACKFILL_WORKERS", 1)),
+    "max_workers": int(os.getenv("BACKFILL_MAX_WORKERS", 8)),
+    "resume": os.getenv("BACKFILL_RESUME", "true").lower() == "true"
+}
+
 XML_CONVERTER_CONFIG = {
+    # "http" calls the converter function over HTTP; "inprocess" calls it directly when the
+    # converter is deployed in the same Function App
+    "transport": os.getenv("XML_CONVERTER_TRANSPORT", "http"),
     "function_url": os.getenv("XML_CONVERTER_FUNCTION_URL", "http://localhost:7071/api/emswe-xml-converter"),
-    "function_key": os.getenv("XML_CONVERTER_FUNCTION_KEY", "")
+    "function_key": os.getenv("XML_CONVERTER_FUNCTION_KEY", ""),
+    "timeout": float(os.getenv("XML_CONVERTER_TIMEOUT_SECONDS", 30)),
+    "max_concurrency": int(os.getenv("XML_CONVERTER_MAX_CONCURRENCY", 8)),
+    # Batch endpoint; derived from function_url when not set
+    "batch_function_url": os.getenv("XML_CONVERTER_BATCH_FUNCTION_URL", ""),
+    "batch_size": int(os.getenv("XML_CONVERTER_BATCH_SIZE", 50)),
+    "batch_timeout": float(os.getenv("XML_CONVERTER_BATCH_TIMEOUT_SECONDS", 120)),
+    "max_batch_items": int(os.getenv("XML_CONVERTER_MAX_BATCH_ITEMS", 500)),
+    "upload_concurrency": int(os.getenv("XML_CONVERTER_UPLOAD_CONCURRENCY", 8))
+}
+
+XML_OUTBOX_CONFIG = {
+    "batch_size": int(os.getenv("XML_OUTBOX_BATCH_SIZE", 100)),
+    "max_attempts": int(os.getenv("XML_OUTBOX_MAX_ATTEMPTS", 5)),
+    "retry_backoff_seconds": int(os.getenv("XML_OUTBOX_RETRY_BACKOFF_SECONDS", 60)),
+    "stale_after_seconds": int(os.getenv("XML_OUTBOX_STALE_AFTER_SECONDS", 900))
+}
+
+# Logging: root level and format (used when no handler is installed by the host), per-logger
+# level overrides such as "PortmanXMLConverter=WARNING,PortmanTrigger=DEBUG", and how often
+# full payloads are logged at DEBUG (every Nth payload per kind)
+LOGGING_CONFIG = {
+    "level": os.getenv("LOG_LEVEL", "INFO").upper(),
+    "format": os.getenv("LOG_FORMAT", "text").lower(),
+    "module_levels": os.getenv("LOG_MODULE_LEVELS", ""),
+    "payload_sample_every": int(os.getenv("LOG_PAYLOAD_SAMPLE_EVERY", 100))
+}
+
+# Per-run stage timings and counters of the ingest pipeline and XML outbox dispatch. The summary
+# is logged at the end of each run; with otel_export it is also recorded as OpenTelemetry
+# metrics (sent to Application Insights when azure-monitor-opentelemetry is installed and
+# APPLICATIONINSIGHTS_CONNECTION_STRING is set)
+METRICS_CONFIG = {
+    "enabled": os.getenv("PIPELINE_METRICS_ENABLED", "true").lower() == "true",
+    "otel_export": os.getenv("PIPELINE_METRICS_OTEL_EXPORT", "false").lower() == "true"
+}
+
+# Slack notifications. Blob events are queued in the slack_outbox table and sent by a timer
+# function; events for the same port queued within digest_window_seconds of each other are sent
+# as one digest message of at most max_digest_events events. Messages are sent within the
+# "slack" rate limit, and a drain stops instead of waiting when the budget is used up.
+SLACK_NOTIFICATION_CONFIG = {
+    "enabled": os.getenv("SLACK_WEBHOOK_ENABLED", "false").lower() == "true",
+    "webhook_url": os.getenv("SLACK_WEBHOOK_URL", ""),
+    "channel": os.getenv("SLACK_CHANNEL"),
+    "username": os.getenv("SLACK_USERNAME", "Portman Bot"),
+    "timeout": float(os.getenv("SLACK_TIMEOUT_SECONDS", 10)),
+    "digest_window_seconds": int(os.getenv("SLACK_DIGEST_WINDOW_SECONDS", 60)),
+    "max_digest_events": int(os.getenv("SLACK_MAX_DIGEST_EVENTS", 10)),
+    "batch_size": int(os.getenv("SLACK_OUTBOX_BATCH_SIZE", 200)),
+    "max_attempts": int(os.getenv("SLACK_OUTBOX_MAX_ATTEMPTS", 5)),
+    "retry_backoff_seconds": int(os.getenv("SLACK_OUTBOX_RETRY_BACKOFF_SECONDS", 30)),
+    "stale_after_seconds": int(os.getenv("SLACK_OUTBOX_STALE_AFTER_SECONDS", 300)),
+    # Blob deliveries already notified are remembered for dedupe_ttl_seconds, the most recent
+    # dedupe_cache_size of them also in memory
+    "dedupe_ttl_seconds": int(os.getenv("SLACK_DEDUPE_TTL_SECONDS", 7 * 24 * 3600)),
+    "dedupe_cache_size": int(os.getenv("SLACK_DEDUPE_CACHE_SIZE", 10000))
+}
+
+# Rate limits of outbound APIs. Each limit is a token bucket refilled at per_minute tokens per
+# minute and holding at most burst tokens. With shared enabled the buckets live in the
+# rate_limit_buckets table, so the limit holds across all Function App instances; each instance
+# takes tokens in leases of up to lease_seconds worth of the rate, so most calls are decided in
+# memory. max_wait_seconds is how long a call may wait for a token (0: fail right away).
+RATE_LIMIT_CONFIG = {
+    "shared": os.getenv("RATE_LIMIT_SHARED", "true").lower() == "true",
+    "lease_seconds": float(os.getenv("RATE_LIMIT_LEASE_SECONDS", 5)),
+    "limits": {
+        "slack": {
+            "per_minute": float(os.getenv("SLACK_MAX_MESSAGES_PER_MINUTE", 50)),
+            "burst": int(os.getenv("SLACK_RATE_LIMIT_BURST", 5)),
+            "max_wait_seconds": 0
+        },
+        "digitraffic": {
+            "per_minute": float(os.getenv("DIGITRAFFIC_MAX_REQUESTS_PER_MINUTE", 30)),
+            "burst": int(os.getenv("DIGITRAFFIC_RATE_LIMIT_BURST", 5)),
+            "max_wait_seconds": float(os.getenv("DIGITRAFFIC_RATE_LIMIT_MAX_WAIT_SECONDS", 10))
+        },
+        "openai": {
+            "per_minute": float(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", 60)),
+            "burst": int(os.getenv("OPENAI_RATE_LIMIT_BURST", 5)),
+            "max_wait_seconds": float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS", 30))
+        }
+    }
 }
@@ -0,0 +1,114 @@
+"""
+Shared parsing and formatting of the ISO-8601 timestamps exchanged with Digitraffic.
+
+Used by both the ingest trigger and the XML converter, so it lives outside either package.
+
+Digitraffic sends the same few timestamp shapes (2024-03-13T10:00:00.000+00:00, with a Z suffix,
+with or without milliseconds) over and over, and port calls often share their ETA, ETD and ATA
+values. Parsing goes through datetime.fromisoformat and the results for recently seen strings
+are memoised, so repeated timestamps cost a dictionary lookup.
+
+Formatted values keep the wall-clock time written in the string; a timezone offset is dropped,
+not converted, as the converter has always done.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+from config import DATETIME_CONFIG
+
+XML_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+MINUTE_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:00.000Z"
+DISPLAY_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+
+def parse_iso_datetime(value: str) -> Optional[datetime]:
+    """
+    Parse a full ISO-8601 date and time with seconds, such as 2024-03-13T10:00:00.000+00:00.
+
+    Args:
+        value: Timestamp string; a Z suffix, an offset and fractional seconds are optional
+
+    Returns:
+        The parsed datetime (aware if the string has a Z or an offset), or None if the string is
+        not a timestamp in that form
+    """
+    # Checked before the cache, which cannot hash arbitrary (e.g. list or dict) values
+    if not isinstance(value, str):
+        return None
+    return _parse_iso_datetime(value)
+
+@lru_cache(maxsize=DATETIME_CONFIG["cache_size"])
+def _parse_iso_datetime(value: str) -> Optional[datetime]:
+    # fromisoformat also accepts dates and times without seconds, which callers do not expect
+    if len(value) < 19 or value[10] != 'T' or value[16] != ':':
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def _format_wall_clock(value: str, date_format: str) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    return _format_wall_clock_cached(value, date_format)
+
+@lru_cache(maxsize=DATETIME_CONFIG["cache_size"])
+def _format_wall_clock_cached(value: str, date_format: str) -> Optional[str]:
+    parsed = _parse_iso_datetime(value)
+    if parsed is None:
+        return None
+    return parsed.strftime(date_format)
+
+def to_xml_datetime(value: str) -> Optional[str]:
+    """
+    Format a timestamp as used in EMSWe documents (2024-03-13T10:00:00Z).
+
+    Args:
+        value: ISO-8601 timestamp string
+
+    Returns:
+        Formatted timestamp, or None if the value could not be parsed
+    """
+    return _format_wall_clock(value, XML_DATETIME_FORMAT)
+
+def to_minute_datetime(value: str) -> Optional[str]:
+    """
+    Truncate a timestamp to minute precision (2024-03-13T10:00:00.000Z), as stored for change detection.
+
+    Args:
+        value: ISO-8601 timestamp string
+
+    Returns:
+        Formatted timestamp, or None if the value could not be parsed
+    """
+    return _format_wall_clock(value, MINUTE_DATETIME_FORMAT)
+
+def to_display_datetime(value: str, default: str = "N/A") -> str:
+    """
+    Format a timestamp for log output (2024-03-13 10:00).
+
+    Args:
+        value: ISO-8601 timestamp string
+        default: Returned when the value is missing or cannot be parsed
+
+    Returns:
+        Formatted timestamp or the default
+    """
+    if not value:
+        return default
+    return _format_wall_clock(value, DISPLAY_DATETIME_FORMAT) or default
+
+def get_datetime_cache_stats() -> dict:
+    """Return hit/miss counts and sizes of the parse and format caches."""
+    parse_info = _parse_iso_datetime.cache_info()
+    format_info = _format_wall_clock_cached.cache_info()
+    return {
+        "parse": {"hits": parse_info.hits, "misses": parse_info.misses, "size": parse_info.currsize},
+        "format": {"hits": format_info.hits, "misses": format_info.misses, "size": format_info.currsize}
+    }
+
+def clear_datetime_caches() -> None:
+    """Forget memoised timestamps (e.g. between tests)."""
+    _parse_iso_datetime.cache_clear()
+    _format_wall_clock_cached.cache_clear()
@@ -1,8 +1,9 @@
 import azure.functions as func
 from PortmanTrigger.http_trigger import http_trigger
 from PortmanTrigger.timer_trigger import timer_trigger
-from PortmanXMLConverter.xml_converter import xml_converter
-from PortmanNotificator.slack_notificator import blob_trigger
+from PortmanTrigger.outbox_trigger import outbox_trigger
+from PortmanXMLConverter.xml_converter import xml_converter, xml_converter_batch
+from PortmanNotificator.slack_notificator import blob_trigger, slack_outbox_trigger
 from CargoGenerator.cargo_generator import cargo_generator
 from VesselDetails.vessel_details import vessel_details
 from PortmanTrigger.noa_generator import noa_generator
@@ -15,12 +16,19 @@ app.route(route="http-trigger", auth_level=func.AuthLevel.FUNCTION, methods=["GE
 # Register Timer Trigger
 app.schedule(schedule="0 */15 * * * *", arg_name="portmanTimer", run_on_startup=True)(timer_trigger)
 
+# Register XML Outbox Dispatcher
+app.schedule(schedule="30 * * * * *", arg_name="outboxTimer", run_on_startup=False)(outbox_trigger)
+
 # Register XML Converter
 app.route(route="emswe-xml-converter", auth_level=func.AuthLevel.FUNCTION, methods=["POST"])(xml_converter)
+app.route(route="emswe-xml-converter-batch", auth_level=func.AuthLevel.FUNCTION, methods=["POST"])(xml_converter_batch)
 
 # Register Blob Trigger for Slack notifications
 app.blob_trigger(arg_name="blob", path="emswe-xml-messages/{name}", connection="AzureWebJobsStorage")(blob_trigger)
 
+# Register Slack Outbox Dispatcher
+app.schedule(schedule="15,45 * * * * *", arg_name="slackTimer", run_on_startup=False)(slack_outbox_trigger)
+
 # Register Cargo Generator
 app.route(route="cargo-generator", auth_level=func.AuthLevel.FUNCTION, methods=["POST"])(cargo_generator)
 